@@ -4,6 +4,8 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 
 # setting module of the application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'identity_backend.settings')
+# Served from one long-lived event loop: the Veramo client can keep its async pool
+os.environ.setdefault('VERAMO_ASYNC_SHARED_POOL', 'True')
 
 # Initialize Django first, before loading any app related content like WebSocket routes
 django.setup()
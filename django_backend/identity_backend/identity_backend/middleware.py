@@ -2,7 +2,16 @@ from urllib.parse import parse_qs
 from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from rest_api.models import Profile
+
+import logging
+
+logger = logging.getLogger('rest_api')
 
 """
 Custom middleware to authenticate WebSocket connections with JWTs.
@@ -14,28 +23,53 @@ https://medium.com/@josephmiracle119/authentication-in-websocket-with-django-and
 class JWTAuthMiddleware(BaseMiddleware):
     """
     Called whenever a new WebSocket connection is established.
-    Extracts the JWT from the query string (?token=...) and
-    attaches the authenticated user (or AnonymousUser) to the scope.
+    Extracts the JWT from the query string (?token=...), validates it once and
+    attaches to the scope:
+        scope['user']  TokenUser built from the token claims (or AnonymousUser)
+        scope['did']   the token's 'did' claim if it is still the DID of the
+                       user's (active) profile, else None
+    The profile check is the only database access and is cached for
+    WS_AUTH_CACHE_TTL seconds, so reconnect storms mostly hit the cache.
     """
     async def __call__(self, scope, receive, send):
+        scope['user'], scope['did'] = AnonymousUser(), None
         try:
             query = parse_qs(scope.get('query_string', b'').decode())
             token = (query.get('token') or [None])[0]
-            user = await self.get_user_from_token(token) if token else AnonymousUser()
-            scope['user'] = user
-        except Exception as e:
-            scope['user'] = AnonymousUser()
+            if token:
+                validated = JWTAuthentication().get_validated_token(token)
+                user = TokenUser(validated)
+                profile_did = await get_profile_did(user.id)
+                if profile_did is not None:
+                    claimed = validated.get('did')
+                    scope['user'] = user
+                    scope['did'] = profile_did if claimed in (None, profile_did) else None
+        except (InvalidToken, TokenError) as e:
+            logger.debug(f"WS token rejected: {e}")
         return await super().__call__(scope, receive, send)
 
 
-    @database_sync_to_async
-    def get_user_from_token(self, token):
-        """
-        Validates the JWT and returns the corresponding user.
-        Falls back to AnonymousUser if validation fails.
-        """
-        try:
-            validated = JWTAuthentication().get_validated_token(token)
-            return JWTAuthentication().get_user(validated)
-        except Exception:
-            return AnonymousUser()
\ No newline at end of file
+def profile_cache_key(user_id):
+    return f'ws-profile-did:{user_id}'
+
+
+@database_sync_to_async
+def get_profile_did(user_id):
+    """
+    DID of the active user's profile, None if the user does not exist, is
+    inactive or has no profile / DID.
+    """
+    if user_id is None:
+        return None
+    key = profile_cache_key(user_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached or None
+
+    did = (
+        Profile.objects.filter(user_id=user_id, user__is_active=True)
+        .values_list('did', flat=True).first()
+    )
+    # '' marks a known miss, so unknown users are cached as well
+    cache.set(key, did or '', timeout=settings.WS_AUTH_CACHE_TTL)
+    return did or None
@@ -99,6 +99,78 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 # Django Channels / Redis
 REDIS_URL = os.getenv("REDIS_URL")
 
+# Cache shared by all workers (Redis) when available, per-process memory otherwise.
+# Bounded by MAX_ENTRIES locally / by Redis' maxmemory policy.
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "5000"))},
+        }
+    }
+
+# Login / request challenges: 'signed' (stateless HMAC + used-nonce set in the cache,
+# needs the shared Redis cache when running several nodes) or 'session' (DB session).
+# 'signed' by default only with REDIS_URL: a per-process cache can't stop a replay on another worker
+CHALLENGE_MODE = os.getenv("CHALLENGE_MODE", "signed" if REDIS_URL else "session")
+CHALLENGE_MAX_AGE = int(os.getenv("CHALLENGE_MAX_AGE", "300"))  # seconds
+
+# WebSocket connect: TTL (seconds) of the cached user -> profile DID lookup (identity_backend.middleware)
+WS_AUTH_CACHE_TTL = int(os.getenv("WS_AUTH_CACHE_TTL", "30"))
+# Max frames queued per WebSocket connection before further notifications are dropped
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+# Max frames replayed on reconnect, beyond that the client is asked to reload
+WS_REPLAY_MAX = int(os.getenv("WS_REPLAY_MAX", "500"))
+# Presence registry (rest_api.presence): skip channel layer sends to DIDs without
+# an open connection. Needs the shared Redis cache, off by default without it
+WS_PRESENCE = os.getenv("WS_PRESENCE", "True" if REDIS_URL else "False").lower() == "true"
+WS_PRESENCE_TTL = int(os.getenv("WS_PRESENCE_TTL", "60"))  # seconds
+# Connections tracked per DID (one cache key each), further ones share the presence of those
+WS_PRESENCE_SLOTS = int(os.getenv("WS_PRESENCE_SLOTS", "8"))
+# How long the time a DID was first found without connections is kept (seconds)
+WS_PRESENCE_OFFLINE_TTL = int(os.getenv("WS_PRESENCE_OFFLINE_TTL", "86400"))
+
+# Per-DID cache of GET /api/users/<did>/contexts/ (rest_api.context_cache), seconds
+CONTEXTS_CACHE_TTL = int(os.getenv("CONTEXTS_CACHE_TTL", "300"))
+CONTEXTS_CACHE_STALE_TTL = int(os.getenv("CONTEXTS_CACHE_STALE_TTL", "3600"))
+CONTEXTS_CACHE_LOCK_TTL = int(os.getenv("CONTEXTS_CACHE_LOCK_TTL", "10"))
+
+# Avatar pipeline (rest_api.avatars): square variants in px, WebP + JPEG each
+AVATAR_VARIANT_SIZES = [int(size) for size in env_list("AVATAR_VARIANT_SIZES", "48,128,512")]
+AVATAR_MAX_UPLOAD_SIZE = int(os.getenv("AVATAR_MAX_UPLOAD_SIZE", str(5 * 1024 * 1024)))  # bytes
+AVATAR_MAX_PIXELS = int(os.getenv("AVATAR_MAX_PIXELS", "40000000"))
+AVATAR_WEBP_QUALITY = int(os.getenv("AVATAR_WEBP_QUALITY", "80"))
+AVATAR_JPEG_QUALITY = int(os.getenv("AVATAR_JPEG_QUALITY", "85"))
+
+# Threads for after-commit background jobs (rest_api.tasks), e.g. avatar file cleanup
+BACKGROUND_WORKERS = int(os.getenv("BACKGROUND_WORKERS", "2"))
+
+# Expiry sweeper (rest_api.expiry / sweep_expired_requests): rows per 
+# transaction and idle sleep of --loop, seconds
+EXPIRY_SWEEP_BATCH_SIZE = int(os.getenv("EXPIRY_SWEEP_BATCH_SIZE", "500"))
+EXPIRY_SWEEP_INTERVAL = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "60"))
+
+# Notification outbox (rest_api.outbox / dispatch_notifications): rows per 
+# dispatcher transaction, retries with exponential backoff (seconds), and whether
+# web workers start a dispatch in the background after each commit
+NOTIFICATION_DISPATCH_BATCH_SIZE = int(os.getenv("NOTIFICATION_DISPATCH_BATCH_SIZE", "200"))
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "8"))
+NOTIFICATION_RETRY_BASE = float(os.getenv("NOTIFICATION_RETRY_BASE", "2"))
+NOTIFICATION_RETRY_MAX = float(os.getenv("NOTIFICATION_RETRY_MAX", "300"))
+NOTIFICATION_DISPATCH_ON_COMMIT = os.getenv("NOTIFICATION_DISPATCH_ON_COMMIT", "True").lower() == "true"
+NOTIFICATION_DISPATCH_INTERVAL = float(os.getenv("NOTIFICATION_DISPATCH_INTERVAL", "1"))
+# Seconds a dispatcher owns the rows it claimed while sending them (sent again after that)
+NOTIFICATION_DISPATCH_LEASE = int(os.getenv("NOTIFICATION_DISPATCH_LEASE", "60"))
+# Seconds sent notifications are kept for replay (?since=<seq> on reconnect)
+NOTIFICATION_RETENTION = int(os.getenv("NOTIFICATION_RETENTION", "86400"))
+
 if not DEBUG:
     CHANNEL_LAYERS = {
         "default": {
@@ -240,4 +312,49 @@ GRAPH_MODELS = {
     'graph_models': True,
 }
 
-VERAMO_URL = os.getenv("VERAMO_URL", "http://localhost:3003").rstrip("/")
\ No newline at end of file
+# Verification backend (rest_api.verifiers): Veramo agent over HTTP or in-process EIP-712
+VERIFIER_BACKEND = os.getenv("VERIFIER_BACKEND", "rest_api.verifiers.VeramoVerifier")
+EIP712_CHAIN_ID = int(os.getenv("EIP712_CHAIN_ID", "11155111"))  # Sepolia
+
+VERAMO_URL = os.getenv("VERAMO_URL", "http://localhost:3003").rstrip("/")
+# Veramo agent client (rest_api.veramo_client): timeouts in seconds
+VERAMO_CONNECT_TIMEOUT = float(os.getenv("VERAMO_CONNECT_TIMEOUT", "3.05"))
+VERAMO_READ_TIMEOUT = float(os.getenv("VERAMO_READ_TIMEOUT", "10"))
+VERAMO_MAX_RETRIES = int(os.getenv("VERAMO_MAX_RETRIES", "2"))
+VERAMO_RETRY_BACKOFF = float(os.getenv("VERAMO_RETRY_BACKOFF", "0.2"))
+VERAMO_POOL_SIZE = int(os.getenv("VERAMO_POOL_SIZE", "10"))
+VERAMO_ASYNC_POOL_SIZE = int(os.getenv("VERAMO_ASYNC_POOL_SIZE", "100"))
+# Keep one async pool per event loop (long-lived loops only: set by asgi.py). Without
+# it the async client is opened and closed per call, e.g. for async views under WSGI
+VERAMO_ASYNC_SHARED_POOL = os.getenv("VERAMO_ASYNC_SHARED_POOL", "False").lower() == "true"
+# Serve login / identity creation / request creation with the async views (rest_api.async_api)
+ASYNC_VERAMO_VIEWS = os.getenv("ASYNC_VERAMO_VIEWS", "False").lower() == "true"
+# TTL (seconds) of cached successful credential verifications, 0 disables the cache
+VERAMO_CREDENTIAL_CACHE_TTL = int(os.getenv("VERAMO_CREDENTIAL_CACHE_TTL", "3600"))
+# Credentials per batch verification call (bulk identity import), at most the
+# agent's own VERAMO_BATCH_SIZE (veramo_backend_agent/src/server.js)
+VERAMO_BATCH_SIZE = int(os.getenv("VERAMO_BATCH_SIZE", "25"))
+# Max credentials per bulk identity import request
+IDENTITY_BULK_IMPORT_MAX = int(os.getenv("IDENTITY_BULK_IMPORT_MAX", "100"))
+VERAMO_BREAKER_THRESHOLD = int(os.getenv("VERAMO_BREAKER_THRESHOLD", "5"))
+VERAMO_BREAKER_RESET = float(os.getenv("VERAMO_BREAKER_RESET", "30"))
+
+# GET /api/me/requests/ page size (keyset pagination)
+REQUESTS_PAGE_SIZE = int(os.getenv("REQUESTS_PAGE_SIZE", "200"))
+REQUESTS_PAGE_MAX = int(os.getenv("REQUESTS_PAGE_MAX", "500"))
+
+# Identity decryption pool (rest_api.crypto_pool)
+IDENTITY_DECRYPT_PARALLEL = os.getenv("IDENTITY_DECRYPT_PARALLEL", "True").lower() == "true"
+IDENTITY_DECRYPT_EXECUTOR = os.getenv("IDENTITY_DECRYPT_EXECUTOR", "thread").lower()
+IDENTITY_DECRYPT_WORKERS = int(os.getenv("IDENTITY_DECRYPT_WORKERS", os.cpu_count() or 1))
+IDENTITY_DECRYPT_MAX_CONCURRENCY = int(os.getenv("IDENTITY_DECRYPT_MAX_CONCURRENCY", "4"))
+
+# Derived key (PBKDF2) cache, per process. KDF_CACHE_SIZE=0 disables it.
+KDF_CACHE_SIZE = int(os.getenv("KDF_CACHE_SIZE", "256"))
+KDF_CACHE_TTL = int(os.getenv("KDF_CACHE_TTL", "300"))
+
+# Identity enc_data format for new writes: 2 = per-user master key + HKDF subkeys,
+# 1 = legacy PBKDF2 per identity. Legacy rows are re-encrypted when decrypted
+# with the holder's signature if IDENTITY_KEY_UPGRADE_ON_READ is enabled.
+IDENTITY_ENC_VERSION = int(os.getenv("IDENTITY_ENC_VERSION", "2"))
+IDENTITY_KEY_UPGRADE_ON_READ = os.getenv("IDENTITY_KEY_UPGRADE_ON_READ", "True").lower() == "true"
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Profile, Identity, Request, SharedData
+from .models import Profile, Identity, Request, SharedData, RequestCounters, Notification
 
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'did', 'creation_date', 'latest_access')
@@ -14,9 +14,16 @@ class RequestAdmin(admin.ModelAdmin):
 class SharedDataAdmin(admin.ModelAdmin):
     list_display = ('request', 'created_at', 'enc_data')
 
+class RequestCountersAdmin(admin.ModelAdmin):
+    list_display = ('profile', 'incoming_pending', 'incoming_approved', 'incoming_declined', 'incoming_expired',
+                    'outgoing_pending', 'outgoing_approved', 'outgoing_declined', 'outgoing_expired')
+
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'did', 'created_at', 'attempts', 'next_attempt_at', 'last_error')
+
 admin.site.register(Profile, ProfileAdmin)
 admin.site.register(Identity, IdentityAdmin)
 admin.site.register(Request, RequestAdmin) 
 admin.site.register(SharedData, SharedDataAdmin)
-
-
+admin.site.register(RequestCounters, RequestCountersAdmin)
+admin.site.register(Notification, NotificationAdmin)
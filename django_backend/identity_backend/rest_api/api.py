@@ -1,34 +1,58 @@
 from django.contrib.auth.models import User
+from django.conf import settings
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.core import signing
+from django.core.cache import cache
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.settings import api_settings
 
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from django.db import IntegrityError, transaction
-from django.db.models import Q
 
 from .models import Profile, Identity, Request, SharedData
 
 from .serializers import (
     IdentitySerializer, 
+    IdentityMetadataSerializer,
+    IdentityDecryptSerializer,
+    IdentityBulkImportSerializer,
     MassDeleteSerializer, 
     RequestListSerializer, 
     RequestUpdateSerializer, 
     IdentityActiveSerializer,
-    ContextSerializer
 )
-from .utils import verify_with_veramo, notify_did, to_bytes
+from .utils import notify_did, to_bytes
+from .veramo_client import get_veramo_client
+from .consumers import send_queue_metrics
+from .verifiers import credential_issuer, get_verifier
 from .cryptographic_utils import unwrap_key_w_signature, fernet_encKey
+from .crypto_pool import decrypt_identities, iter_decrypted_identities, encrypt_identities
+from .renderers import NDJSONRenderer, render_line
+from .pagination import KeysetPagination
+from .counters import record_request_created, request_stats
+from .context_cache import get_contexts_entry, absolute_contexts, invalidate_contexts
+from .deletion import delete_identities
+from .tasks import run_in_background
+from .versioning import (
+    make_etag, 
+    etag_matches, 
+    not_modified, 
+    with_etag, 
+    bump_requests_version, 
+    bump_identities_version
+)
 
 import secrets, logging, requests, json, base64
 
@@ -39,9 +63,14 @@ logger = logging.getLogger('rest_api')
 # --------------------------------------------------------------------
 def issue_challenge(session, key):
     """
-    Issue and store a short-lived challenge in session under 'key'
+    Issue a short-lived challenge for 'key' (login_challenge / request_challenge).
+    CHALLENGE_MODE 'signed': HMAC-signed, timestamped nonce, nothing is stored.
+    CHALLENGE_MODE 'session': stored in the session under 'key'.
     Returns the challenge string.
     """
+    if settings.CHALLENGE_MODE == 'signed':
+        return challenge_signer(key).sign(secrets.token_hex(16))
+
     challenge = secrets.token_hex(16)
     session[key] = {"value": challenge, "issued": timezone.now().timestamp()}
     session.modified = True
@@ -50,10 +79,13 @@ def issue_challenge(session, key):
 
 def validate_challenge(session, key, received):
     """
-    Validate a challenge previously stored under 'key' in session.
-    - raises ValidationError if invalid/expired/missing
-    - removes the challenge from session on success or expiry
+    Validate a challenge previously issued for 'key'.
+    - raises ValidationError if invalid/expired/missing/already used
+    - session mode: removes the challenge from session on success or expiry
     """
+    if settings.CHALLENGE_MODE == 'signed':
+        return validate_signed_challenge(key, received)
+
     item = session.get(key)
     if not item: 
         raise ValidationError("Missing challenge")
@@ -63,7 +95,7 @@ def validate_challenge(session, key, received):
     age = timezone.now().timestamp() - issued 
 
     # Expired
-    if age > 300:
+    if age > settings.CHALLENGE_MAX_AGE:
         try: 
             del session[key]
         except KeyError:
@@ -81,6 +113,117 @@ def validate_challenge(session, key, received):
         pass
 
 
+def challenge_signer(key):
+    """
+    Signer for challenges of one purpose (the salt keeps a login challenge from
+    being accepted as a request challenge and vice versa).
+    """
+    return signing.TimestampSigner(salt=f'rest_api.challenge.{key}')
+
+
+def validate_signed_challenge(key, received):
+    """
+    Check signature and age of a signed challenge, then mark its nonce as used
+    in the cache for the rest of its lifetime (one-time use across all nodes 
+    sharing the cache).
+    """
+    if not received or not isinstance(received, str):
+        raise ValidationError("Missing challenge")
+    try:
+        nonce = challenge_signer(key).unsign(received, max_age=settings.CHALLENGE_MAX_AGE)
+    except signing.SignatureExpired:
+        raise ValidationError("Challenge expired.")
+    except signing.BadSignature:
+        raise ValidationError("Challenge mismatch.")
+
+    # cache.add is atomic: only the first use of a nonce succeeds
+    if not cache.add(f'challenge-used:{key}:{nonce}', 1, timeout=settings.CHALLENGE_MAX_AGE):
+        raise ValidationError("Challenge already used.")
+
+
+def login_profile(verified_did):
+    """
+    Find or create the user & profile for a verified DID.
+    Returns (user, profile, created).
+    """
+    try:
+        profile = Profile.objects.select_related('user').get(did=verified_did)
+        user = profile.user
+        profile.save(update_fields=['latest_access'])
+        logger.info(f'Existing user {user.username} authenticated successfully!')
+        return user, profile, False
+    except Profile.DoesNotExist:
+        with transaction.atomic():
+            user = User.objects.create_user(username=verified_did)
+            user.set_unusable_password()
+            user.save()
+            profile = Profile.objects.create(user=user, did=verified_did)
+        logger.info(f'New user created: {user.username}')
+        return user, profile, True
+
+
+def login_response_data(user, profile, verified_did):
+    """
+    Issue the JWT pair (with the 'did' claim) and build the login response body.
+    """
+    refresh = RefreshToken.for_user(user)
+    refresh['did'] = verified_did
+    return {
+        'success': True,
+        'user_id': user.id, 
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+        'profile_created': profile.creation_date,
+        'profile_last_access': profile.latest_access
+    }
+
+
+def parse_request_credential(presentation):
+    """
+    Extract the RequestCredential subject from a verified request VP.
+    Returns (vc, subject) or raises ValidationError with the client message.
+    """
+    vc_list = presentation.get('verifiableCredential') or [] 
+    if not vc_list: 
+        raise ValidationError('No credential in presentation')
+    
+    vc_str = vc_list[0] 
+    vc = json.loads(vc_str) if isinstance(vc_str, str) else vc_str
+
+    types = vc.get('type', []) 
+    if 'RequestCredential' not in types: 
+        raise ValidationError('Unexpected VC type')
+    
+    subject = vc.get('credentialSubject') or {} 
+    if not all([subject.get('requestorDid'), subject.get('holderDid'), subject.get('contextId')]): 
+        raise ValidationError('Incomplete information in the credentialSubject')
+    return vc, subject
+
+
+def new_request_event(req, requestor_did, identity):
+    """
+    WebSocket payload sent to the holder when a request was created.
+    """
+    return { 
+        "event": "new request received", 
+        "request_id": str(req.id), 
+        "from": requestor_did, 
+        "context": { "context": identity.context},
+        "created_at": req.created_at.isoformat(), 
+        "request": RequestListSerializer(req).data,
+    }
+
+
+def error_message(e):
+    """
+    Plain message of a DRF ValidationError raised by the helpers above.
+    """
+    detail = e.detail
+    if isinstance(detail, list) and len(detail) == 1:
+        return str(detail[0])
+    return str(detail)
+
+
 # --------------------------------------------------------------------
 # Views
 # --------------------------------------------------------------------
@@ -88,7 +231,7 @@ def validate_challenge(session, key, received):
 class LoginChallengeView(APIView):
     """
     GET /api/auth/challenge/
-    Issue a login challenge and store it in the session
+    Issue a login challenge (signed, or stored in the session, see CHALLENGE_MODE)
     """
     permission_classes = [AllowAny]
     authentication_classes = []
@@ -100,7 +243,7 @@ class LoginChallengeView(APIView):
 class RequestChallengeView(APIView): 
     """
     GET /api/requests/challenge/
-    Issue a request challenge and store it in the session
+    Issue a request challenge (signed, or stored in the session, see CHALLENGE_MODE)
     """
     def get(self, request, *args, **kwargs): 
         challenge = issue_challenge(request.session, "request_challenge")
@@ -111,8 +254,8 @@ class RequestChallengeView(APIView):
 class UserAuthenticationView(APIView):
     """
     POST /api/auth/authenticate/
-    Receive a Verifiable Presentation, validate the session challenge and 
-    verify the VP through the Veramo backend. If valid, create or update the user 
+    Receive a Verifiable Presentation, validate the challenge and 
+    verify the VP through the configured verifier (Veramo backend by default). If valid, create or update the user 
     and return JWT tokens.
     """
     authentication_classes = []
@@ -123,7 +266,7 @@ class UserAuthenticationView(APIView):
         if not presentation:
             return Response({'error': 'Presentation is missing'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Validate stored session challenge (throw ValidationError on fail)
+        # Validate issued challenge (throw ValidationError on fail)
         vp_challenge = presentation.get('challenge')
         try:
             validate_challenge(request.session, 'login_challenge', vp_challenge)
@@ -132,12 +275,7 @@ class UserAuthenticationView(APIView):
         
         # Verify with Veramo backend agent
         try: 
-            payload = {
-                'presentation': presentation,
-                'challenge': {'value': vp_challenge},
-                'domain': 11155111 # Sepolia 
-            }
-            verification_data = verify_with_veramo('verify-presentation', payload)
+            verification_data = get_verifier().verify_presentation(presentation, vp_challenge)
         except requests.exceptions.RequestException as e:
             logger.error(f'Error calling Veramo service: {e}')
             return Response({'error': 'Could not connect to Veramo service'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
@@ -145,40 +283,19 @@ class UserAuthenticationView(APIView):
         is_verified = verification_data.get('verified')
         verified_did = verification_data.get('issuer')
 
-        request.session['authenticated_did'] = verified_did
+        if settings.CHALLENGE_MODE == 'session':
+            request.session['authenticated_did'] = verified_did
 
         if not is_verified or not verified_did:
             logger.warning("Presentation failed or DID is missing.")
             return Response({'error': 'Presentation verification failed'}, status=status.HTTP_403_FORBIDDEN)
         
         # Find or create user
-        created = False
-        try:
-            profile = Profile.objects.get(did=verified_did)
-            user = profile.user
-            profile.save(update_fields=['latest_access'])
-            logger.info(f'Existing user {user.username} authenticated successfully!')
-        except Profile.DoesNotExist:
-            user = User.objects.create_user(username=verified_did)
-            user.set_unusable_password()
-            user.save()
-            profile = Profile.objects.create(user=user, did=verified_did)
-            created = True
-            logger.info(f'New user created: {user.username}')
+        user, profile, created = login_profile(verified_did)
 
         # Issue JWT token
-        refresh = RefreshToken.for_user(user)
-        refresh['did'] = verified_did
-
         return Response(
-            {
-                'success': True,
-                'user_id': user.id, 
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-                'profile_created': profile.creation_date,
-                'profile_last_access': profile.latest_access
-            }, 
+            login_response_data(user, profile, verified_did), 
             status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
         )
 
@@ -205,15 +322,18 @@ class CreateIdentityProfileView(APIView):
 
         # Verify with Veramo backend agent
         try:
-            result = verify_with_veramo('verify-credential', {'credential': vc})
+            result = get_verifier().verify_credential(vc)
             if not result.get('verified'):
                 return Response({'success': False, 'error': 'Credential invalid'}, status=status.HTTP_400_BAD_REQUEST)    
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            logger.error(f'Error calling Veramo service: {e}')
+            return Response({'error': 'Could not connect to Veramo service'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         except Exception as e:
             logger.exception("Credential verification with Veramo failed.")
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         # Cross-check DID in VC vs JWT claim
-        issuer_did = vc.get('issuer', {}).get('id')
+        issuer_did = credential_issuer(vc)
         jwt_did = request.auth.get('did')
         if not jwt_did or issuer_did != jwt_did:
             logger.warning(f"Issuer DID ({issuer_did}) does not match authenticated DID ({jwt_did})")
@@ -261,30 +381,248 @@ class CreateIdentityProfileView(APIView):
         return Response(read_serializer.data, status=status.HTTP_201_CREATED)
             
 
+@method_decorator(csrf_exempt, name='dispatch')
+class BulkIdentityImportView(APIView):
+    """
+    POST /api/identity/bulk/
+    Import many Verifiable Credentials at once with a single signature.
+    Body: { "signature": "...", "credentials": [<vc>, ...] }
+
+    All credentials are verified in batch calls to the Veramo agent, the valid
+    ones are encrypted on the crypto pool and inserted with one bulk_create in 
+    a single transaction. Returns a per-item status list (same order as the 
+    input): created | invalid | conflict.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = IdentityBulkImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        signature = serializer.validated_data['signature']
+        credentials = serializer.validated_data['credentials']
+
+        profile = request.user.profile
+        jwt_did = request.auth.get('did')
+        if not jwt_did or jwt_did != profile.did:
+            return Response({'error': 'Authenticated DID missing'}, status=status.HTTP_403_FORBIDDEN)
+
+        results = [None] * len(credentials)
+        candidates = []
+
+        # Structural checks before the (batched) agent round trip
+        for index, vc in enumerate(credentials):
+            if isinstance(vc, str):
+                try:
+                    vc = json.loads(vc)
+                except ValueError:
+                    vc = None
+            subject = vc.get('credentialSubject') if isinstance(vc, dict) else None
+            issuer_did = credential_issuer(vc)
+
+            if not isinstance(subject, dict) or not subject:
+                results[index] = {'status': 'invalid', 'error': 'Incomplete credential data'}
+            elif issuer_did != jwt_did:
+                results[index] = {'status': 'invalid', 'error': 'DID in VC does not match the authenticated DID'}
+            elif not (subject.get('context') or '').strip():
+                results[index] = {'status': 'invalid', 'error': 'Context is required.'}
+            else:
+                candidates.append((index, vc, subject))
+
+        try:
+            verifications = get_verifier().verify_credentials([vc for _, vc, _ in candidates])
+        except requests.exceptions.RequestException as e:
+            logger.error(f'Error calling Veramo service: {e}')
+            return Response({'error': 'Could not connect to Veramo service'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        # Conflicts with existing rows and duplicates within the batch
+        seen = set(
+            Identity.objects
+                .filter(user=profile, context__in={subject['context'] for _, _, subject in candidates})
+                .values_list('context', 'description')
+        )
+        identities, raw_data_list = [], []
+        for (index, vc, subject), verification in zip(candidates, verifications):
+            if not verification.get('verified'):
+                results[index] = {'status': 'invalid', 'error': 'Credential invalid'}
+                continue
+
+            key = (subject['context'], subject.get('description') or '')
+            if key in seen:
+                results[index] = {'status': 'conflict', 'error': 'Identity already exists for this context/description'}
+                continue
+            seen.add(key)
+
+            identities.append(Identity(
+                user=profile,
+                context=key[0],
+                description=key[1],
+                is_active=True,
+                salt=secrets.token_bytes(16),
+            ))
+            raw_data_list.append({k: v for k, v in subject.items() if k not in ('id', 'context', 'description')})
+            results[index] = {'status': 'created'}
+
+        encrypt_identities(identities, raw_data_list, signature)
+        created = self.insert(identities)
+
+        pending = iter(identities)
+        for result in results:
+            if result['status'] == 'created':
+                identity = next(pending)
+                if identity.id in created:
+                    result['id'] = str(identity.id)
+                else:
+                    result.update(status='conflict', error='Identity already exists for this context/description')
+
+        return Response({
+            'created': len(created), 
+            'results': [{'index': index, **result} for index, result in enumerate(results)],
+        }, status=status.HTTP_200_OK)
+
+    def insert(self, identities):
+        """
+        Insert all identities with one bulk_create. If a concurrent request 
+        created one of them in the meantime, retry row by row (savepoint each)
+        so only the conflicting items are reported.
+        Returns the set of inserted ids.
+        """
+        if not identities:
+            return set()
+        # bulk_create sends no post_save: bump the contexts version and drop 
+        # the cached contexts explicitly
+        profile = identities[0].user
+        try:
+            with transaction.atomic():
+                Identity.objects.bulk_create(identities)
+                bump_identities_version(profile.pk)
+                invalidate_contexts(profile.did)
+            return {identity.id for identity in identities}
+        except IntegrityError:
+            logger.info("Bulk identity insert conflicted, retrying per item.")
+
+        created = set()
+        with transaction.atomic():
+            for identity in identities:
+                try:
+                    with transaction.atomic():
+                        Identity.objects.bulk_create([identity])
+                    created.add(identity.id)
+                except IntegrityError:
+                    pass
+            if created:
+                bump_identities_version(profile.pk)
+                invalidate_contexts(profile.did)
+        return created
+
+
+async def stream_decrypted_identities(request, identities, signature):
+    """
+    Async generator for the NDJSON mode: one line per identity, emitted as soon
+    as it is decrypted (the pool futures are awaited, so ASGI sends each line
+    right away instead of buffering the body). 'index' is the position in the
+    full (newest first) list so the client can restore the order.
+
+    No database access here: legacy rows are upgraded by a background job once
+    the stream ends (also when the client goes away early).
+    """
+    decrypted = {}
+    try:
+        async for index, identity, data in iter_decrypted_identities(identities, signature):
+            decrypted[identity.id] = data
+            serializer = IdentitySerializer(
+                identity, context={'signature': signature, 'decrypted': decrypted, 'request': request })
+            yield render_line({'index': index, 'id': identity.id, 'identity': serializer.data})
+    finally:
+        if settings.IDENTITY_KEY_UPGRADE_ON_READ and decrypted:
+            run_in_background(Identity.upgrade_keys, identities, decrypted, signature)
+
+
+def decrypted_identities_response(request, identities, signature):
+    """
+    Decrypt the given identities (on the crypto pool), upgrade legacy 
+    ciphertexts and return the serialized list.
+    Clients sending 'Accept: application/x-ndjson' get a streamed response 
+    instead (see stream_decrypted_identities).
+    """
+    identities = list(identities)
+    if request.accepted_renderer.format == NDJSONRenderer.format:
+        return StreamingHttpResponse(
+            stream_decrypted_identities(request, identities, signature),
+            content_type=NDJSONRenderer.media_type,
+        )
+
+    decrypted = decrypt_identities(identities, signature)
+    if settings.IDENTITY_KEY_UPGRADE_ON_READ:
+        Identity.upgrade_keys(identities, decrypted, signature)
+
+    serializer = IdentitySerializer(
+        identities, many=True, context={'signature': signature, 'decrypted': decrypted, 'request': request })
+    return Response({'identities': serializer.data}, status=status.HTTP_200_OK)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class GetMyIdentitiesView(APIView):
     """
+    GET /api/me/identities/
+    Returns the caller's identities as metadata only (no key derivation).
+
     POST /api/me/identities/
-    Returns the caller's identities.
+    Returns the caller's identities incl. decrypted data.
+    With IDENTITY_DECRYPT_PARALLEL enabled the per-identity key derivation and
+    decryption run on the shared crypto pool instead of one after another.
+    Legacy (v1) rows are re-encrypted with the caller's master key on the way.
+    Supports 'Accept: application/x-ndjson' for a streamed response.
     """
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+
+    def get_queryset(self, request):
+        return (
+            Identity.objects
+                .select_related('user')
+                .filter(user=request.user.profile)
+                .order_by('-issued')
+        )
+    
+    def get(self, request):
+        serializer = IdentityMetadataSerializer(self.get_queryset(request), many=True, context={'request': request})
+        return Response({'identities': serializer.data}, status=status.HTTP_200_OK)
     
     def post(self, request):    
         signature = request.data.get('signature')
         if not signature:
             return Response({'error': 'Missing signature'}, status=status.HTTP_400_BAD_REQUEST)
         
-        did = request.user.profile.did
-        ids = (
+        return decrypted_identities_response(request, self.get_queryset(request), signature)
+    
+
+@method_decorator(csrf_exempt, name='dispatch')
+class DecryptIdentitiesView(APIView):
+    """
+    POST /api/me/identities/decrypt/
+    Decrypt only the requested identities of the caller.
+    Body: { "signature": "...", "ids": ["<uuid>", ...] }
+    Supports 'Accept: application/x-ndjson' for a streamed response.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+
+    def post(self, request):
+        serializer = IdentityDecryptSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        signature = serializer.validated_data['signature']
+
+        identities = (
             Identity.objects
                 .select_related('user')
-                .filter(user__did=did)
+                .filter(user=request.user.profile, id__in=ids)
                 .order_by('-issued')
         )
-        
-        serializer = IdentitySerializer(ids, many=True, context={'signature': signature, 'request': request })
-        return Response({'identities': serializer.data}, status=status.HTTP_200_OK)
+        return decrypted_identities_response(request, identities, signature)
     
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -310,7 +648,8 @@ class UpdateIdentityActiveView(APIView):
 class IdentityDeleteView(APIView):
     """
     POST /api/identities/mass-delete/
-    Delete multiple identities that belong to the authenticated user.
+    Delete multiple identities that belong to the authenticated user, with 
+    set-based cascades (see deletion.py). Returns the number actually deleted.
     """
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
@@ -325,32 +664,36 @@ class IdentityDeleteView(APIView):
         if not profile:
             return Response({'error': 'Profile does not exist'}, status=status.HTTP_400_BAD_REQUEST)
         
-        qs = Identity.objects.filter(user=profile, id__in=ids)
-        if not qs.exists():
-            return Response({'error': 'No matching identities found'}, status=status.HTTP_404_NOT_FOUND)
-
         with transaction.atomic():
-            qs.delete()
+            deleted = delete_identities(profile, ids)
 
-        return Response({'success': True, 'deletion_count': len(ids)}, status=status.HTTP_200_OK)
+        if not deleted:
+            return Response({'error': 'No matching identities found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({'success': True, 'deletion_count': deleted}, status=status.HTTP_200_OK)
     
 
 class GetContexts(APIView):
     """
     GET /api/users/<path:did>/contexts/
+    Active identity contexts of a user, served from the per-DID cache 
+    (context_cache.py). Supports If-None-Match (ETag from the profile's 
+    identities_version).
     """
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request, did, *args, **kwargs):    
-        try: 
-            profile = Profile.objects.get(did=did)
-        except Profile.DoesNotExist:
+        entry = get_contexts_entry(did)
+        if entry is None:
             return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        identities = Identity.objects.filter(user=profile, is_active=True)
-        serializer = ContextSerializer(identities, many=True, context={'request': request})
-        return Response({'contexts': serializer.data}, status=status.HTTP_200_OK)
+        etag = entry['etag']
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        contexts = absolute_contexts(entry['contexts'], request)
+        return with_etag(Response({'contexts': contexts}, status=status.HTTP_200_OK), etag)
 
 
 @method_decorator(csrf_exempt, name='dispatch') 
@@ -367,7 +710,7 @@ class CreateRequestView(APIView):
         if not presentation:
             return Response({'error': 'Presentation is missing'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Validate session challenge
+        # Validate issued challenge
         try:
             vp_challenge = presentation.get('challenge')
             validate_challenge(request.session, 'request_challenge', vp_challenge)
@@ -376,12 +719,7 @@ class CreateRequestView(APIView):
 
         # Verify with Veramo backend agent
         try:
-            payload = { 
-                'presentation': presentation, 
-                'challenge': {'value': vp_challenge}, 
-                'domain': 11155111 # Sepolia 
-            }
-            verification_data = verify_with_veramo('verify-presentation', payload) 
+            verification_data = get_verifier().verify_presentation(presentation, vp_challenge) 
         except requests.exceptions.RequestException as e: 
             logger.error(f'Error calling Veramo service: {e}') 
             return Response({'error': 'Could not connect to Veramo service'}, status=status.HTTP_503_SERVICE_UNAVAILABLE) 
@@ -391,27 +729,17 @@ class CreateRequestView(APIView):
             return Response({'error': 'Presentation verification failed'}, status=status.HTTP_403_FORBIDDEN) 
         
         # Extract the VC from the VP
-        vc_list = presentation.get('verifiableCredential') or [] 
-        if not vc_list: 
-            return Response({'error': 'No credential in presentation'}, status=status.HTTP_400_BAD_REQUEST) 
-        
-        vc_str = vc_list[0] 
-        vc = json.loads(vc_str) 
-
-        types = vc.get('type', []) 
-        if 'RequestCredential' not in types: 
-            return Response({'error': 'Unexpected VC type'}, status=status.HTTP_400_BAD_REQUEST) 
+        try:
+            vc, subject = parse_request_credential(presentation)
+        except ValidationError as e:
+            return Response({'error': error_message(e)}, status=status.HTTP_400_BAD_REQUEST) 
         
-        subject = vc.get('credentialSubject') or {} 
         requestor_did = subject.get('requestorDid') 
         holder_did = subject.get('holderDid') 
         context_id = subject.get('contextId') 
         purpose = subject.get('purpose') 
         requestor_signature = subject.get('requestorSignature') or request.data.get('signature')
         
-        if not all([requestor_did, holder_did, context_id]): 
-            return Response({'error': 'Incomplete information in the credentialSubject'}, status=status.HTTP_400_BAD_REQUEST) 
-        
         # Profiles and context exist?
         try: 
             requestor_profile = Profile.objects.get(did=requestor_did) 
@@ -427,36 +755,32 @@ class CreateRequestView(APIView):
             identity = Identity.objects.get(id=context_id, user=holder_profile) 
         except Identity.DoesNotExist: return Response({'error': 'Requested context not found for holder'}, status=status.HTTP_404_NOT_FOUND) 
         
-        req = Request.objects.create( 
-            requestor = requestor_profile, 
-            holder=holder_profile, 
-            context=identity, 
-            purpose=purpose, 
-            status=Request.Status.PENDING, 
-            challenge=vp_challenge, 
-            presentation=vc,
-            requestor_signature=requestor_signature,    
-        ) 
-        
-        # Notify holder via WebSocket
-        notify_did(
-            holder_did, 
-            { 
-                "event": "new request received", 
-                "request_id": str(req.id), 
-                "from": requestor_did, 
-                "context": { "context": identity.context},
-                "created_at": req.created_at.isoformat(), 
-            }
-        ) 
+        with transaction.atomic():
+            req = Request.objects.create( 
+                requestor = requestor_profile, 
+                holder=holder_profile, 
+                context=identity, 
+                purpose=purpose, 
+                status=Request.Status.PENDING, 
+                challenge=vp_challenge, 
+                presentation=vc,
+                requestor_signature=requestor_signature,    
+            ) 
+            record_request_created(req)
+        
+            # Notify holder via WebSocket (outbox row, sent after commit)
+            notify_did(holder_did, new_request_event(req, requestor_did, identity))
         
         return Response({'success': True, 'request_id': str(req.id)}, status=status.HTTP_201_CREATED) 
     
     
 class GetRequests(APIView): 
     """
-    GET /api/me/requests/
-    List requests where the authenticated user is requestor or holder.
+    GET /api/me/requests/?direction=&status=&limit=&cursor=&count=true
+    List requests where the authenticated user is holder (direction=incoming),
+    requestor (direction=outgoing) or either (default), newest first, with 
+    keyset pagination (see pagination.KeysetPagination). Supports 
+    If-None-Match (ETag from the profile's requests_version).
     """
     authentication_classes = [JWTAuthentication] 
     permission_classes = [IsAuthenticated] 
@@ -466,25 +790,35 @@ class GetRequests(APIView):
         if not profile:
             return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND) 
         
-        qs = (Request.objects.select_related('requestor', 'holder', 'context').filter(
-            Q(requestor=profile) | Q(holder=profile))
-        )
+        # Conditional GET: answered from the profile row alone
+        etag = make_etag('requests', profile, profile.requests_version)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        direction = request.query_params.get('direction')
+        if direction not in (None, '', 'incoming', 'outgoing'):
+            return Response({'error': "direction must be 'incoming' or 'outgoing'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One index-ordered scan per role instead of requestor OR holder
+        qs = Request.objects.select_related('requestor', 'holder', 'context')
+        scans = []
+        if direction != 'outgoing':
+            scans.append(qs.filter(holder=profile))
+        if direction != 'incoming':
+            scans.append(qs.filter(requestor=profile))
         
         status_code = request.query_params.get('status') 
         if status_code: 
-            qs = qs.filter(status=status_code) 
+            scans = [scan.filter(status=status_code) for scan in scans]
 
-        total = qs.count() 
-
-        limit = request.query_params.get('limit')
+        paginator = KeysetPagination()
         try:
-            limit = int(limit) if limit is not None else 200
-        except ValueError:
-            limit = 200
+            page = paginator.paginate_queryset(scans, request, view=self)
+        except ValidationError as e:
+            return Response({'error': error_message(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        page = qs.order_by('-created_at')[:limit]  
         data = RequestListSerializer(page, many=True).data   
-        return Response({ 'count': total, 'results': data }, status=status.HTTP_200_OK ) 
+        return with_etag(paginator.get_paginated_response(data), etag)
     
 
 class DeleteRequestView(APIView):
@@ -503,8 +837,25 @@ class DeleteRequestView(APIView):
         instance = get_object_or_404(
             Request, id=request_id, requestor=profile, status=Request.Status.PENDING,
         )
+        # Counters are decremented by the post_delete receiver (signals.py)
         instance.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class RequestStatsView(APIView):
+    """
+    GET /api/me/requests/stats/
+    Pending / approved / declined counts of the authenticated user's requests,
+    as holder (incoming) and requestor (outgoing).
+    """
+    authentication_classes = [JWTAuthentication] 
+    permission_classes = [IsAuthenticated] 
+
+    def get(self, request, *args, **kwargs):
+        profile = request.user.profile
+        if not profile:
+            return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(request_stats(profile), status=status.HTTP_200_OK)
  
             
 class UpdateRequestView(APIView): 
@@ -529,20 +880,24 @@ class UpdateRequestView(APIView):
         if not serializer.is_valid(): 
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        instance = serializer.save() 
+        with transaction.atomic():
+            instance = serializer.save() 
+            # Serialized once: response body and schema v2 event payload
+            data = RequestListSerializer(instance).data
             
-        notify_did(
-            instance.requestor.did, 
-            { 
-                "event": "request answer received", 
-                "request_id": str(instance.id), 
-                "status": instance.get_status_display(), 
-                "expires_at": instance.expires_at.isoformat() 
-                if instance.expires_at else None, 
-                "reason": instance.reason, 
-            },
-        ) 
-        return Response(RequestListSerializer(instance).data, status=status.HTTP_200_OK) 
+            notify_did(
+                instance.requestor.did, 
+                { 
+                    "event": "request answer received", 
+                    "request_id": str(instance.id), 
+                    "status": instance.get_status_display(), 
+                    "expires_at": instance.expires_at.isoformat() 
+                    if instance.expires_at else None, 
+                    "reason": instance.reason, 
+                    "request": data,
+                },
+            ) 
+        return Response(data, status=status.HTTP_200_OK) 
     
 
 class RetrieveSharedDataView(APIView):
@@ -562,9 +917,13 @@ class RetrieveSharedDataView(APIView):
         except Request.DoesNotExist:
             return Response({'error': 'No approved request found.'}, status=status.HTTP_404_NOT_FOUND)
 
+        if req.status == Request.Status.EXPIRED:
+            return Response({'error': 'Access expired.'}, status=status.HTTP_403_FORBIDDEN)
+
         if req.status != Request.Status.APPROVED:
             return Response({'error': 'Request is not approved.'}, status=status.HTTP_403_FORBIDDEN)
         
+        # Not swept yet (expiry.py)
         if req.expires_at and req.expires_at <= timezone.now():
             return Response({'error': 'Access expired.'}, status=status.HTTP_403_FORBIDDEN)
         
@@ -605,25 +964,53 @@ class DeleteSharedDataView(APIView):
             return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
         
         sd = get_object_or_404(
-            SharedData.objects.select_related('request', 'request__holder', 'request__requestor'),
+            SharedData.objects.select_related('request', 'request__holder', 'request__requestor', 'request__context'),
             request__id=request_id,
             request__holder=profile,
         )
         req = sd.request
-        sd.delete()
+        with transaction.atomic():
+            sd.delete()
+
+            if req.status == Request.Status.APPROVED:
+                req.expires_at = timezone.now()
+                req.reason = 'Access revoked by holder'
+                req.save(update_fields=['expires_at', 'reason'])
+                bump_requests_version(req.holder_id, req.requestor_id)
+
+            notify_did(req.requestor.did, {
+                "event": "access revoked",
+                "request_id": str(req.id),
+                "status": req.get_status_display(),
+                "expires_at": req.expires_at.isoformat() if req.expires_at else None,
+                "reason": req.reason,
+                "request": RequestListSerializer(req).data,
+            })
 
-        if req.status == Request.Status.APPROVED:
-            req.expires_at = timezone.now()
-            req.reason = 'Access revoked by holder'
-            req.save(update_fields=['expires_at', 'reason'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-        notify_did(req.requestor.did, {
-            "event": "access revoked",
-            "request_id": str(req.id),
-            "status": req.get_status_display(),
-            "expires_at": req.expires_at.isoformat() if req.expires_at else None,
-            "reason": req.reason,
-        })
 
-        return Response(status=status.HTTP_204_NO_CONTENT)
- 
\ No newline at end of file
+class VeramoMetricsView(APIView):
+    """
+    GET /api/veramo/metrics/
+    Admin only: per-endpoint call counts, error counts and latency of the 
+    Veramo agent client in this worker process, plus the circuit breaker state.
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_veramo_client().metrics(), status=status.HTTP_200_OK)
+
+
+class WebSocketMetricsView(APIView):
+    """
+    GET /api/ws/metrics/
+    Admin only: WebSocket send queue counters of this worker process (open
+    connections, queued / max queued frames, sent, coalesced and dropped).
+    """
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(send_queue_metrics(), status=status.HTTP_200_OK)
@@ -0,0 +1,303 @@
+"""
+Native async variants of the Veramo-bound endpoints.
+
+Same contract as the sync views in api.py (UserAuthenticationView,
+CreateIdentityProfileView, CreateRequestView), but the agent round trip runs on
+the shared async connection pool (VeramoClient.apost, through the
+configured verifier) and the profile /
+identity lookups use the async ORM, so a single ASGI process can keep many
+verifications in flight without tying up a thread per request. Work that is
+inherently sync (session store, PBKDF2 + INSERT, user creation) is delegated
+with sync_to_async.
+
+Enabled with ASYNC_VERAMO_VIEWS (see urls.py).
+
+Documentation:
+https://docs.djangoproject.com/en/5.2/topics/async/
+"""
+from django.conf import settings
+from django.http import JsonResponse
+from django.views import View
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from asgiref.sync import sync_to_async
+
+from rest_framework import status
+from rest_framework.exceptions import ValidationError, AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .models import Profile, Identity, Request
+from .serializers import IdentitySerializer
+from .verifiers import credential_issuer, get_verifier
+from .utils import notify_did
+from .counters import record_request_created
+from .api import (
+    validate_challenge,
+    login_profile,
+    login_response_data,
+    parse_request_credential,
+    new_request_event,
+    error_message,
+)
+
+import requests, json, logging
+
+logger = logging.getLogger('rest_api')
+
+
+# --------------------------------------------------------------------
+# Helper functions
+# --------------------------------------------------------------------
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return JsonResponse(data, status=status_code, encoder=DjangoJSONEncoder, safe=False)
+
+
+def error_response(message, status_code):
+    return json_response({'error': message}, status_code)
+
+
+def json_body(request):
+    """
+    Parse a JSON request body, {} if empty or invalid.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def authenticate_jwt(request):
+    """
+    Async counterpart of JWTAuthentication: token validation is CPU only, the
+    user lookup goes through the ORM.
+    Returns (user, validated_token) or raises AuthenticationFailed.
+    """
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = auth.get_raw_token(header) if header else None
+    if raw_token is None:
+        raise AuthenticationFailed('Authentication credentials were not provided.')
+    try:
+        validated = auth.get_validated_token(raw_token)
+    except (InvalidToken, TokenError) as e:
+        raise AuthenticationFailed(str(e))
+    user = await sync_to_async(auth.get_user)(validated)
+    return user, validated
+
+
+class AsyncJWTView(View):
+    """
+    Base view: authenticates the JWT before dispatching to the async handler
+    and exposes request.user / request.auth like the DRF views do.
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            request.user, request.auth = await authenticate_jwt(request)
+        except AuthenticationFailed as e:
+            return json_response({'detail': str(e.detail)}, status.HTTP_401_UNAUTHORIZED)
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def verify_presentation(presentation, challenge):
+    """
+    Verify a VP with the configured verifier (Veramo agent over the async pool
+    by default).
+    Returns (verification_data, None) or (None, error JsonResponse).
+    """
+    try:
+        data = await get_verifier().averify_presentation(presentation, challenge)
+        return data, None
+    except requests.exceptions.RequestException as e:
+        logger.error(f'Error calling Veramo service: {e}')
+        return None, error_response('Could not connect to Veramo service', status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+# --------------------------------------------------------------------
+# Views
+# --------------------------------------------------------------------
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncUserAuthenticationView(View):
+    """
+    POST /api/auth/authenticate/ (async)
+    See api.UserAuthenticationView.
+    """
+    async def post(self, request, *args, **kwargs):
+        presentation = json_body(request).get('presentation')
+        if not presentation or not isinstance(presentation, dict):
+            return error_response('Presentation is missing', status.HTTP_400_BAD_REQUEST)
+
+        vp_challenge = presentation.get('challenge')
+        try:
+            await sync_to_async(validate_challenge)(request.session, 'login_challenge', vp_challenge)
+        except ValidationError as e:
+            return error_response(error_message(e), status.HTTP_400_BAD_REQUEST)
+
+        verification_data, error = await verify_presentation(presentation, vp_challenge)
+        if error:
+            return error
+
+        is_verified = verification_data.get('verified')
+        verified_did = verification_data.get('issuer')
+
+        if not is_verified or not verified_did:
+            logger.warning("Presentation failed or DID is missing.")
+            return error_response('Presentation verification failed', status.HTTP_403_FORBIDDEN)
+
+        if settings.CHALLENGE_MODE == 'session':
+            await sync_to_async(request.session.__setitem__)('authenticated_did', verified_did)
+
+        user, profile, created = await sync_to_async(login_profile)(verified_did)
+        # Token issuance writes the outstanding token (blacklist app)
+        data = await sync_to_async(login_response_data)(user, profile, verified_did)
+        return json_response(data, status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCreateIdentityProfileView(AsyncJWTView):
+    """
+    POST /api/identity/ (async, multipart)
+    See api.CreateIdentityProfileView.
+    """
+    async def post(self, request, *args, **kwargs):
+        vc = request.POST.get('credential')
+        try:
+            vc = json.loads(vc) if isinstance(vc, str) else vc
+        except ValueError:
+            vc = None
+
+        avatar = request.FILES.get('avatar')
+        if not vc or not isinstance(vc, dict):
+            return error_response('Missing credential', status.HTTP_400_BAD_REQUEST)
+
+        try:
+            result = await get_verifier().averify_credential(vc)
+            if not result.get('verified'):
+                return json_response({'success': False, 'error': 'Credential invalid'}, status.HTTP_400_BAD_REQUEST)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            logger.error(f'Error calling Veramo service: {e}')
+            return error_response('Could not connect to Veramo service', status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            logger.exception("Credential verification with Veramo failed.")
+            return error_response(str(e), status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        issuer_did = credential_issuer(vc)
+        jwt_did = request.auth.get('did')
+        if not jwt_did or issuer_did != jwt_did:
+            logger.warning(f"Issuer DID ({issuer_did}) does not match authenticated DID ({jwt_did})")
+            return error_response('DID in VC does not match the authenticated DID', status.HTTP_403_FORBIDDEN)
+
+        signature = request.POST.get('signature')
+        if not signature:
+            return error_response('Missing signature', status.HTTP_400_BAD_REQUEST)
+
+        subject_data = vc.get('credentialSubject', {})
+        if not isinstance(subject_data, dict) or not subject_data:
+            return error_response('Incomplete credential data', status.HTTP_400_BAD_REQUEST)
+
+        try:
+            user_profile = await Profile.objects.aget(user=request.user)
+        except Profile.DoesNotExist:
+            return error_response('No profile exists for authenticated user', status.HTTP_400_BAD_REQUEST)
+
+        identity_data = {
+            'context': subject_data.get('context'),
+            'description': subject_data.get('description'),
+            'is_active': True,
+            'raw_data': {k: v for k, v in subject_data.items() if k not in ('id', 'context', 'description')},
+            'avatar': avatar
+        }
+
+        # Validation, key derivation and INSERT are sync (CPU + DB)
+        def save_identity():
+            serializer = IdentitySerializer(
+                data=identity_data, context={'signature': signature, 'user': user_profile, 'request': request })
+            if not serializer.is_valid():
+                return serializer.errors, status.HTTP_400_BAD_REQUEST
+            try:
+                identity = serializer.save()
+            except IntegrityError:
+                return {'error': 'Identity already exists for this context/description'}, status.HTTP_409_CONFLICT
+            return IdentitySerializer(identity, context={'request': request}).data, status.HTTP_201_CREATED
+
+        data, status_code = await sync_to_async(save_identity)()
+        return json_response(data, status_code)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCreateRequestView(AsyncJWTView):
+    """
+    POST /api/requests/ (async)
+    See api.CreateRequestView.
+    """
+    async def post(self, request, *args, **kwargs):
+        body = json_body(request)
+        presentation = body.get('presentation')
+        if not presentation or not isinstance(presentation, dict):
+            return error_response('Presentation is missing', status.HTTP_400_BAD_REQUEST)
+
+        vp_challenge = presentation.get('challenge')
+        try:
+            await sync_to_async(validate_challenge)(request.session, 'request_challenge', vp_challenge)
+        except ValidationError as e:
+            return error_response(error_message(e), status.HTTP_400_BAD_REQUEST)
+
+        verification_data, error = await verify_presentation(presentation, vp_challenge)
+        if error:
+            return error
+
+        if not verification_data.get('verified'):
+            logger.warning("Request presentation verification failed.")
+            return error_response('Presentation verification failed', status.HTTP_403_FORBIDDEN)
+
+        try:
+            vc, subject = parse_request_credential(presentation)
+        except ValidationError as e:
+            return error_response(error_message(e), status.HTTP_400_BAD_REQUEST)
+
+        requestor_did = subject.get('requestorDid')
+        holder_did = subject.get('holderDid')
+        context_id = subject.get('contextId')
+        requestor_signature = subject.get('requestorSignature') or body.get('signature')
+
+        try:
+            requestor_profile = await Profile.objects.aget(did=requestor_did)
+        except Profile.DoesNotExist:
+            return error_response('Requestor profile does not exist', status.HTTP_404_NOT_FOUND)
+
+        try:
+            holder_profile = await Profile.objects.aget(did=holder_did)
+        except Profile.DoesNotExist:
+            return error_response('Identity holder profile does not exist', status.HTTP_404_NOT_FOUND)
+
+        try:
+            identity = await Identity.objects.aget(id=context_id, user=holder_profile)
+        except (Identity.DoesNotExist, ValueError, DjangoValidationError):
+            return error_response('Requested context not found for holder', status.HTTP_404_NOT_FOUND)
+
+        # INSERT, counter update and notification in one transaction (sync)
+        @transaction.atomic
+        def create_request():
+            req = Request.objects.create(
+                requestor=requestor_profile,
+                holder=holder_profile,
+                context=identity,
+                purpose=subject.get('purpose'),
+                status=Request.Status.PENDING,
+                challenge=vp_challenge,
+                presentation=vc,
+                requestor_signature=requestor_signature,
+            )
+            record_request_created(req)
+            notify_did(holder_did, new_request_event(req, requestor_did, identity))
+            return req
+
+        req = await sync_to_async(create_request)()
+
+        return json_response({'success': True, 'request_id': str(req.id)}, status.HTTP_201_CREATED)
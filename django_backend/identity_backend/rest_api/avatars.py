@@ -0,0 +1,138 @@
+"""
+Avatar processing: validate the upload, normalize it and store fixed-size
+WebP / JPEG variants under content-hashed names.
+
+- validation: size limit, decodable JPEG / PNG / WebP / GIF, pixel limit
+  (checked before decoding, protects against decompression bombs)
+- EXIF orientation applied, then the image is re-encoded from pixels only,
+  so no EXIF / GPS / ICC metadata of the original upload is kept
+- square center crop per size in AVATAR_VARIANT_SIZES, one WebP and one JPEG
+- names are 'avatars/<sha256 of the bytes>.<ext>': a name never changes its
+  content, so variants are served with immutable cache headers (views.py)
+
+Identity.avatar points at the largest JPEG variant (the raw upload is not
+stored), Identity.avatar_variants holds the map
+    {'<size>': {'webp': '<name>', 'jpeg': '<name>'}, ...}
+
+Documentation:
+https://pillow.readthedocs.io/en/stable/reference/ImageOps.html
+"""
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework.exceptions import ValidationError
+
+import hashlib, io, logging
+
+logger = logging.getLogger('rest_api')
+
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF'}
+VARIANT_FORMATS = (('webp', 'WEBP', 'webp'), ('jpeg', 'JPEG', 'jpg'))
+
+
+def open_avatar(upload):
+    """
+    Validate an uploaded file and return the decoded, upright RGB image.
+    Raises ValidationError with a client message.
+    """
+    if upload.size > settings.AVATAR_MAX_UPLOAD_SIZE:
+        raise ValidationError(f'Avatar exceeds {settings.AVATAR_MAX_UPLOAD_SIZE // (1024 * 1024)} MB.')
+    try:
+        upload.seek(0)
+        image = Image.open(upload)
+        if image.format not in ALLOWED_FORMATS:
+            raise ValidationError('Unsupported avatar format.')
+        width, height = image.size
+        if width * height > settings.AVATAR_MAX_PIXELS:
+            raise ValidationError('Avatar dimensions are too large.')
+        image.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ValidationError('Invalid image file.')
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Flatten transparency on white (JPEG has no alpha)
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'WEBP':
+        image.save(buffer, 'WEBP', quality=settings.AVATAR_WEBP_QUALITY, method=6)
+    else:
+        image.save(buffer, 'JPEG', quality=settings.AVATAR_JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def variant_name(data, ext):
+    return f'avatars/{hashlib.sha256(data).hexdigest()}.{ext}'
+
+
+def store_files(files):
+    """
+    Save {name: bytes} of render_variants(); names are content hashes, so 
+    identical variants are stored once.
+    """
+    for name, data in files.items():
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(data))
+
+
+def render_variants(image):
+    """
+    Encode all variants of an image opened by open_avatar() without storing
+    them. Returns (main_name, variants, files) where files is {name: bytes},
+    for store_files() once the identity referencing them is committed.
+    """
+    variants, files = {}, {}
+    for size in sorted(settings.AVATAR_VARIANT_SIZES):
+        resized = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        variants[str(size)] = {}
+        for key, fmt, ext in VARIANT_FORMATS:
+            data = encode(resized, fmt)
+            name = variant_name(data, ext)
+            files[name] = data
+            variants[str(size)][key] = name
+    main_name = variants[str(max(settings.AVATAR_VARIANT_SIZES))]['jpeg']
+    return main_name, variants, files
+
+
+def process_avatar(upload):
+    """
+    Build and store all variants of an upload.
+    Returns (main_name, variants) for Identity.avatar / Identity.avatar_variants.
+    """
+    main_name, variants, files = render_variants(open_avatar(upload))
+    store_files(files)
+    return main_name, variants
+
+
+def variant_paths(variants):
+    """
+    Relative URLs of a variant map (served by views.avatar_variant).
+    """
+    if not variants:
+        return None
+    return {
+        size: {key: reverse('avatar_variant', args=[name.rsplit('/', 1)[-1]]) for key, name in formats.items()}
+        for size, formats in variants.items()
+    }
+
+
+def variant_urls(variants, request):
+    """
+    Absolute URLs of a variant map for API responses.
+    """
+    paths = variant_paths(variants)
+    if not paths or request is None:
+        return paths
+    return {
+        size: {key: request.build_absolute_uri(path) for key, path in formats.items()}
+        for size, formats in paths.items()
+    }
@@ -1,101 +1,149 @@
 from channels.generic.websocket import AsyncWebsocketConsumer 
 from channels.db import database_sync_to_async
+from django.conf import settings
 from urllib.parse import parse_qs
-from rest_framework_simplejwt.tokens import UntypedToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-import re, json, logging
+from .outbox import group_name, replay, set_consumer_loop
+from .presence import mark_online, mark_offline, heartbeat
+
+import asyncio, json, logging
 
 logger = logging.getLogger(__name__)
 
+# Events of which only the count matters to the client while they are queued:
+# repeated ones are collapsed into a single {'event': ..., 'count': n, 'seq': s}
+# frame. It carries the highest seq of the merged events but none of their 
+# payloads: clients refetch on it. The frame keeps its queue position, so it
+# can go out ahead of frames with lower seqs: clients resume from the highest
+# seq they received (max, not the last one)
+COALESCE_EVENTS = {'new request received'}
+
+# Send queue counters of this worker process (single event loop, no lock needed)
+SEND_QUEUE_METRICS = {'connections': 0, 'queued': 0, 'max_queued': 0, 'sent': 0, 'coalesced': 0, 'dropped': 0}
+
+
+def send_queue_metrics():
+    return dict(SEND_QUEUE_METRICS)
+
+
+class OutgoingFrame:
+    """
+    Queued frame; count > 1 once later events were coalesced into it.
+    """
+    __slots__ = ('event', 'text', 'seq', 'count')
+
+    def __init__(self, event, text, seq):
+        self.event = event
+        self.text = text
+        self.seq = seq
+        self.count = 1
+
 
 class BackendConsumer(AsyncWebsocketConsumer):
     """
     Handle the incoming WebSocket connection.
     Steps:
         1. Extract 'did' from the URL kwargs
-        2. Extract 'token' from the query string
-        3. Validate token & extract 'user_id'
-        4. Ensure DID in URL matches DID in user profile
-        5. Accept connection and add client to group
+        2. Ensure the connection was authenticated (JWTAuthMiddleware put the
+           token user and the verified profile DID into the scope)
+        3. Ensure DID in URL matches DID in user profile
+        4. Register presence, accept connection and add client to group
+        5. With ?since=<seq>: replay the notifications sent after <seq> 
+           (or ask the client to reload if they are not available anymore)
+
+    ?v=2 selects notification schema version 2 (outbox.V2_FIELDS). Its 
+    clients get a 'resync required' frame instead of coalesced summaries and
+    dropped notices, which lack the payloads they apply in place.
+
+    Notifications are not sent from the channel layer handler: they go into
+    a bounded per-connection queue (WS_SEND_QUEUE_SIZE) drained by a sender 
+    task, so a slow client only ever holds a fixed number of frames. Repeated
+    COALESCE_EVENTS still waiting in the queue are merged into one count-only
+    frame with the highest seq (the client has to refetch), other frames are
+    dropped while the queue is full (the client is told how many).
+    Frames carry the per-DID sequence number; live frames already replayed
+    are skipped. A merged frame is sent at the position of the first merged
+    event, so seqs are not always increasing: clients track max(seq) for 
+    ?since=<seq>.
 
     Documentation:
     https://django-rest-framework-simplejwt.readthedocs.io/en/latest/rest_framework_simplejwt.html
     https://channels.readthedocs.io/en/latest/index.html
     """
+    version = 1
+
     async def connect(self):        
-        from django.contrib.auth import get_user_model
-        from .models import Profile 
-        User = get_user_model()
-
-        # get user 
-        @database_sync_to_async
-        def get_user_by_id(user_id):
-            try: 
-                return User.objects.get(id=user_id)
-            except User.DoesNotExist:
-                return None
-
-        # ensure profile DID is the one requested
-        @database_sync_to_async
-        def user_did_matches(user, did_url):
-            try:
-                profile = Profile.objects.get(user=user)
-                return profile.did == did_url
-            except Profile.DoesNotExist:
-                return False
-        
         # step 1
         did = self.scope["url_route"]["kwargs"]["did"]
 
-        # step 2 
-        query = parse_qs(self.scope.get("query_string", b"").decode())
-        token_list = query.get("token", [])
-        token = token_list[0] if token_list else None
-
-        if not did or not token_list:
-            logger.warning("WS connection denied: did or token missing.")
+        # step 2
+        user = self.scope.get("user")
+        if not did or not user or not user.is_authenticated:
+            logger.warning("WS connection denied: did or valid token missing.")
             await self.close(code=4401)
             return 
         
         # step 3
-        try:
-            validated = UntypedToken(token)
-            user_id = validated.get("user_id")
-
-            if not user_id:
-                logger.warning("WS connect denied: token missing user_id.")
-                await self.close(code=4401)
-                return
-        except (InvalidToken, TokenError) as e:
-            logger.warning("WS connect denied: invalid token: %s.", e)
-            await self.close(code=4401)
-            return
-        
-        user = await get_user_by_id(user_id)
-        if not user:
-            logger.warning("WS connect denied: user not found. user_id=%s", user_id)
-            await self.close(code=4401)
-            return
-        
-        match = await user_did_matches(user, did)
-        if not match:
-            logger.warning("WS connect denied: DID mismatch. user_id=%s did=%s", user_id, did)
+        if self.scope.get("did") != did:
+            logger.warning("WS connect denied: DID mismatch. user_id=%s did=%s", user.id, did)
             await self.close(code=4403)
             return 
         
-        # step 5
+        # step 4
         self.did = did
-        sanitized_did = re.sub(r'[^a-zA-Z0-9-._]+', '_', did)
-        self.group_name = f"user_{sanitized_did}"
+        self.group_name = group_name(did)
+        # Notification schema: ?v=2 adds the full request to request events
+        self.version = 2 if self.query_int("v") == 2 else 1
 
         if self.channel_layer is None:
             logger.error("WS connect failed: channel_layer is None.")
             await self.close(code=1011)
             return
 
+        # In-process channel layer: the outbox sends have to run on this loop
+        set_consumer_loop(asyncio.get_running_loop())
+        self.start_sender()
+        if settings.WS_PRESENCE:
+            self.presence_slot = await mark_online(did, self.channel_name)
+            self.presence = asyncio.create_task(self.presence_loop())
         await self.channel_layer.group_add(self.group_name, self.channel_name)
         await self.accept()
 
+        # step 5 (channel layer messages are handled once connect() returns,
+        # after the replayed frames)
+        since = self.query_int("since")
+        if since is not None and since >= 0:
+            await self.replay_missed(since)
+
+
+    async def presence_loop(self):
+        """
+        Keep the connection's presence slot alive while it is open.
+        """
+        while True:
+            await asyncio.sleep(settings.WS_PRESENCE_TTL / 3)
+            try:
+                self.presence_slot = await heartbeat(self.did, self.channel_name, self.presence_slot)
+            except Exception as e:
+                logger.warning("Presence heartbeat failed: %s", e)
+
+
+    def query_int(self, name):
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            return int(query[name][0])
+        except (KeyError, IndexError, ValueError):
+            return None
+
+
+    async def replay_missed(self, since):
+        frames, last_seq, complete = await database_sync_to_async(replay)(self.did, since, version=self.version)
+        if complete:
+            for _, text in frames:
+                await self.send(text_data=text)
+        else:
+            await self.send(text_data=json.dumps({"event": "resync required", "seq": last_seq}))
+        self.last_seq = last_seq
+
 
     async def disconnect(self, code):
         """
@@ -104,10 +152,91 @@ class BackendConsumer(AsyncWebsocketConsumer):
         if hasattr(self, "group_name") and self.channel_layer:
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
+        if getattr(self, "presence", None):
+            self.presence.cancel()
+            self.presence = None
+            await mark_offline(self.did, self.channel_name, self.presence_slot)
+
+        if getattr(self, "sender", None):
+            self.sender.cancel()
+            SEND_QUEUE_METRICS['connections'] -= 1
+            SEND_QUEUE_METRICS['queued'] -= self.queue.qsize()
+            self.sender = None
+
+    
+    def start_sender(self):
+        self.queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.coalescing = {}
+        self.dropped = 0
+        self.last_seq = 0
+        self.sender = asyncio.create_task(self.send_loop())
+        SEND_QUEUE_METRICS['connections'] += 1
+
     
     async def notify(self, event):
         """
-        Helper to call from other parts of the app to send notifications to the client.
+        Channel layer handler (outbox dispatcher): queue the pre-serialized 
+        frame for this connection.
         """
-        message = event.get('message', {})
-        await self.send(text_data=json.dumps(message))
+        if not getattr(self, "sender", None):
+            return
+        name, seq = event.get('event'), event.get('seq')
+        # Messages sent before frames were pre-serialized carry the payload only
+        text = (self.version >= 2 and event.get('text_v2')) or event.get('text') or json.dumps(event.get('message', {}))
+
+        if seq is not None:
+            if seq <= self.last_seq:
+                return  # replayed already
+            self.last_seq = seq
+
+        queued = self.coalescing.get(name)
+        if queued is not None:
+            queued.count += 1
+            queued.seq = seq
+            SEND_QUEUE_METRICS['coalesced'] += 1
+            return
+
+        frame = OutgoingFrame(name, text, seq)
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            SEND_QUEUE_METRICS['dropped'] += 1
+            return
+        if name in COALESCE_EVENTS:
+            self.coalescing[name] = frame
+
+        SEND_QUEUE_METRICS['queued'] += 1
+        SEND_QUEUE_METRICS['max_queued'] = max(SEND_QUEUE_METRICS['max_queued'], self.queue.qsize())
+
+
+    async def send_loop(self):
+        """
+        Sender task: one frame at a time, at the pace of the client.
+        """
+        while True:
+            frame = await self.queue.get()
+            SEND_QUEUE_METRICS['queued'] -= 1
+            if self.coalescing.get(frame.event) is frame:
+                del self.coalescing[frame.event]
+
+            text = frame.text
+            if frame.count > 1:
+                # Payloads of the merged events are gone, seq is the last one
+                summary = {"event": frame.event, "count": frame.count}
+                if self.version >= 2:
+                    # v2 clients apply payloads in place: a count is no use to them
+                    summary = {"event": "resync required"}
+                if frame.seq is not None:
+                    summary["seq"] = frame.seq
+                text = json.dumps(summary)
+            await self.send(text_data=text)
+            SEND_QUEUE_METRICS['sent'] += 1
+
+            if self.dropped and self.queue.empty():
+                # Let the client resync instead of silently missing events
+                dropped, self.dropped = self.dropped, 0
+                if self.version >= 2:
+                    await self.send(text_data=json.dumps({"event": "resync required", "seq": self.last_seq}))
+                else:
+                    await self.send(text_data=json.dumps({"event": "notifications dropped", "count": dropped}))
@@ -0,0 +1,137 @@
+"""
+Per-DID cache of the public contexts payload (GET /api/users/<did>/contexts/).
+
+Popular holders are read far more often than they change their identities,
+so the serialized contexts (avatar URLs kept relative, made absolute per
+request) and the ETag are cached under the holder's DID: a hit needs no
+database access at all.
+
+Invalidation: every Identity change that is visible in the payload (create,
+delete, is_active / avatar update, bulk import) calls invalidate_contexts(),
+which sets a new generation token for the DID once the transaction has 
+committed. Entries carry the generation they were built for and only count
+as a hit while it is current, so a rebuild that read the database before the
+commit but stores after the invalidation is never served (it is not stored
+at all, nor as the stale copy, if the generation changed meanwhile).
+
+Stampede protection: after an invalidation only the worker that wins the
+rebuild lock (cache.add) queries the database; the others keep serving the
+previous payload from the longer-lived stale copy until the new one is stored.
+
+Settings:
+    CONTEXTS_CACHE_TTL        lifetime of a fresh entry (seconds)
+    CONTEXTS_CACHE_STALE_TTL  lifetime of the stale copy used during rebuilds
+    CONTEXTS_CACHE_LOCK_TTL   max time a rebuild may hold the lock
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Profile, Identity
+from .versioning import make_etag
+from .avatars import variant_paths
+
+import hashlib, logging, secrets
+
+logger = logging.getLogger('rest_api')
+
+
+def contexts_key(did):
+    return 'contexts:' + hashlib.sha256(did.encode()).hexdigest()
+
+
+def build_contexts_entry(did):
+    """
+    Load the payload from the database. None if there is no profile for did.
+    """
+    try:
+        profile = Profile.objects.get(did=did)
+    except Profile.DoesNotExist:
+        return None
+
+    identities = Identity.objects.filter(user=profile, is_active=True)
+    return {
+        'etag': make_etag('contexts', profile, profile.identities_version),
+        'contexts': [
+            {
+                'id': str(identity.id),
+                'context': identity.context,
+                'description': identity.description,
+                'avatar': identity.avatar.url if identity.avatar else None,
+                'avatar_variants': variant_paths(identity.avatar_variants),
+            }
+            for identity in identities
+        ],
+    }
+
+
+def generation_key(did):
+    return contexts_key(did) + ':generation'
+
+
+def new_generation():
+    return secrets.token_hex(8)
+
+
+def get_contexts_entry(did):
+    """
+    Cached {'etag', 'contexts', 'generation'} for did, or None if the profile
+    does not exist.
+    """
+    key, gen_key = contexts_key(did), generation_key(did)
+    cached = cache.get_many([key, gen_key])
+    entry, generation = cached.get(key), cached.get(gen_key)
+    if entry is not None and generation is not None and entry.get('generation') == generation:
+        return entry
+
+    if generation is None:
+        cache.add(gen_key, new_generation(), timeout=settings.CONTEXTS_CACHE_STALE_TTL)
+        generation = cache.get(gen_key)
+
+    lock_key = key + ':lock'
+    if not cache.add(lock_key, 1, timeout=settings.CONTEXTS_CACHE_LOCK_TTL):
+        # Another worker is rebuilding: serve the previous payload if any
+        stale = cache.get(key + ':stale')
+        if stale is not None:
+            return stale
+        return build_contexts_entry(did)
+
+    try:
+        entry = build_contexts_entry(did)
+        if entry is not None:
+            entry['generation'] = generation
+            # Invalidated while building: the payload may predate that commit
+            if cache.get(gen_key) == generation:
+                cache.set(key, entry, timeout=settings.CONTEXTS_CACHE_TTL)
+                cache.set(key + ':stale', entry, timeout=settings.CONTEXTS_CACHE_STALE_TTL)
+        return entry
+    finally:
+        cache.delete(lock_key)
+
+
+def invalidate_contexts(did):
+    """
+    Start a new generation for did after the current transaction commits (so
+    a concurrent rebuild cannot cache the pre-commit state).
+    """
+    if not did:
+        return
+    gen_key = generation_key(did)
+    transaction.on_commit(lambda: cache.set(gen_key, new_generation(), timeout=settings.CONTEXTS_CACHE_STALE_TTL))
+
+
+def absolute_contexts(contexts, request):
+    """
+    Copy of the cached contexts with absolute avatar / variant URLs for this request.
+    """
+    return [
+        {
+            **item,
+            'avatar': request.build_absolute_uri(item['avatar']) if item['avatar'] else None,
+            'avatar_variants': {
+                size: {key: request.build_absolute_uri(path) for key, path in formats.items()}
+                for size, formats in item['avatar_variants'].items()
+            } if item.get('avatar_variants') else None,
+        }
+        for item in contexts
+    ]
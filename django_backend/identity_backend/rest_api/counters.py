@@ -0,0 +1,151 @@
+"""
+Incremental maintenance of RequestCounters.
+
+Every write that creates a Request, changes its status or deletes it calls one
+of the record_* helpers inside the same transaction, so the counters move
+atomically with the base table. Updates are relative (F() expressions) and 
+never read-modify-write, so concurrent requests touching the same profile
+don't lose increments.
+
+Deletes, including cascades from Identity / Profile deletion, are recorded 
+by the post_delete receiver in signals.py, mass deletes (deletion.py) go 
+through the same record_requests_deleted(). The repair_request_counters
+command recomputes everything from the base table.
+"""
+from django.db.models import F, Count
+
+from .models import Request, RequestCounters
+from .versioning import bump_requests_version
+
+INCOMING, OUTGOING = 'incoming', 'outgoing'
+
+STATUS_SUFFIX = {
+    Request.Status.PENDING: 'pending',
+    Request.Status.APPROVED: 'approved',
+    Request.Status.DECLINED: 'declined',
+    Request.Status.EXPIRED: 'expired',
+}
+
+
+def counter_field(role, status):
+    return f'{role}_{STATUS_SUFFIX[status]}'
+
+
+def counter_fields():
+    return [counter_field(role, status) for role in (INCOMING, OUTGOING) for status in STATUS_SUFFIX]
+
+
+def apply_deltas(profile_id, deltas, create=True):
+    """
+    Add deltas ({field: n}) to the counters row of a profile. The row is 
+    created on first use; decrements never create rows (the profile may be
+    in the middle of being deleted).
+    """
+    deltas = {field: n for field, n in deltas.items() if n}
+    if not deltas:
+        return
+    updates = {field: F(field) + n for field, n in deltas.items()}
+    if RequestCounters.objects.filter(profile_id=profile_id).update(**updates) or not create:
+        return
+    RequestCounters.objects.get_or_create(profile_id=profile_id)
+    RequestCounters.objects.filter(profile_id=profile_id).update(**updates)
+
+
+def record_transition(req, old_status, new_status):
+    """
+    Move one request from old_status to new_status (None = not existing) for
+    both the holder (incoming) and the requestor (outgoing), and bump both 
+    request list versions.
+    """
+    for role, profile_id in ((INCOMING, req.holder_id), (OUTGOING, req.requestor_id)):
+        deltas = {}
+        if old_status in STATUS_SUFFIX:
+            deltas[counter_field(role, old_status)] = -1
+        if new_status in STATUS_SUFFIX:
+            field = counter_field(role, new_status)
+            deltas[field] = deltas.get(field, 0) + 1
+        apply_deltas(profile_id, deltas, create=new_status is not None)
+    bump_requests_version(req.holder_id, req.requestor_id)
+
+
+def record_request_created(req):
+    record_transition(req, None, req.status)
+
+
+def record_request_status(req, old_status):
+    if old_status != req.status:
+        record_transition(req, old_status, req.status)
+
+
+def record_request_deleted(req):
+    record_requests_deleted([{'holder_id': req.holder_id, 'requestor_id': req.requestor_id, 'status': req.status, 'n': 1}])
+
+
+def record_requests_transition(reqs, old_status, new_status):
+    """
+    Set-based variant of record_transition() for a batch of requests that all
+    moved from old_status to new_status (e.g. expiry sweeps).
+    """
+    deltas = {}
+    for req in reqs:
+        for role, profile_id in ((INCOMING, req.holder_id), (OUTGOING, req.requestor_id)):
+            fields = deltas.setdefault(profile_id, {})
+            for status, n in ((old_status, -1), (new_status, 1)):
+                field = counter_field(role, status)
+                fields[field] = fields.get(field, 0) + n
+
+    for profile_id, fields in deltas.items():
+        apply_deltas(profile_id, fields)
+    if deltas:
+        bump_requests_version(*deltas)
+
+
+def record_requests_deleted(rows):
+    """
+    Set-based variant of record_request_deleted() for mass deletes.
+    rows: aggregates [{'holder_id', 'requestor_id', 'status', 'n'}, ...]
+    """
+    deltas = {}
+    for row in rows:
+        if row['status'] not in STATUS_SUFFIX:
+            continue
+        for role, profile_id in ((INCOMING, row['holder_id']), (OUTGOING, row['requestor_id'])):
+            fields = deltas.setdefault(profile_id, {})
+            field = counter_field(role, row['status'])
+            fields[field] = fields.get(field, 0) - row['n']
+
+    for profile_id, fields in deltas.items():
+        apply_deltas(profile_id, fields, create=False)
+    if deltas:
+        bump_requests_version(*deltas)
+
+
+def request_stats(profile):
+    """
+    Counters of a profile as {'incoming': {...}, 'outgoing': {...}}.
+    """
+    counters = RequestCounters.objects.filter(profile=profile).first()
+    return {
+        role: {
+            suffix: getattr(counters, f'{role}_{suffix}', 0) if counters else 0
+            for suffix in STATUS_SUFFIX.values()
+        }
+        for role in (INCOMING, OUTGOING)
+    }
+
+
+def compute_counters(profile_ids=None):
+    """
+    Recompute counters from the base table.
+    Returns {profile_id: {field: n}} for profiles with at least one request.
+    """
+    results = {}
+    for role, column in ((INCOMING, 'holder_id'), (OUTGOING, 'requestor_id')):
+        qs = Request.objects.order_by()
+        if profile_ids is not None:
+            qs = qs.filter(**{f'{column}__in': profile_ids})
+        for row in qs.values(column, 'status').annotate(n=Count('id')):
+            if row['status'] in STATUS_SUFFIX:
+                fields = results.setdefault(row[column], {})
+                fields[counter_field(role, row['status'])] = row['n']
+    return results
@@ -0,0 +1,242 @@
+"""
+Bounded worker pool for the CPU-heavy identity crypto (PBKDF2 + Fernet).
+
+Every identity is encrypted with its own salt, so decrypting a list of N
+identities means N independent key derivations. Instead of running them one
+after another in the request thread, they are fanned out to a shared pool and
+the results are put back in the original order.
+
+Settings:
+    IDENTITY_DECRYPT_EXECUTOR         'thread' (default) or 'process'
+    IDENTITY_DECRYPT_WORKERS          size of the shared pool (per process)
+    IDENTITY_DECRYPT_MAX_CONCURRENCY  max jobs a single request keeps in flight
+"""
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .cryptographic_utils import decrypt_json, encrypt, derive_master_key, get_identity_fernet, enc_data_version, ENC_DATA_V2
+from .utils import to_bytes
+
+import asyncio, threading, logging, json
+
+logger = logging.getLogger('rest_api')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Lazily create the shared executor (one per worker process).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = max(1, settings.IDENTITY_DECRYPT_WORKERS)
+            if settings.IDENTITY_DECRYPT_EXECUTOR == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='identity-crypto')
+        return _executor
+
+
+def run_bounded(fn, arg_list, limit=None):
+    """
+    Submit fn(*args) for every entry of arg_list to the shared executor, keeping
+    at most 'limit' jobs of this call in flight at once.
+
+    Yields (index, result) pairs in completion order; index refers to the
+    position in arg_list so callers can restore the original order.
+    Exceptions raised by fn are re-raised to the caller.
+    """
+    executor = get_executor()
+    limit = max(1, limit or settings.IDENTITY_DECRYPT_MAX_CONCURRENCY)
+    jobs = iter(enumerate(arg_list))
+    pending = {}
+
+    def submit_next():
+        try:
+            index, args = next(jobs)
+        except StopIteration:
+            return
+        pending[executor.submit(fn, *args)] = index
+
+    for _ in range(limit):
+        submit_next()
+
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                submit_next()
+                yield index, future.result()
+    finally:
+        # Consumer stopped early (client gone, exception): drop queued work
+        for future in pending:
+            future.cancel()
+
+
+async def arun_bounded(fn, arg_list, limit=None):
+    """
+    Async variant of run_bounded() for code running on the event loop 
+    (streamed responses under ASGI): the pool futures are awaited instead of
+    blocking the loop. Same ordering, bound and cancellation rules.
+    """
+    executor = get_executor()
+    limit = max(1, limit or settings.IDENTITY_DECRYPT_MAX_CONCURRENCY)
+    jobs = iter(enumerate(arg_list))
+    pending = {}
+
+    def submit_next():
+        try:
+            index, args = next(jobs)
+        except StopIteration:
+            return
+        pending[asyncio.wrap_future(executor.submit(fn, *args))] = index
+
+    for _ in range(limit):
+        submit_next()
+
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                submit_next()
+                yield index, future.result()
+    finally:
+        # Cancelling the wrapper cancels the pool future if it has not started
+        for future in pending:
+            future.cancel()
+
+
+def run_ordered(fn, arg_list, limit=None):
+    """
+    Same as run_bounded() but returns the list of results in input order.
+    """
+    results = [None] * len(arg_list)
+    for index, result in run_bounded(fn, arg_list, limit):
+        results[index] = result
+    return results
+
+
+# --------------------------------------------------------------------
+# Identity helpers
+# --------------------------------------------------------------------
+
+def decrypt_identity_payload(enc_data, signature, salt, master_salt=None, master_key=None):
+    """
+    Worker job: decrypt a single identity ciphertext.
+    Mirrors Identity.retrieve_decrypted_data() but only takes plain bytes, so it
+    can run in a process pool without touching the ORM. With the master key 
+    derived up front, v2 ciphertexts only need the cheap HKDF step.
+    Returns None if decryption fails.
+    """
+    try:
+        if master_key is not None and enc_data_version(enc_data) == 2:
+            return json.loads(get_identity_fernet(master_key, salt).decrypt(enc_data[len(ENC_DATA_V2):]).decode())
+        return decrypt_json(enc_data, signature.encode(), salt, master_salt)
+    except Exception as e:
+        logger.debug(f"decrypt failed: {e}")
+        return None
+
+
+def master_keys(identities, signature):
+    """
+    Master keys of the owners of the v2 rows, {kdf_salt: key}: derived once
+    here instead of in every worker (the PBKDF2 stretch is the expensive part).
+    """
+    keys = {}
+    for identity in identities:
+        master_salt = to_bytes(identity.user.kdf_salt)
+        if master_salt and master_salt not in keys and enc_data_version(identity.enc_data) == 2:
+            keys[master_salt] = derive_master_key(signature.encode(), master_salt)
+    return keys
+
+
+def identity_decrypt_args(identity, signature, keys=None):
+    """
+    Build the worker arguments for one Identity row (identity.user should be
+    select_related to avoid a query per row). keys: master_keys() result.
+    """
+    master_salt = to_bytes(identity.user.kdf_salt)
+    return (
+        to_bytes(identity.enc_data), 
+        signature, 
+        to_bytes(identity.salt), 
+        master_salt,
+        (keys or {}).get(master_salt),
+    )
+
+
+def decrypt_identities(identities, signature):
+    """
+    Decrypt a list of Identity instances, in parallel if IDENTITY_DECRYPT_PARALLEL
+    is enabled, otherwise inline.
+    Returns a dict {identity.id: decrypted data or None}.
+    """
+    identities = list(identities)
+    keys = master_keys(identities, signature)
+    arg_list = [identity_decrypt_args(identity, signature, keys) for identity in identities]
+    if settings.IDENTITY_DECRYPT_PARALLEL:
+        results = run_ordered(decrypt_identity_payload, arg_list)
+    else:
+        results = [decrypt_identity_payload(*args) for args in arg_list]
+    return {identity.id: data for identity, data in zip(identities, results)}
+
+
+async def iter_decrypted_identities(identities, signature):
+    """
+    Decrypt a list of Identity instances (identity.user select_related) and 
+    yield (index, identity, data) as soon as each one is done (completion 
+    order, not input order). Async generator: the decryption never runs on 
+    the event loop.
+    """
+    identities = list(identities)
+    keys = await sync_to_async(master_keys, thread_sensitive=False)(identities, signature)
+    arg_list = [identity_decrypt_args(identity, signature, keys) for identity in identities]
+    if settings.IDENTITY_DECRYPT_PARALLEL:
+        async for index, data in arun_bounded(decrypt_identity_payload, arg_list):
+            yield index, identities[index], data
+        return
+
+    decrypt = sync_to_async(decrypt_identity_payload, thread_sensitive=False)
+    for index, args in enumerate(arg_list):
+        yield index, identities[index], await decrypt(*args)
+
+
+def encrypt_identity_payload(data, signature, salt, master_key=None):
+    """
+    Worker job: encrypt one serialized identity payload. With a master key the
+    v2 format is produced (HKDF subkey), otherwise v1 (PBKDF2 per identity).
+    """
+    if master_key is not None:
+        return ENC_DATA_V2 + get_identity_fernet(master_key, salt).encrypt(data)
+    return encrypt(data, signature.encode(), salt)
+
+
+def encrypt_identities(identities, raw_data_list, signature):
+    """
+    Encrypt raw_data_list[i] into identities[i].enc_data in parallel.
+    Identities must share one owner and have their salt set. The master key is
+    derived once up front so the workers only run the cheap HKDF step.
+    """
+    identities = list(identities)
+    master_key = None
+    if identities and settings.IDENTITY_ENC_VERSION >= 2:
+        master_key = derive_master_key(signature.encode(), identities[0].user.get_kdf_salt())
+
+    arg_list = [
+        (json.dumps(raw_data).encode(), signature, identity.salt, master_key)
+        for identity, raw_data in zip(identities, raw_data_list)
+    ]
+    if settings.IDENTITY_DECRYPT_PARALLEL:
+        results = run_ordered(encrypt_identity_payload, arg_list)
+    else:
+        results = [encrypt_identity_payload(*args) for args in arg_list]
+
+    for identity, enc_data in zip(identities, results):
+        identity.enc_data = enc_data
+    return identities
@@ -1,7 +1,166 @@
-import os, base64
+import os, base64, json, hmac, hashlib, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future
+from django.conf import settings
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes 
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+KDF_ITERATIONS = 1_200_000
+
+
+# --- Derived key cache ----
+
+class DerivedKeyCache:
+    """
+    Process-local LRU + TTL cache for PBKDF2 output.
+    Entries are keyed on an HMAC of (signature, salt, iterations) under a random
+    per-process key, so the raw signature is never kept in memory as a key.
+    Entries are also indexed by salt so they can be dropped when the Identity 
+    or SharedData row owning that salt is deleted. Concurrent misses on the 
+    same key wait for the first caller's derivation instead of repeating it.
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._hmac_key = os.urandom(32)
+        self._entries = OrderedDict()  # cache key -> (expires, salt tag, derived key)
+        self._by_salt = {}             # salt tag -> {cache keys}
+        self._in_flight = {}           # cache key -> Future of the running derivation
+        self._lock = threading.Lock()
+
+    def _salt_tag(self, salt):
+        return hmac.new(self._hmac_key, b'salt:' + bytes(salt), hashlib.sha256).digest()
+
+    def _cache_key(self, signature, salt, iterations):
+        h = hmac.new(self._hmac_key, digestmod=hashlib.sha256)
+        h.update(len(salt).to_bytes(4, 'big'))
+        h.update(bytes(salt))
+        h.update(iterations.to_bytes(8, 'big'))
+        h.update(signature)
+        return h.digest()
+
+    def _drop(self, key):
+        _, tag, _ = self._entries.pop(key)
+        keys = self._by_salt.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_salt[tag]
+
+    def get_or_derive(self, signature, salt, iterations, derive):
+        """
+        Return the cached key for (signature, salt, iterations) or compute it 
+        with derive() and store it. The derivation itself runs outside the lock,
+        once per key: callers missing meanwhile get its result (or exception).
+        """
+        if self.max_size <= 0:
+            return derive()
+
+        key = self._cache_key(signature, salt, iterations)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            if entry:
+                self._drop(key)
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = Future()
+                self.misses += 1
+                running = False
+            else:
+                self.hits += 1
+                running = True
+
+        if running:
+            return future.result()
+
+        try:
+            derived = derive()
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            if key in self._entries:
+                self._drop(key)
+            tag = self._salt_tag(salt)
+            self._entries[key] = (time.monotonic() + self.ttl, tag, derived)
+            self._by_salt.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+        future.set_result(derived)
+        return derived
+
+    def invalidate_salt(self, salt):
+        """
+        Drop every cached key derived with this salt.
+        """
+        if not salt:
+            return
+        with self._lock:
+            for key in list(self._by_salt.get(self._salt_tag(salt), ())):
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_salt.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries), 
+                'max_size': self.max_size, 
+                'hits': self.hits, 
+                'misses': self.misses,
+            }
+
+
+_kdf_cache = None
+_kdf_cache_lock = threading.Lock()
+
+
+def get_kdf_cache():
+    """
+    Return the process-wide derived key cache (sized by KDF_CACHE_SIZE / KDF_CACHE_TTL).
+    """
+    global _kdf_cache
+    with _kdf_cache_lock:
+        if _kdf_cache is None:
+            _kdf_cache = DerivedKeyCache(settings.KDF_CACHE_SIZE, settings.KDF_CACHE_TTL)
+        return _kdf_cache
+
+
+def pbkdf2_sha256(signature, salt, iterations=KDF_ITERATIONS):
+    """
+    PBKDF2-HMAC-SHA256 (32 bytes) of the signature, served from the derived key 
+    cache when the same (signature, salt) was stretched recently.
+    """
+    if isinstance(signature, str):
+        signature = signature.encode('utf-8')
+    salt = bytes(salt)
+
+    def derive():
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=iterations,
+        )
+        return kdf.derive(signature)
+
+    return get_kdf_cache().get_or_derive(signature, salt, iterations, derive)
 
 
 def get_fernet_key(signature, salt):
@@ -12,17 +171,7 @@ def get_fernet_key(signature, salt):
     Documentation:
         https://cryptography.io/en/latest/
     """
-    if isinstance(signature, str):
-        signature = signature.encode()
-        
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=1_200_000,
-    )
-
-    key = base64.urlsafe_b64encode(kdf.derive(signature))
+    key = base64.urlsafe_b64encode(pbkdf2_sha256(signature, salt))
     return Fernet(key)
 
 
@@ -44,6 +193,73 @@ def decrypt(data, signature, salt):
     return f.decrypt(data)
 
 
+# --- Identity key hierarchy (enc_data v2) ----
+# v1: Fernet token, key = PBKDF2(signature, identity salt)
+# v2: b'v2:' + Fernet token, key = HKDF(master key, info=identity salt) where
+#     master key = PBKDF2(signature, profile kdf_salt), stretched once per user.
+
+ENC_DATA_V2 = b'v2:'
+
+
+def enc_data_version(data):
+    """
+    Return the format version (1 or 2) of a stored identity ciphertext.
+    Fernet tokens are urlsafe base64 and never contain ':'.
+    """
+    return 2 if bytes(data).startswith(ENC_DATA_V2) else 1
+
+
+def derive_master_key(signature, master_salt):
+    """
+    Stretch the wallet signature once per profile into a 32-byte master key.
+    """
+    return pbkdf2_sha256(signature, master_salt)
+
+
+def get_identity_fernet(master_key, identity_salt):
+    """
+    Cheap per-identity subkey: HKDF-SHA256 over the master key, with the 
+    identity's own salt as context info.
+    """
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'identity:' + bytes(identity_salt),
+    )
+    return Fernet(base64.urlsafe_b64encode(hkdf.derive(master_key)))
+
+
+def encrypt_identity(data, signature, identity_salt, master_salt):
+    """
+    Encrypt identity data in the v2 format.
+    """
+    f = get_identity_fernet(derive_master_key(signature, master_salt), identity_salt)
+    return ENC_DATA_V2 + f.encrypt(data)
+
+
+def decrypt_identity(data, signature, identity_salt, master_salt=None):
+    """
+    Decrypt an identity ciphertext of either format version.
+    """
+    data = bytes(data)
+    if enc_data_version(data) == 1:
+        return decrypt(data, signature, identity_salt)
+    if not master_salt:
+        raise ValueError("Master salt required to decrypt v2 identity data.")
+    f = get_identity_fernet(derive_master_key(signature, master_salt), identity_salt)
+    return f.decrypt(data[len(ENC_DATA_V2):])
+
+
+def decrypt_json(data, signature, salt, master_salt=None):
+    """
+    Decrypt identity data (v1 or v2) and parse the JSON plaintext.
+    Plain module-level function (bytes/str in, dict out) so it can be handed
+    to a thread or process pool.
+    """
+    return json.loads(decrypt_identity(data, signature, salt, master_salt).decode())
+
+
 # --- Envelope Encryption ----
 # https://medium.com/@tarangchikhalia/envelope-encryption-a-secure-approach-to-secrets-management-c8abce5b24d2
 
@@ -69,16 +285,7 @@ def derive_kek_from_signature(signature, salt):
     Derive Key Encryption Key (KEK) from signature + salt.
     Encrypts the encryption key not data.
     """
-    if isinstance(signature, str):
-        signature = signature.encode('utf-8')
-
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32, 
-        salt=salt,
-        iterations=1_200_000
-    )
-    return kdf.derive(signature)
+    return pbkdf2_sha256(signature, salt)
 
 
 def wrap_key_w_signature(enc_key, signature, salt):
@@ -0,0 +1,143 @@
+"""
+Set-based mass deletion of a holder's identities.
+
+QuerySet.delete() collects every cascaded Request / SharedData row into
+Python objects (signal receivers are connected for all three models, so no
+fast delete is possible). Here each level is deleted with a single DELETE
+... WHERE ... IN (subquery), and the work the receivers did per row is done
+once per set instead:
+    - request counters / list versions: one aggregate over the deleted requests
+    - contexts version + cache: one bump / invalidation for the holder
+    - derived key cache: evicted by salt
+    - avatar files: removed by a background job after commit
+
+The side effects themselves live in one place: the post_delete receivers
+(signals.py) call the same functions with a single row, so both paths stay
+in sync (forget_salts(), identities_deleted(), counters.record_requests_deleted()).
+
+The level deletes use QuerySet._raw_delete(), what QuerySet.delete() itself
+runs for collector-free ("fast") deletes; Django has no public API for it.
+It is only safe while RAW_DELETE_RELATIONS lists every relation pointing at
+the three models: with any other one (a new FK) delete_identities() falls 
+back to QuerySet.delete(), and MassDeleteTests fails until the new relation
+is handled here.
+"""
+from django.core.files.storage import default_storage
+from django.db.models import Count
+
+from .models import Identity, Request, SharedData
+from .counters import record_requests_deleted
+from .versioning import bump_identities_version
+from .context_cache import invalidate_contexts
+from .cryptographic_utils import get_kdf_cache
+from .tasks import run_after_commit
+from .utils import to_bytes
+
+import logging
+
+logger = logging.getLogger('rest_api')
+
+
+# Relations (accessor names) of the rows deleted below, all handled by them
+RAW_DELETE_RELATIONS = {
+    Identity: {'requests'},
+    Request: {'shared_data'},
+    SharedData: set(),
+}
+
+
+def unhandled_relations():
+    """
+    Relations pointing at the deleted models that the raw deletes would skip.
+    """
+    return {
+        f'{model.__name__}.{field.get_accessor_name()}'
+        for model, handled in RAW_DELETE_RELATIONS.items()
+        for field in model._meta.get_fields()
+        if field.auto_created and not field.concrete and field.get_accessor_name() not in handled
+    }
+
+
+def delete_identities(profile, ids):
+    """
+    Delete the identities 'ids' of 'profile' with their requests and shared
+    data. Must run inside a transaction.
+    Returns the number of deleted identities.
+    """
+    identities = Identity.objects.filter(user=profile, id__in=ids)
+    requests = Request.objects.filter(context__in=identities.values('id'))
+    shared = SharedData.objects.filter(request__in=requests.values('id'))
+    files = [(avatar, variants) for avatar, variants in identities.values_list('avatar', 'avatar_variants') if avatar]
+
+    unhandled = unhandled_relations()
+    if unhandled:
+        # Collector and post_delete receivers, row by row
+        logger.warning(f"Mass delete falls back to QuerySet.delete(), unhandled relations: {sorted(unhandled)}")
+        deleted = identities.delete()[1].get(Identity._meta.label, 0)
+        if deleted and files:
+            run_after_commit(delete_avatar_files, files)
+        return deleted
+
+    # Small per-row values only (no model instances)
+    salts = [to_bytes(salt) for salt in identities.values_list('salt', flat=True)]
+    salts += [to_bytes(salt) for salt in shared.values_list('wrap_salt', flat=True)]
+    request_rows = list(
+        requests.order_by().values('holder_id', 'requestor_id', 'status').annotate(n=Count('id'))
+    )
+
+    shared._raw_delete(shared.db)
+    requests._raw_delete(requests.db)
+    deleted = identities._raw_delete(identities.db)
+    if not deleted:
+        return 0
+
+    record_requests_deleted(request_rows)
+    identities_deleted(profile.pk, profile.did)
+    forget_salts(salts)
+
+    if files:
+        run_after_commit(delete_avatar_files, files)
+    logger.info(f"Deleted {deleted} identities of profile {profile.pk}.")
+    return deleted
+
+
+def identities_deleted(profile_id, did):
+    """
+    Identities of a holder were deleted: new contexts ETag, drop the cached
+    contexts after commit.
+    """
+    bump_identities_version(profile_id)
+    invalidate_contexts(did)
+
+
+def forget_salts(salts):
+    """
+    Evict the derived keys cached for the salts of deleted rows.
+    """
+    cache = get_kdf_cache()
+    for salt in salts:
+        if salt:
+            cache.invalidate_salt(salt)
+
+
+def delete_avatar_files(files):
+    """
+    Background job: remove avatar files of deleted identities that no other
+    identity still references. Variants are content-hashed, so the same upload
+    shares its files; the largest variant (Identity.avatar) identifies the set.
+    """
+    in_use = set(Identity.objects.filter(avatar__in=[avatar for avatar, _ in files]).values_list('avatar', flat=True))
+    removed = 0
+    for avatar, variants in files:
+        if avatar in in_use:
+            continue
+        names = {avatar}
+        for formats in (variants or {}).values():
+            names.update(formats.values())
+        for name in names:
+            try:
+                default_storage.delete(name)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Could not delete avatar file {name}: {e}")
+    logger.info(f"Removed {removed} avatar files.")
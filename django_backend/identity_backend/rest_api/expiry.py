@@ -0,0 +1,77 @@
+"""
+Expiry sweeper for approved requests.
+
+RetrieveSharedDataView refuses expired approvals at read time, but the
+ciphertext would stay in SharedData forever. sweep_expired() finds approvals
+whose expires_at has passed (walking the expires_at index, oldest first, in
+bounded batches), deletes their SharedData, moves the requests to EXPIRED
+and notifies each requestor once per batch (through the outbox, sent after
+the commit).
+
+Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several sweepers
+(or a sweeper and a holder answering / revoking) never block each other.
+Holder revocations leave the request APPROVED with expires_at = now, they are
+picked up by the next sweep like any other expiry.
+
+Run by the sweep_expired_requests management command (once, from cron, or
+with --loop as a long running worker).
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Profile, Request, SharedData
+from .counters import record_requests_transition
+from .utils import notify_did
+
+import logging
+
+logger = logging.getLogger('rest_api')
+
+
+def sweep_expired(batch_size=None, now=None):
+    """
+    Expire one batch of approvals. Returns the number of expired requests
+    (less than batch_size means there is nothing left to do right now).
+    """
+    batch_size = batch_size or settings.EXPIRY_SWEEP_BATCH_SIZE
+    now = now or timezone.now()
+
+    with transaction.atomic():
+        expired = list(
+            Request.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(status=Request.Status.APPROVED, expires_at__lte=now)
+            .order_by('expires_at')
+            .only('id', 'holder_id', 'requestor_id')[:batch_size]
+        )
+        if not expired:
+            return 0
+
+        ids = [req.id for req in expired]
+        # SharedData has no dependants; its post_delete receiver evicts the
+        # cached KEKs (deletion.forget_salts())
+        deleted, _ = SharedData.objects.filter(request_id__in=ids).delete()
+
+        Request.objects.filter(id__in=ids).update(status=Request.Status.EXPIRED, updated_at=now)
+        record_requests_transition(expired, Request.Status.APPROVED, Request.Status.EXPIRED)
+
+        by_requestor = {}
+        for req in expired:
+            by_requestor.setdefault(req.requestor_id, []).append(str(req.id))
+        dids = dict(Profile.objects.filter(pk__in=by_requestor).values_list('pk', 'did'))
+        notify_expired({dids[pk]: request_ids for pk, request_ids in by_requestor.items() if dids.get(pk)})
+
+    logger.info(f"Expired {len(expired)} approved requests ({deleted} shared data rows deleted).")
+    return len(expired)
+
+
+def notify_expired(notifications):
+    """
+    One websocket event per requestor: {did: [request_id, ...]}.
+    """
+    for did, request_ids in notifications.items():
+        notify_did(did, {
+            "event": "access expired",
+            "request_ids": request_ids,
+            "status": str(Request.Status.EXPIRED.label),
+        })
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_api.outbox import drain, local_channel_layer, purge_dispatched
+
+import time
+
+
+class Command(BaseCommand):
+    """
+    Send the queued WebSocket notifications of the outbox to the channel
+    layer, including retries of failed sends, and purge sent notifications
+    past the replay window (see rest_api.outbox). Needs a shared channel 
+    layer (Redis): the in-memory layer of the web server can't be reached 
+    from here.
+
+    Usage:
+        python manage.py dispatch_notifications [--batch-size 200]
+        python manage.py dispatch_notifications --loop [--interval 1]
+    """
+    help = "Drain the notification outbox to the channel layer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.NOTIFICATION_DISPATCH_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep dispatching until interrupted.')
+        parser.add_argument('--interval', type=float, default=settings.NOTIFICATION_DISPATCH_INTERVAL,
+                            help='Seconds to sleep when the outbox is empty (with --loop).')
+
+    def handle(self, *args, **options):
+        if local_channel_layer():
+            raise CommandError(
+                'The channel layer is in-memory (per process): notifications are '
+                'dispatched by the web server after each commit. Configure Redis to run a dispatcher.'
+            )
+        batch_size = max(1, options['batch_size'])
+        total = purged = 0
+        try:
+            while True:
+                total += drain(batch_size)
+                purged += purge_dispatched(batch_size)
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'{total} notifications processed, {purged} purged.'))
@@ -0,0 +1,89 @@
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rest_api.models import Profile, Identity
+from rest_api.crypto_pool import decrypt_identities
+
+
+class Command(BaseCommand):
+    """
+    Re-encrypt a holder's legacy (v1, PBKDF2 per identity) identities with the
+    per-user master key + HKDF scheme (v2), in batches.
+
+    The wallet signature is never stored, so rows can only be migrated for a 
+    holder whose signature is supplied. Without --did/--signature the command 
+    reports how many legacy rows are left per holder.
+
+    Usage:
+        python manage.py migrate_identity_keys
+        python manage.py migrate_identity_keys --did <did> --signature <sig> [--batch-size 50] [--dry-run]
+    """
+    help = "Migrate legacy identity ciphertexts to the master key format (v2)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--did', help='DID of the holder to migrate.')
+        parser.add_argument('--signature', help="Holder's wallet signature.")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--dry-run', action='store_true', help='Decrypt only, do not write.')
+
+    def handle(self, *args, **options):
+        did, signature = options['did'], options['signature']
+
+        if not did and not signature:
+            self.report(options['batch_size'])
+            return
+        if not did or not signature:
+            raise CommandError('--did and --signature must be given together.')
+        
+        try:
+            profile = Profile.objects.get(did=did)
+        except Profile.DoesNotExist:
+            raise CommandError(f'No profile for DID {did}.')
+
+        batch_size = max(1, options['batch_size'])
+        dry_run = options['dry_run']
+        migrated = failed = 0
+        last_id = None
+
+        while True:
+            qs = Identity.objects.select_related('user').filter(user=profile).order_by('id')
+            if last_id is not None:
+                qs = qs.filter(id__gt=last_id)
+            batch = list(qs[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            batch = [identity for identity in batch if identity.needs_key_upgrade]
+            if not batch:
+                continue
+
+            decrypted = decrypt_identities(batch, signature)
+            failed += sum(1 for data in decrypted.values() if data is None)
+            if dry_run:
+                migrated += sum(1 for data in decrypted.values() if data is not None)
+                continue
+
+            with transaction.atomic():
+                migrated += Identity.upgrade_keys(batch, decrypted, signature)
+            self.stdout.write(f'{migrated} migrated, {failed} failed...')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would migrate" if dry_run else "Migrated"} {migrated} identities for {did} '
+            f'({failed} could not be decrypted).'
+        ))
+
+    def report(self, chunk_size):
+        """
+        Print the number of legacy identities per holder.
+        """
+        counts = Counter()
+        rows = Identity.objects.select_related('user').only('enc_data', 'user__did').iterator(chunk_size=max(1, chunk_size))
+        for identity in rows:
+            if identity.needs_key_upgrade:
+                counts[identity.user.did] += 1
+
+        for did, count in sorted(counts.items()):
+            self.stdout.write(f'{did}: {count}')
+        self.stdout.write(self.style.SUCCESS(f'{sum(counts.values())} legacy identities left.'))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rest_api.models import Profile, RequestCounters
+from rest_api.counters import compute_counters, counter_fields
+
+
+class Command(BaseCommand):
+    """
+    Recompute RequestCounters from the Request table and fix rows that drifted
+    (e.g. after raw SQL changes or a restore).
+
+    Usage:
+        python manage.py repair_request_counters [--did <did>] [--batch-size 500] [--dry-run]
+    """
+    help = "Recompute the per-profile request counters from the base table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--did', help='Only repair the counters of this profile.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Report differences, do not write.')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.order_by('pk')
+        if options['did']:
+            profiles = profiles.filter(did=options['did'])
+            if not profiles.exists():
+                raise CommandError(f"No profile for DID {options['did']}.")
+
+        batch_size = max(1, options['batch_size'])
+        dry_run = options['dry_run']
+        fields = counter_fields()
+        checked = fixed = 0
+        last_pk = None
+
+        while True:
+            qs = profiles if last_pk is None else profiles.filter(pk__gt=last_pk)
+            ids = list(qs.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            last_pk = ids[-1]
+            checked += len(ids)
+
+            # Counting and writing in one transaction with the rows locked, so 
+            # concurrent increments are not overwritten by a stale count
+            with transaction.atomic():
+                current = {
+                    c.profile_id: c for c in RequestCounters.objects.select_for_update().filter(profile_id__in=ids)
+                }
+                expected = compute_counters(ids)
+                for profile_id in ids:
+                    values = {field: expected.get(profile_id, {}).get(field, 0) for field in fields}
+                    row = current.get(profile_id)
+                    if row is None and not any(values.values()):
+                        continue
+                    if row is not None and all(getattr(row, f) == v for f, v in values.items()):
+                        continue
+
+                    fixed += 1
+                    self.stdout.write(f'profile {profile_id}: {values}')
+                    if not dry_run:
+                        RequestCounters.objects.update_or_create(profile_id=profile_id, defaults=values)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{checked} profiles checked, {fixed} {"would be fixed" if dry_run else "fixed"}.'
+        ))
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rest_api.expiry import sweep_expired
+
+import time
+
+
+class Command(BaseCommand):
+    """
+    Expire approved requests whose expires_at has passed and delete their
+    shared data (see rest_api.expiry).
+
+    Usage:
+        python manage.py sweep_expired_requests [--batch-size 500]
+        python manage.py sweep_expired_requests --loop [--interval 60]
+    """
+    help = "Move expired approvals to EXPIRED and delete their shared data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EXPIRY_SWEEP_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping until interrupted.')
+        parser.add_argument('--interval', type=float, default=settings.EXPIRY_SWEEP_INTERVAL,
+                            help='Seconds to sleep when nothing is left to expire (with --loop).')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        total = 0
+        try:
+            while True:
+                # Drain the backlog batch by batch, one short transaction each
+                while True:
+                    expired = sweep_expired(batch_size)
+                    total += expired
+                    if expired < batch_size:
+                        break
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f'{total} requests expired.'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0014_remove_request_requestor_pubkey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='kdf_salt',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0015_profile_kdf_salt'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['holder', 'created_at'], name='rest_api_re_holder__89116c_idx'),
+        ),
+    ]
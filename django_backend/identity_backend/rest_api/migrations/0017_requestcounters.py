@@ -0,0 +1,49 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    """
+    Initial counters from the existing requests (repair_request_counters does
+    the same at runtime).
+    """
+    Request = apps.get_model('rest_api', 'Request')
+    RequestCounters = apps.get_model('rest_api', 'RequestCounters')
+    suffix = {'PD': 'pending', 'AP': 'approved', 'DC': 'declined'}
+
+    counters = {}
+    for role, column in (('incoming', 'holder_id'), ('outgoing', 'requestor_id')):
+        for row in Request.objects.order_by().values(column, 'status').annotate(n=Count('id')):
+            if row['status'] in suffix:
+                counters.setdefault(row[column], {})[f"{role}_{suffix[row['status']]}"] = row['n']
+
+    RequestCounters.objects.bulk_create(
+        [RequestCounters(profile_id=profile_id, **fields) for profile_id, fields in counters.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0016_request_holder_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestCounters',
+            fields=[
+                ('profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='request_counters', serialize=False, to='rest_api.profile')),
+                ('incoming_pending', models.IntegerField(default=0)),
+                ('incoming_approved', models.IntegerField(default=0)),
+                ('incoming_declined', models.IntegerField(default=0)),
+                ('outgoing_pending', models.IntegerField(default=0)),
+                ('outgoing_approved', models.IntegerField(default=0)),
+                ('outgoing_declined', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0017_requestcounters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='identities_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='requests_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
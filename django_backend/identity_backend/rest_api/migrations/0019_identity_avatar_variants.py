@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0018_profile_list_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='identity',
+            name='avatar_variants',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0019_identity_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestcounters',
+            name='incoming_expired',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='requestcounters',
+            name='outgoing_expired',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='request',
+            name='status',
+            field=models.CharField(choices=[('PD', 'Pending'), ('AP', 'Approved'), ('DC', 'Declined'), ('EX', 'Expired')], db_index=True, default='PD', max_length=2),
+        ),
+    ]
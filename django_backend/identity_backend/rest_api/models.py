@@ -2,10 +2,12 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _ 
 from django.core.exceptions import ValidationError
+from django.conf import settings
+from django.utils import timezone
 
-from .cryptographic_utils import encrypt, decrypt
+from .cryptographic_utils import encrypt, encrypt_identity, decrypt_json, enc_data_version
 from .utils import to_bytes
-import uuid, json, logging
+import uuid, json, logging, secrets
 
 logger = logging.getLogger('rest_api')
 
@@ -20,9 +22,28 @@ class Profile(models.Model):
     did = models.CharField(max_length=255, unique=True, blank=True, null=True)
     creation_date = models.DateTimeField(auto_now_add=True)
     latest_access = models.DateTimeField(auto_now=True) 
+    # Salt for the per-user master key (v2 identity encryption), set on first use
+    kdf_salt = models.BinaryField(blank=True, null=True)
+    # Bumped on every change visible in the profile's request list / public 
+    # contexts, used as ETag validators (see versioning.py)
+    requests_version = models.PositiveBigIntegerField(default=0)
+    identities_version = models.PositiveBigIntegerField(default=0)
+    # Last sequence number of the profile's notifications (see outbox.py)
+    notification_seq = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
         return self.user.username
+    
+    def get_kdf_salt(self):
+        """
+        Return the master key salt, creating it on first use.
+        The conditional update keeps concurrent requests from overwriting a 
+        salt that another request already used to encrypt identities.
+        """
+        if not self.kdf_salt:
+            Profile.objects.filter(pk=self.pk, kdf_salt__isnull=True).update(kdf_salt=secrets.token_bytes(16))
+            self.kdf_salt = Profile.objects.values_list('kdf_salt', flat=True).get(pk=self.pk)
+        return to_bytes(self.kdf_salt)
 
 
 class Identity(models.Model):
@@ -35,6 +56,8 @@ class Identity(models.Model):
     context = models.CharField(max_length=255, blank=False, null=False)
     description = models.TextField()
     avatar = models.ImageField(blank=True, null=True, upload_to='images/')
+    # Resized, content-hashed variants {'<size>': {'webp': name, 'jpeg': name}} (avatars.py)
+    avatar_variants = models.JSONField(blank=True, null=True)
     issued = models.DateTimeField(auto_now_add=True)
     enc_data = models.BinaryField(blank=False, null=False)
     salt = models.BinaryField(blank=False, null=False)
@@ -51,27 +74,61 @@ class Identity(models.Model):
     
     def store_encrypted_data(self, raw_data, signature):
         """
-        Serialize and encrypt the provided data with a Fernet key derived from 
+        Serialize and encrypt the provided data with a key derived from the
         Ethereum wallet signature and this instance's salt.
+        IDENTITY_ENC_VERSION selects the format: 2 derives the key from the 
+        holder's master key (HKDF), 1 runs a full PBKDF2 per identity.
         """
         data_bytes = json.dumps(raw_data).encode()
-        encrypted = encrypt(data_bytes, signature.encode(), self.salt)
+        if settings.IDENTITY_ENC_VERSION >= 2:
+            encrypted = encrypt_identity(data_bytes, signature.encode(), self.salt, self.user.get_kdf_salt())
+        else:
+            encrypted = encrypt(data_bytes, signature.encode(), self.salt)
         self.enc_data = encrypted
 
 
     def retrieve_decrypted_data(self, signature):
         """
-        Decrypt the stored ciphertext with the holder's signature.
+        Decrypt the stored ciphertext (v1 or v2) with the holder's signature.
         """
         try:
             cipertext = to_bytes(self.enc_data)
             salt = to_bytes(self.salt)
-            decrypted = decrypt(cipertext, signature.encode(), salt)
-            return json.loads(decrypted.decode())
+            master_salt = to_bytes(self.user.kdf_salt)
+            return decrypt_json(cipertext, signature.encode(), salt, master_salt)
         except Exception as e:
             logger.debug(f"decrypt failed: {e}")
             return None
         
+    
+    @property
+    def needs_key_upgrade(self):
+        """
+        True if enc_data is older than the configured IDENTITY_ENC_VERSION.
+        """
+        return enc_data_version(to_bytes(self.enc_data)) < settings.IDENTITY_ENC_VERSION
+    
+    
+    @classmethod
+    def upgrade_keys(cls, identities, decrypted, signature):
+        """
+        Re-encrypt legacy rows in the current format, reusing plaintext that 
+        was just decrypted ({identity.id: data}). Rows that failed to decrypt 
+        are left untouched. Returns the number of upgraded rows.
+        """
+        upgraded = []
+        for identity in identities:
+            data = decrypted.get(identity.id)
+            if data is None or not identity.needs_key_upgrade:
+                continue
+            identity.store_encrypted_data(data, signature)
+            upgraded.append(identity)
+        
+        if upgraded:
+            cls.objects.bulk_update(upgraded, ['enc_data'])
+            logger.info(f"Upgraded encryption of {len(upgraded)} identities.")
+        return len(upgraded)
+        
 
     def save(self, *args, **kwargs):
         """
@@ -91,6 +148,7 @@ class Request(models.Model):
         PENDING = "PD", _("Pending") 
         APPROVED = "AP", _("Approved") 
         DECLINED = "DC", _("Declined") 
+        EXPIRED = "EX", _("Expired")
         
     id = models.UUIDField(primary_key=True, unique=True, default=uuid.uuid4, editable=False) 
     requestor = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='requests_made') 
@@ -111,7 +169,8 @@ class Request(models.Model):
     class Meta: 
         indexes = [ 
             models.Index(fields=['holder', 'status']), 
-            models.Index(fields=['requestor', 'created_at']) 
+            models.Index(fields=['requestor', 'created_at']),
+            models.Index(fields=['holder', 'created_at']),
         ] 
         # Limit to one request for a requestor-context pair while status pending 
         constraints = [ 
@@ -153,6 +212,59 @@ class SharedData(models.Model):
     class Meta: 
         verbose_name = "Shared Encrypted Data"
         verbose_name_plural = "Shared Encrypted Data"
-        ordering = ['-created_at'] 
+        ordering = ['-created_at']
 
-    
+
+class RequestCounters(models.Model):
+    """
+    Per-profile request counts by role and status, maintained incrementally in
+    the same transaction as every Request insert / status change / delete
+    (see counters.py), so dashboard badges are a primary key lookup.
+    incoming: the profile is holder, outgoing: the profile is requestor.
+    """
+    profile = models.OneToOneField(Profile, on_delete=models.CASCADE, primary_key=True, related_name='request_counters')
+    incoming_pending = models.IntegerField(default=0)
+    incoming_approved = models.IntegerField(default=0)
+    incoming_declined = models.IntegerField(default=0)
+    incoming_expired = models.IntegerField(default=0)
+    outgoing_pending = models.IntegerField(default=0)
+    outgoing_approved = models.IntegerField(default=0)
+    outgoing_declined = models.IntegerField(default=0)
+    outgoing_expired = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Request counters for {self.profile.did}"
+
+
+class Notification(models.Model):
+    """
+    Transactional outbox and replay log of WebSocket notifications (see
+    outbox.py). notify_did() inserts a row in the transaction of the state
+    change, the dispatcher sends it to the channel layer once committed. Sent
+    rows are kept for NOTIFICATION_RETENTION seconds so reconnecting clients
+    can replay what they missed (?since=<seq>).
+    """
+    did = models.CharField(max_length=255)
+    # Per-DID sequence number (Profile.notification_seq), None without profile
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    # Retries of failed sends, with exponential backoff
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['did', 'id']),
+            # Dispatcher scan: only rows not sent yet
+            models.Index(fields=['next_attempt_at'], condition=models.Q(dispatched_at__isnull=True), name='notification_pending'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['did', 'seq'], name='unique_notification_seq_per_did'),
+        ]
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.payload.get('event')} for {self.did}"
@@ -0,0 +1,357 @@
+"""
+Transactional outbox for WebSocket notifications.
+
+notify_did() only inserts a Notification row, inside the transaction of the
+state change it reports: a rolled back change never notifies, and API
+responses no longer wait on channel layer (Redis) I/O.
+
+dispatch_pending() drains the table in batches to the channel layer:
+    - rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED and leased 
+      (next_attempt_at moved NOTIFICATION_DISPATCH_LEASE ahead) in a short
+      transaction, so several dispatchers can run side by side and no lock
+      or connection is held during the channel layer I/O; the results are
+      recorded in a second transaction (rows of a dispatcher that died are
+      sent again once the lease runs out, clients skip seqs they have)
+    - per DID ordering: a DID is skipped while an older row of it is claimed
+      by another dispatcher or waiting for a retry, and after a failed send
+      the rest of the DID's batch is left for later
+    - failed sends are retried with exponential backoff (NOTIFICATION_RETRY_*)
+      and dropped after NOTIFICATION_MAX_ATTEMPTS
+    - notifications of DIDs without an open connection are not sent to the
+      channel layer at all (presence.py); they are deferred while that is
+      not certain yet
+    - sent rows are kept for NOTIFICATION_RETENTION seconds as a replay log
+      (purge_dispatched())
+
+Every notification gets the next per-DID sequence number (Profile.
+notification_seq, incremented in the same transaction, so sequence order is
+commit order and numbers have no gaps). Frames carry it as 'seq'; a client 
+reconnecting with ?since=<seq> gets the missed frames from replay() before 
+live delivery resumes (see BackendConsumer).
+
+Web workers start a dispatch in the background after each commit (kick(),
+NOTIFICATION_DISPATCH_ON_COMMIT); the dispatch_notifications command drains
+the table as a long running worker and picks up retries.
+
+Both need a channel layer shared between processes and event loops (Redis).
+The InMemoryChannelLayer (DEBUG) is only read by consumers on the server's
+own event loop: a send from another loop never wakes them. With it the 
+background dispatch hands its sends to the loop of this process' consumers
+(set_consumer_loop()), and the command refuses to run.
+"""
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .models import Notification, Profile
+from .tasks import run_in_background
+from .presence import lookup
+
+import asyncio, datetime, json, logging, re, threading
+
+logger = logging.getLogger('rest_api')
+
+
+# Payload fields of notification schema version 2 (?v=2 on connect): the 
+# affected request as RequestListSerializer returns it, so clients can update
+# their state without refetching the list
+V2_FIELDS = ('request',)
+
+
+def group_name(did):
+    """
+    Channel layer group of the WebSocket connections of a DID.
+    """
+    return "user_" + re.sub(r'[^a-zA-Z0-9-._]+', '_', did)
+
+
+def enqueue(did, payload):
+    """
+    Store a notification in the current transaction, dispatched after commit.
+    """
+    Notification.objects.create(did=did, seq=next_seq(did), payload=payload)
+    if settings.NOTIFICATION_DISPATCH_ON_COMMIT:
+        transaction.on_commit(kick)
+
+
+def local_channel_layer():
+    """
+    True if the channel layer only exists inside this process and event loop
+    (InMemoryChannelLayer), so only the web server's loop can deliver to it.
+    """
+    return isinstance(get_channel_layer(), InMemoryChannelLayer)
+
+
+# Event loop of the WebSocket consumers of this process, for the sends to an
+# InMemoryChannelLayer
+_consumer_loop = None
+
+
+def set_consumer_loop(loop):
+    global _consumer_loop
+    _consumer_loop = loop
+
+
+def run_sends(channel_layer, rows):
+    """
+    send_rows() from the dispatcher's (sync) thread. Sends to an in-process
+    layer run on the consumers' loop, the only one they are read from.
+    """
+    loop = _consumer_loop
+    if loop is not None and loop.is_running() and isinstance(channel_layer, InMemoryChannelLayer):
+        return asyncio.run_coroutine_threadsafe(send_rows(channel_layer, rows), loop).result()
+    return async_to_sync(send_rows)(channel_layer, rows)
+
+
+def next_seq(did):
+    """
+    Allocate the next sequence number of did (None if there is no profile). 
+    The row lock taken by the UPDATE orders concurrent notifiers of the same
+    DID until their commit.
+    """
+    if not Profile.objects.filter(did=did).update(notification_seq=F('notification_seq') + 1):
+        return None
+    return Profile.objects.values_list('notification_seq', flat=True).get(did=did)
+
+
+def retry_delay(attempts):
+    return datetime.timedelta(seconds=min(
+        settings.NOTIFICATION_RETRY_BASE * 2 ** (attempts - 1), settings.NOTIFICATION_RETRY_MAX
+    ))
+
+
+def blocked_dids(rows):
+    """
+    DIDs of the batch with an older row outside of it (claimed by another
+    dispatcher): sending now would reorder them.
+    """
+    first = {}
+    for row in rows:
+        first.setdefault(row.did, row.id)
+    oldest = (
+        Notification.objects.filter(did__in=first, dispatched_at__isnull=True).order_by()
+        .values('did').annotate(first_id=Min('id'))
+    )
+    return {item['did'] for item in oldest if item['first_id'] < first[item['did']]}
+
+
+def frame_text(payload, seq, version=1):
+    """
+    WebSocket frame of a notification: the payload plus its sequence number.
+    V2_FIELDS are only included for clients of schema version 2.
+    """
+    if version < 2:
+        payload = {key: value for key, value in payload.items() if key not in V2_FIELDS}
+    if seq is not None:
+        payload = {**payload, "seq": seq}
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def notify_message(payload, seq=None):
+    """
+    Channel layer message for BackendConsumer.notify: the payload is serialized
+    here, once per schema version, and sent as is to every connection of the
+    group.
+    """
+    message = {
+        "type": "notify",
+        "event": payload.get("event"),
+        "seq": seq,
+        "text": frame_text(payload, seq),
+    }
+    if any(key in payload for key in V2_FIELDS):
+        message["text_v2"] = frame_text(payload, seq, 2)
+    return message
+
+
+async def send_rows(channel_layer, rows):
+    """
+    Send rows in order. Returns ({row.id: exception} of the failed sends, 
+    ids of the rows skipped because an earlier row of their DID failed).
+    """
+    failed, skipped, failed_dids = {}, set(), set()
+    for row in rows:
+        if row.did in failed_dids:
+            skipped.add(row.id)
+            continue
+        try:
+            await channel_layer.group_send(group_name(row.did), notify_message(row.payload, row.seq))
+        except Exception as e:
+            failed[row.id] = e
+            failed_dids.add(row.did)
+    return failed, skipped
+
+
+def present(rows):
+    """
+    (online, offline) DIDs of rows (presence.lookup()). All of them online if
+    the registry can't be read, an unneeded send is harmless.
+    """
+    dids = {row.did for row in rows}
+    try:
+        return lookup(dids)
+    except Exception as e:
+        logger.warning(f"Presence lookup failed: {e}")
+        return dids, set()
+
+
+def dispatch_pending(batch_size=None):
+    """
+    Send one batch of due notifications. Returns the number of rows claimed
+    (less than batch_size means the outbox is drained for now).
+    """
+    batch_size = batch_size or settings.NOTIFICATION_DISPATCH_BATCH_SIZE
+    now = timezone.now()
+
+    with transaction.atomic():
+        # DIDs with a row waiting for a retry (or leased by another
+        # dispatcher) are left out entirely, their later rows must not 
+        # overtake it
+        pending = Notification.objects.filter(dispatched_at__isnull=True)
+        waiting = pending.filter(next_attempt_at__gt=now).values('did')
+        claimed = list(
+            pending.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .exclude(did__in=waiting)
+            .order_by('id')[:batch_size]
+        )
+        if not claimed:
+            return 0
+
+        blocked = blocked_dids(claimed)
+        rows = [row for row in claimed if row.did not in blocked]
+        lease = now + datetime.timedelta(seconds=settings.NOTIFICATION_DISPATCH_LEASE)
+        Notification.objects.filter(id__in=[row.id for row in rows]).update(next_attempt_at=lease)
+
+    # Nobody to send to for offline DIDs: the rows stay in the replay log.
+    # DIDs that may just have lost their presence slot are checked again
+    # once it is certain
+    online, offline = present(rows)
+    live = [row for row in rows if row.did in online]
+    unsure = [row.id for row in rows if row.did not in online and row.did not in offline]
+
+    channel_layer = get_channel_layer()
+    failed, skipped = {}, set()
+    if channel_layer and live:
+        try:
+            failed, skipped = run_sends(channel_layer, live)
+        except Exception as e:
+            failed = {row.id: e for row in live}
+
+    record_results(rows, live, offline, unsure, failed, skipped, now)
+    return len(claimed)
+
+
+def record_results(rows, live, offline, unsure, failed, skipped, now):
+    """
+    Second transaction of dispatch_pending(): end the lease of the rows.
+    """
+    done = [row.id for row in live if row.id not in failed and row.id not in skipped]
+    done += [row.id for row in rows if row.did in offline]
+    with transaction.atomic():
+        for row in rows:
+            if row.id not in failed:
+                continue
+            error = failed[row.id]
+            row.attempts += 1
+            row.last_error = str(error)
+            if row.attempts >= settings.NOTIFICATION_MAX_ATTEMPTS:
+                # Given up on live delivery, still available for replay
+                logger.error(f"Dropping notification {row.id} for {row.did} after {row.attempts} attempts: {error}")
+                row.dispatched_at = now
+                row.save(update_fields=['attempts', 'last_error', 'dispatched_at'])
+                continue
+            row.next_attempt_at = now + retry_delay(row.attempts)
+            row.save(update_fields=['attempts', 'next_attempt_at', 'last_error'])
+            logger.warning(f"Notification {row.id} for {row.did} failed, retry #{row.attempts}: {error}")
+
+        Notification.objects.filter(id__in=done).update(dispatched_at=now)
+        # Behind a failed row of their DID: due again, after it
+        Notification.objects.filter(id__in=skipped).update(next_attempt_at=now)
+        if unsure:
+            Notification.objects.filter(id__in=unsure).update(
+                next_attempt_at=now + datetime.timedelta(seconds=settings.WS_PRESENCE_TTL)
+            )
+
+
+def drain(batch_size=None):
+    """
+    Dispatch batches until the outbox has no due rows left. Returns the number
+    of claimed rows.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_DISPATCH_BATCH_SIZE
+    total = 0
+    while True:
+        claimed = dispatch_pending(batch_size)
+        total += claimed
+        if claimed < batch_size:
+            return total
+
+
+def purge_dispatched(batch_size=None):
+    """
+    Delete sent notifications older than NOTIFICATION_RETENTION, one batch.
+    Returns the number of deleted rows.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_DISPATCH_BATCH_SIZE
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.NOTIFICATION_RETENTION)
+    ids = list(
+        Notification.objects.filter(created_at__lt=cutoff, dispatched_at__isnull=False)
+        .order_by('created_at').values_list('id', flat=True)[:batch_size]
+    )
+    deleted, _ = Notification.objects.filter(id__in=ids).delete()
+    return deleted
+
+
+def replay(did, since, limit=None, version=1):
+    """
+    Frames of did with a sequence number after 'since', oldest first, for a
+    reconnecting client (one range scan on the (did, seq) unique index).
+    Returns (frames, last_seq, complete); complete is False if the client has
+    to reload its state instead: events were purged already, there are more
+    than 'limit' of them, or 'since' is unknown.
+    """
+    limit = limit or settings.WS_REPLAY_MAX
+    last_seq = Profile.objects.filter(did=did).values_list('notification_seq', flat=True).first() or 0
+    if since >= last_seq:
+        return [], last_seq, since == last_seq
+
+    rows = list(
+        Notification.objects.filter(did=did, seq__gt=since, seq__lte=last_seq)
+        .order_by('seq').values_list('seq', 'payload')[:limit]
+    )
+    complete = bool(rows) and rows[0][0] == since + 1 and rows[-1][0] == last_seq
+    return [(seq, frame_text(payload, seq, version)) for seq, payload in rows], last_seq, complete
+
+
+# --- After-commit dispatch in web workers ---
+# At most one background drain per process; a kick during a running drain
+# makes it run once more, so no committed row waits for the next kick.
+
+_kick_lock = threading.Lock()
+_kick_state = {'running': False, 'again': False}
+
+
+def kick():
+    with _kick_lock:
+        if _kick_state['running']:
+            _kick_state['again'] = True
+            return
+        _kick_state['running'] = True
+    run_in_background(drain_in_background)
+
+
+def drain_in_background():
+    while True:
+        try:
+            drain()
+        except Exception:
+            logger.exception("Notification dispatch failed.")
+        with _kick_lock:
+            if not _kick_state['again']:
+                _kick_state['running'] = False
+                return
+            _kick_state['again'] = False
@@ -0,0 +1,175 @@
+"""
+Keyset (cursor) pagination on (created_at, id), newest first.
+
+Each page is fetched with
+    WHERE created_at <= c AND (created_at < c OR id < i)
+    ORDER BY created_at DESC, id DESC LIMIT n + 1
+so the database walks a (<participant>, created_at) index from the cursor
+position instead of counting or skipping rows: the cost of a page does not depend on
+how deep the client pages or how large the table is.
+
+Several scans (one per participant index) can be paginated together: each is
+fetched with its own LIMIT n + 1 and the results are merged in Python, which
+replaces the bitmap OR + sort over all matching rows with a few bounded
+index range scans.
+
+Cursors are opaque to clients (urlsafe base64 of the boundary row's
+created_at / id and the direction). COUNT(*) is only run on ?count=true.
+
+Documentation:
+https://www.django-rest-framework.org/api-guide/pagination/#custom-pagination
+"""
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+import base64, heapq, json, uuid
+
+NEXT, PREVIOUS = 'n', 'p'
+
+
+def encode_cursor(instance, direction):
+    """
+    Opaque cursor pointing at 'instance' (exclusive), walking in 'direction'.
+    """
+    payload = {'c': instance.created_at.isoformat(), 'i': str(instance.id), 'd': direction}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns (created_at, id, direction) or raises ValidationError.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = parse_datetime(payload['c'])
+        pk = uuid.UUID(payload['i'])
+        direction = payload['d']
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise ValidationError('Invalid cursor')
+    if created_at is None or direction not in (NEXT, PREVIOUS):
+        raise ValidationError('Invalid cursor')
+    return created_at, pk, direction
+
+
+def keyset_filter(created_at, pk, direction):
+    """
+    Rows strictly after (NEXT, older) or before (PREVIOUS, newer) the cursor row.
+    The created_at range is repeated outside the OR so the planner can use it
+    as the index scan boundary.
+    """
+    if direction == NEXT:
+        return Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(id__lt=pk))
+    return Q(created_at__gte=created_at) & (Q(created_at__gt=created_at) | Q(id__gt=pk))
+
+
+def sort_key(instance):
+    return (instance.created_at, instance.id)
+
+
+def merge_scans(scans, direction, limit):
+    """
+    Merge the already ordered results of several scans (e.g. the requestor and
+    holder side of the inbox) into one page: heapq.merge on (created_at, id), 
+    rows present in several scans are kept once, at most 'limit' rows.
+    """
+    merged, seen = [], set()
+    for row in heapq.merge(*scans, key=sort_key, reverse=direction == NEXT):
+        if row.id in seen:
+            continue
+        seen.add(row.id)
+        merged.append(row)
+        if len(merged) == limit:
+            break
+    return merged
+
+
+class KeysetPagination(BasePagination):
+    """
+    Query params:
+        cursor  opaque cursor from a previous 'next' / 'previous' link
+        limit   page size (default REQUESTS_PAGE_SIZE, max REQUESTS_PAGE_MAX)
+        count   'true' to include the total number of matching rows
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    count_query_param = 'count'
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, settings.REQUESTS_PAGE_SIZE))
+        except (TypeError, ValueError):
+            limit = settings.REQUESTS_PAGE_SIZE
+        return max(1, min(limit, settings.REQUESTS_PAGE_MAX))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        queryset may also be a list of querysets (one per index-ordered scan),
+        which are fetched separately and merged, see merge_scans().
+        """
+        self.request = request
+        self.limit = self.get_limit(request)
+        scans = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = self.count_rows(scans)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        direction = NEXT
+        if cursor:
+            created_at, pk, direction = decode_cursor(cursor)
+            scans = [qs.filter(keyset_filter(created_at, pk, direction)) for qs in scans]
+
+        ordering = ('-created_at', '-id') if direction == NEXT else ('created_at', 'id')
+        scans = [list(qs.order_by(*ordering)[:self.limit + 1]) for qs in scans]
+        rows = scans[0] if len(scans) == 1 else merge_scans(scans, direction, self.limit + 1)
+
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if direction == PREVIOUS:
+            rows.reverse()
+
+        # A page reached through 'next' always has a previous page and vice versa
+        self.has_next = has_more if direction == NEXT else True
+        self.has_previous = bool(cursor) if direction == NEXT else has_more
+        self.page = rows
+        return rows
+
+    def count_rows(self, scans):
+        if len(scans) == 1:
+            return scans[0].count()
+        # Rows matched by several scans are counted once (UNION of the ids)
+        ids = [qs.order_by().values('id') for qs in scans]
+        return ids[0].union(*ids[1:]).count()
+
+    def build_link(self, instance, direction):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(instance, direction))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.build_link(self.page[-1], NEXT)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.build_link(self.page[0], PREVIOUS)
+
+    def get_paginated_response(self, data):
+        body = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            body = {'count': self.count, **body}
+        return Response(body)
@@ -0,0 +1,94 @@
+"""
+Presence registry: which DIDs have at least one open WebSocket connection.
+
+Kept in the shared Django cache (Redis), one key per connection: a DID has
+WS_PRESENCE_SLOTS slot keys presence:<hash>:<n>, each holding the channel
+name of the connection that claimed it (cache.add, so two connections never
+share a slot and no entry is ever read, modified and written back):
+    - BackendConsumer.connect claims a free slot, disconnect deletes its own
+    - every connection refreshes its slot (heartbeat) every WS_PRESENCE_TTL / 3
+      seconds, slots of crashed workers expire after WS_PRESENCE_TTL; a slot
+      lost meanwhile (eviction, cache restart) is claimed again
+    - connections beyond WS_PRESENCE_SLOTS are not tracked, the DID is online
+      through the others anyway (and they claim a slot once one is free)
+
+A missing slot may still be a lost one that the next heartbeat brings back,
+so no slot is only a hint. lookup() remembers when it first found a DID
+without slots (presence:<hash>:offline, cleared by every slot claim) and
+reports it offline only WS_PRESENCE_TTL later, once every open connection
+has had a heartbeat. The outbox dispatcher skips the channel layer send for
+those; their notifications stay in the replay log and are picked up on the 
+next connect (?since=<seq>). Notifications of DIDs in between are deferred,
+never dropped. WS_PRESENCE needs a cache shared by the web workers and the
+dispatcher, it is off by default without REDIS_URL.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+import hashlib, logging, time
+
+logger = logging.getLogger('rest_api')
+
+
+def presence_key(did):
+    return 'presence:' + hashlib.sha256(did.encode()).hexdigest()
+
+
+def slot_keys(did):
+    prefix = presence_key(did)
+    return [f'{prefix}:{slot}' for slot in range(settings.WS_PRESENCE_SLOTS)]
+
+
+def offline_key(did):
+    return presence_key(did) + ':offline'
+
+
+async def mark_online(did, channel_name):
+    """
+    Claim a free slot for the connection. Returns its key, None if all
+    slots are taken.
+    """
+    await cache.adelete(offline_key(did))
+    for key in slot_keys(did):
+        if await cache.aadd(key, channel_name, timeout=settings.WS_PRESENCE_TTL):
+            return key
+    return None
+
+
+async def heartbeat(did, channel_name, key):
+    """
+    Refresh the connection's slot, or claim one if it was lost (or there was
+    none free so far). Returns the slot key as mark_online().
+    """
+    if key is not None and await cache.aget(key) == channel_name:
+        await cache.atouch(key, timeout=settings.WS_PRESENCE_TTL)
+        return key
+    return await mark_online(did, channel_name)
+
+
+async def mark_offline(did, channel_name, key):
+    if key is not None and await cache.aget(key) == channel_name:
+        await cache.adelete(key)
+
+
+def lookup(dids):
+    """
+    Presence of dids: (online, offline). online have a claimed slot, offline
+    have had none for at least WS_PRESENCE_TTL; the others may have an open
+    connection whose slot is about to be claimed again.
+    All of them are online if presence tracking is disabled.
+    """
+    dids = set(dids)
+    if not settings.WS_PRESENCE or not dids:
+        return dids, set()
+    slots = {key: did for did in dids for key in slot_keys(did)}
+    online = {slots[key] for key in cache.get_many(slots)}
+
+    markers = {offline_key(did): did for did in dids - online}
+    seen = cache.get_many(markers)
+    now = time.time()
+    offline = {did for key, did in markers.items() if key in seen and seen[key] <= now - settings.WS_PRESENCE_TTL}
+    first_seen = {key: now for key in markers if key not in seen}
+    if first_seen:
+        cache.set_many(first_seen, timeout=settings.WS_PRESENCE_OFFLINE_TTL)
+    return online, offline
@@ -0,0 +1,24 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline-delimited JSON (one JSON document per line).
+    Streaming views write their own lines; this renderer only handles regular
+    Response objects (e.g. errors), which are rendered as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return render_line(data)
+
+
+def render_line(data):
+    """
+    Render one NDJSON line (UUIDs, datetimes etc. handled like DRF responses).
+    """
+    return JSONRenderer().render(data) + b'\n'
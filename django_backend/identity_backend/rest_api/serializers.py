@@ -1,9 +1,12 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.utils import timezone
 from django.db import IntegrityError, transaction
 
 from .models import Identity, Request, SharedData
 from .cryptographic_utils import generate_encKey, fernet_encKey, wrap_key_w_signature
+from .counters import record_request_status
+from .avatars import open_avatar, render_variants, store_files, variant_urls
 
 import secrets, json, logging
 
@@ -19,10 +22,12 @@ class IdentitySerializer(serializers.ModelSerializer):
     - Accepts optional raw_data which will be encrypted and stored.
     - Returns decrypted_data if a valid signature is provided via the 
       serializer context (context={'signature':...})
-    - Returns the avatar URL path
+    - Returns the avatar URL path and the map of resized variants
+    - An uploaded avatar is validated, stripped and resized (avatars.py)
     """
     decrypted_data = serializers.SerializerMethodField()
     raw_data = serializers.JSONField(write_only=True, required=False)
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta: 
         model = Identity
@@ -32,6 +37,7 @@ class IdentitySerializer(serializers.ModelSerializer):
             'context',
             'description', 
             'avatar', 
+            'avatar_variants',
             'issued', 
             'is_active', 
             'salt', 
@@ -73,12 +79,30 @@ class IdentitySerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.avatar.url)
         return None 
 
+    def get_avatar_variants(self, obj):
+        return variant_urls(obj.avatar_variants, self.context.get('request'))
+
+    def validate_avatar(self, avatar):
+        """
+        Decode and normalize the upload here so invalid images are a 400; the
+        decoded image is passed on to create(), which builds the variants.
+        """
+        if avatar:
+            return open_avatar(avatar)
+        return avatar
+
     def get_decrypted_data(self, obj):
         """
         Try to decrypt and return the raw data using the provided signature in the
         serializer context (context={'signature': '...'}).
         Returns None if no signature is provided or decryption fails. 
+        If the view already decrypted the rows in parallel, the results are 
+        passed as context={'decrypted': {identity.id: data}} and reused here.
         """
+        decrypted = self.context.get('decrypted')
+        if decrypted is not None:
+            return decrypted.get(obj.id)
+
         signature = self.context.get('signature')
         if not signature:
             return None
@@ -111,16 +135,46 @@ class IdentitySerializer(serializers.ModelSerializer):
         validated_data['salt'] = secrets.token_bytes(16)
         validated_data['user'] = user
         
+        avatar = validated_data.pop('avatar', None)
         try:
             identity = Identity(**validated_data)
             if raw_data:
                 identity.store_encrypted_data(raw_data, signature)
+            files = {}
+            if avatar:
+                identity.avatar.name, identity.avatar_variants, files = render_variants(avatar)
             identity.save()
+            # Stored only once the row referencing them is committed, a rolled
+            # back insert (duplicate context/description) leaves no files behind
+            if files:
+                transaction.on_commit(lambda: store_files(files))
             return identity
         except IntegrityError as e:
             raise serializers.ValidationError({'error': ['Identity already exists for this context/description.'] })
     
 
+class IdentityMetadataSerializer(serializers.ModelSerializer):
+    """
+    Metadata-only representation of an Identity (no decryption).
+    Used for list views; decrypted data is fetched on demand.
+    """
+    avatar = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
+
+    class Meta: 
+        model = Identity
+        fields = ['id', 'context', 'description', 'avatar', 'avatar_variants', 'issued', 'is_active']
+
+    def get_avatar(self, obj):
+        request = self.context.get('request')
+        if obj.avatar and request:
+            return request.build_absolute_uri(obj.avatar.url)
+        return None
+
+    def get_avatar_variants(self, obj):
+        return variant_urls(obj.avatar_variants, self.context.get('request'))
+
+
 class IdentityActiveSerializer(serializers.Serializer):
     """
     Serializer for toggling an Identity's visibility.
@@ -137,6 +191,30 @@ class MassDeleteSerializer(serializers.Serializer):
         allow_empty=False
     )
 
+class IdentityDecryptSerializer(serializers.Serializer):
+    """
+    Validate an on-demand decryption call: holder signature plus a non-empty 
+    list of identity UUIDs.
+    """
+    signature = serializers.CharField(allow_blank=False)
+    ids = serializers.ListField(
+        child=serializers.UUIDField(format='hex_verbose'),
+        allow_empty=False,
+        max_length=100
+    )
+
+class IdentityBulkImportSerializer(serializers.Serializer):
+    """
+    Validate a bulk import: one holder signature plus a non-empty list of 
+    verifiable credentials (each checked individually by the view).
+    """
+    signature = serializers.CharField(allow_blank=False)
+    credentials = serializers.ListField(
+        child=serializers.JSONField(),
+        allow_empty=False,
+        max_length=settings.IDENTITY_BULK_IMPORT_MAX
+    )
+
 # ----------------------------------------------------------------
 # Request serializers
 # ----------------------------------------------------------------
@@ -260,15 +338,12 @@ class RequestUpdateSerializer(serializers.ModelSerializer):
             wrap_salt = secrets.token_bytes(16)
             encKey_wrapped = wrap_key_w_signature(encKey, signature_requestor, wrap_salt)
 
-            # Create SharedData entry
-            SharedData.objects.update_or_create(
-                request=instance, 
-                defaults={
-                    'enc_data': enc_data, 
-                    'encKey_wrapped': encKey_wrapped,
-                    'wrap_salt': wrap_salt
-                },
-            )
+            # SharedData entry (written below, with the status change)
+            shared_data = {
+                'enc_data': enc_data, 
+                'encKey_wrapped': encKey_wrapped,
+                'wrap_salt': wrap_salt
+            }
 
         else: 
             # Decline
@@ -277,8 +352,18 @@ class RequestUpdateSerializer(serializers.ModelSerializer):
             instance.expires_at = None 
             instance.approved_at = None 
             update_fields += ['reason', 'expires_at', 'approved_at', 'updated_at']
-            
-        instance.save(update_fields=update_fields)         
+            shared_data = None
+
+        with transaction.atomic():
+            # Lock the row: a concurrent update may have answered it since validate()
+            old_status = Request.objects.select_for_update().values_list('status', flat=True).get(pk=instance.pk)
+            if old_status != Request.Status.PENDING:
+                raise serializers.ValidationError('Request is not pending.')
+
+            if shared_data:
+                SharedData.objects.update_or_create(request=instance, defaults=shared_data)
+            instance.save(update_fields=update_fields)         
+            record_request_status(instance, old_status)
         return instance
 
 # ----------------------------------------------------------------
@@ -290,13 +375,17 @@ class ContextSerializer(serializers.ModelSerializer):
     Return the exposed identity contexts incl. absolute avatar path if available.
     """
     avatar = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta: 
         model = Identity 
-        fields = ['id', 'context', 'description', 'avatar']
+        fields = ['id', 'context', 'description', 'avatar', 'avatar_variants']
 
     def get_avatar(self, obj):
         request = self.context.get('request')
         if obj.avatar and request:
             return request.build_absolute_uri(obj.avatar.url)
         return None
+
+    def get_avatar_variants(self, obj):
+        return variant_urls(obj.avatar_variants, self.context.get('request'))
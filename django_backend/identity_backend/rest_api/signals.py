@@ -0,0 +1,71 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Profile, Identity, Request, SharedData
+from .utils import to_bytes
+from .counters import record_request_deleted
+from .versioning import bump_identities_version
+from .context_cache import invalidate_contexts
+from .deletion import forget_salts, identities_deleted
+
+
+@receiver(post_delete, sender=Identity)
+def drop_identity_keys(sender, instance, **kwargs):
+    """
+    Evict cached derived keys for the salt of a deleted identity.
+    """
+    forget_salts([to_bytes(instance.salt)])
+
+
+@receiver(post_delete, sender=SharedData)
+def drop_shared_data_keys(sender, instance, **kwargs):
+    """
+    Evict the cached KEK for the wrap salt of deleted shared data.
+    """
+    forget_salts([to_bytes(instance.wrap_salt)])
+
+
+@receiver(post_delete, sender=Profile)
+def drop_master_keys(sender, instance, **kwargs):
+    """
+    Evict the cached master key of a deleted profile.
+    """
+    forget_salts([to_bytes(instance.kdf_salt)])
+
+
+@receiver(post_delete, sender=Request)
+def update_request_counters(sender, instance, **kwargs):
+    """
+    Decrement the holder / requestor counters of a deleted request (direct
+    delete or cascade from Identity / Profile), inside the delete transaction.
+    """
+    record_request_deleted(instance)
+
+
+# Fields shown by GET /api/users/<did>/contexts/
+CONTEXT_FIELDS = {'context', 'description', 'avatar', 'avatar_variants', 'is_active'}
+
+
+@receiver(post_save, sender=Identity)
+def identity_saved(sender, instance, update_fields=None, **kwargs):
+    """
+    Invalidate the holder's contexts ETag and cached payload when a visible
+    field changed.
+    """
+    if update_fields is None or CONTEXT_FIELDS & set(update_fields):
+        bump_identities_version(instance.user_id)
+        invalidate_contexts(owner_did(instance))
+
+
+@receiver(post_delete, sender=Identity)
+def identity_deleted(sender, instance, **kwargs):
+    identities_deleted(instance.user_id, owner_did(instance))
+
+
+def owner_did(identity):
+    """
+    DID of the identity's holder, without a query if the profile is loaded.
+    """
+    if Identity.user.is_cached(identity):
+        return identity.user.did
+    return Profile.objects.filter(pk=identity.user_id).values_list('did', flat=True).first()
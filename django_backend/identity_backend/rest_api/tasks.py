@@ -0,0 +1,46 @@
+"""
+Small in-process background executor for work that must not delay the 
+response and may run after the transaction has committed (file cleanup).
+
+Jobs are best effort: they are lost if the process exits, so they must be 
+safe to skip or repeat.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction, close_old_connections
+
+import threading, logging
+
+logger = logging.getLogger('rest_api')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, settings.BACKGROUND_WORKERS), thread_name_prefix='background')
+        return _executor
+
+
+def run_job(fn, *args):
+    try:
+        fn(*args)
+    except Exception:
+        logger.exception(f"Background job {fn.__name__} failed.")
+    finally:
+        # Jobs run outside the request cycle: release their DB connection
+        close_old_connections()
+
+
+def run_in_background(fn, *args):
+    return get_executor().submit(run_job, fn, *args)
+
+
+def run_after_commit(fn, *args):
+    """
+    Submit fn(*args) once the current transaction commits (dropped on rollback).
+    """
+    transaction.on_commit(lambda: run_in_background(fn, *args))
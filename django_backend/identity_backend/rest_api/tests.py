@@ -1,3 +1,1495 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, SimpleTestCase, AsyncRequestFactory, override_settings
+from django.db import transaction
+from eth_account import Account
+from eth_account.messages import encode_typed_data
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from asgiref.testing import ApplicationCommunicator
+from concurrent.futures import ThreadPoolExecutor
+from identity_backend.middleware import JWTAuthMiddleware
+from identity_backend.routing import websocket_urlpatterns
+
+from .models import Profile, Identity, Request, RequestCounters, SharedData, Notification
+from .counters import record_request_created, record_request_status, request_stats
+from . import context_cache
+from .context_cache import contexts_key
+from .avatars import open_avatar, process_avatar, variant_urls
+from .serializers import IdentitySerializer
+from . import deletion
+from .deletion import delete_avatar_files, unhandled_relations
+from .expiry import sweep_expired
+from .outbox import dispatch_pending, group_name, notify_message, purge_dispatched, replay
+from .consumers import BackendConsumer, send_queue_metrics
+from .presence import mark_online, mark_offline, heartbeat, lookup, offline_key, slot_keys
+from .utils import notify_did
+from . import crypto_pool, cryptographic_utils
+from .crypto_pool import decrypt_identity_payload, run_ordered
+from . import veramo_client
+from .veramo_client import CircuitBreaker, VeramoUnavailable, credential_cache_ttl, get_veramo_client
+from .cryptographic_utils import DerivedKeyCache, derive_master_key, enc_data_version, get_kdf_cache
+from .api import login_response_data
+from .async_api import AsyncCreateIdentityProfileView, AsyncCreateRequestView, AsyncUserAuthenticationView
+from .api import issue_challenge, validate_challenge
+from .verifiers import EIP712Verifier, VeramoVerifier, did_to_address
+from unittest import mock
+
+import asyncio, copy, datetime, httpx, io, json, os, requests, tempfile, threading, time, unittest, uuid
+
+# Fixed test keys (never used outside the test suite)
+ISSUER_KEY = '0x' + '11' * 32
+OTHER_KEY = '0x' + '22' * 32
+CHAIN_ID = 11155111
+
+
+def did_for(key):
+    return f'did:ethr:sepolia:{Account.from_key(key).address}'
+
+
+def sign_document(document, key, primary_type, types):
+    """
+    Attach an 'EthereumEip712Signature2021' proof the way Veramo's
+    createVerifiableCredentialEIP712 / createVerifiablePresentationEIP712 do.
+    """
+    proof = {
+        'verificationMethod': document.get('issuer', {}).get('id', document.get('holder')) + '#controller',
+        'created': '2025-01-01T00:00:00.000Z',
+        'proofPurpose': 'assertionMethod',
+        'type': 'EthereumEip712Signature2021',
+    }
+    domain = {'chainId': CHAIN_ID, 'name': primary_type, 'version': '1'}
+    typed_data = {
+        'types': types,
+        'primaryType': primary_type,
+        'domain': domain,
+        'message': {**document, 'proof': proof},
+    }
+    signed = Account.sign_message(encode_typed_data(full_message=typed_data), private_key=key)
+    return {
+        **document,
+        'proof': {
+            **proof,
+            'proofValue': '0x' + signed.signature.hex().removeprefix('0x'),
+            'eip712': {'domain': domain, 'types': types, 'primaryType': primary_type},
+        },
+    }
+
+
+CREDENTIAL_TYPES = {
+    'EIP712Domain': [
+        {'name': 'name', 'type': 'string'},
+        {'name': 'version', 'type': 'string'},
+        {'name': 'chainId', 'type': 'uint256'},
+    ],
+    'VerifiableCredential': [
+        {'name': '@context', 'type': 'string[]'},
+        {'name': 'credentialSubject', 'type': 'CredentialSubject'},
+        {'name': 'issuanceDate', 'type': 'string'},
+        {'name': 'issuer', 'type': 'Issuer'},
+        {'name': 'proof', 'type': 'Proof'},
+        {'name': 'type', 'type': 'string[]'},
+    ],
+    'CredentialSubject': [
+        {'name': 'context', 'type': 'string'},
+        {'name': 'description', 'type': 'string'},
+        {'name': 'id', 'type': 'string'},
+    ],
+    'Issuer': [{'name': 'id', 'type': 'string'}],
+    'Proof': [
+        {'name': 'created', 'type': 'string'},
+        {'name': 'proofPurpose', 'type': 'string'},
+        {'name': 'type', 'type': 'string'},
+        {'name': 'verificationMethod', 'type': 'string'},
+    ],
+}
+
+PRESENTATION_TYPES = {
+    'EIP712Domain': CREDENTIAL_TYPES['EIP712Domain'],
+    'VerifiablePresentation': [
+        {'name': '@context', 'type': 'string[]'},
+        {'name': 'challenge', 'type': 'string'},
+        {'name': 'holder', 'type': 'string'},
+        {'name': 'issuanceDate', 'type': 'string'},
+        {'name': 'proof', 'type': 'Proof'},
+        {'name': 'type', 'type': 'string[]'},
+    ],
+    'Proof': CREDENTIAL_TYPES['Proof'],
+}
+
+
+def make_credential(key=ISSUER_KEY, issuer_did=None):
+    issuer_did = issuer_did or did_for(key)
+    credential = {
+        '@context': ['https://www.w3.org/2018/credentials/v1'],
+        'type': ['VerifiableCredential'],
+        'issuer': {'id': issuer_did},
+        'issuanceDate': '2025-01-01T00:00:00.000Z',
+        'credentialSubject': {'id': issuer_did, 'context': 'Work', 'description': 'Employee profile'},
+    }
+    return sign_document(credential, key, 'VerifiableCredential', CREDENTIAL_TYPES)
+
+
+def make_presentation(challenge, key=ISSUER_KEY, holder_did=None):
+    presentation = {
+        '@context': ['https://www.w3.org/2018/credentials/v1'],
+        'type': ['VerifiablePresentation'],
+        'holder': holder_did or did_for(key),
+        'issuanceDate': '2025-01-01T00:00:00.000Z',
+        'challenge': challenge,
+    }
+    return sign_document(presentation, key, 'VerifiablePresentation', PRESENTATION_TYPES)
+
+
+def parity_cases():
+    """
+    (name, kind, document, challenge, expected verified) shared by both backends.
+    """
+    tampered = make_credential()
+    tampered['credentialSubject']['description'] = 'Something else'
+    impersonated = make_credential(key=OTHER_KEY, issuer_did=did_for(ISSUER_KEY))
+    return [
+        ('valid credential', 'credential', make_credential(), None, True),
+        ('tampered credential', 'credential', tampered, None, False),
+        ('wrong signer', 'credential', impersonated, None, False),
+        ('valid presentation', 'presentation', make_presentation('abc123'), 'abc123', True),
+        ('presentation wrong signer', 'presentation', make_presentation('abc123', OTHER_KEY, did_for(ISSUER_KEY)), 'abc123', False),
+    ]
+
+
+def run_case(verifier, kind, document, challenge):
+    if kind == 'credential':
+        return verifier.verify_credential(copy.deepcopy(document))
+    return verifier.verify_presentation(copy.deepcopy(document), challenge)
+
+
+def track_in_flight(state, value):
+    """
+    run_bounded job: records the highest number of jobs running at once.
+    """
+    with state['lock']:
+        state['running'] += 1
+        state['max'] = max(state['max'], state['running'])
+    time.sleep(0.01)
+    with state['lock']:
+        state['running'] -= 1
+    return value * 2
+
+
+def sleep_and_return(value, delay):
+    time.sleep(delay)
+    return value
+
+
+def fail_on_three(value):
+    if value == 3:
+        raise ValueError('bad item')
+    return value
+
+
+class CryptoPoolTests(SimpleTestCase):
+    def setUp(self):
+        # Fresh shared executor per test, so overridden settings apply
+        self.saved_executor, crypto_pool._executor = crypto_pool._executor, None
+
+    def tearDown(self):
+        if crypto_pool._executor is not None:
+            crypto_pool._executor.shutdown(wait=True, cancel_futures=True)
+        crypto_pool._executor = self.saved_executor
+
+    def test_results_in_input_order(self):
+        # Later items finish first
+        arg_list = [(value, 0.002 * (10 - value)) for value in range(10)]
+        self.assertEqual(run_ordered(sleep_and_return, arg_list, limit=4), list(range(10)))
+
+    @override_settings(IDENTITY_DECRYPT_WORKERS=8)
+    def test_limit_bounds_in_flight_jobs(self):
+        state = {'lock': threading.Lock(), 'running': 0, 'max': 0}
+        results = run_ordered(track_in_flight, [(state, value) for value in range(12)], limit=3)
+        self.assertEqual(results, [value * 2 for value in range(12)])
+        self.assertEqual(state['max'], 3)
+
+    def test_exception_propagates(self):
+        with self.assertRaisesMessage(ValueError, 'bad item'):
+            run_ordered(fail_on_three, [(value,) for value in range(6)], limit=2)
+
+    @override_settings(IDENTITY_DECRYPT_WORKERS=2)
+    def test_thread_and_process_executors_agree(self):
+        signature, master_salt = '0xsig', os.urandom(16)
+        master_key = derive_master_key(signature.encode(), master_salt)
+        arg_list = []
+        for n in range(4):
+            salt = os.urandom(16)
+            enc_data = crypto_pool.encrypt_identity_payload(json.dumps({'n': n}).encode(), signature, salt, master_key)
+            arg_list.append((enc_data, signature, salt, master_salt))
+        arg_list.append((b'garbage', signature, os.urandom(16), master_salt))
+
+        results = {}
+        for kind in ('thread', 'process'):
+            with override_settings(IDENTITY_DECRYPT_EXECUTOR=kind):
+                results[kind] = run_ordered(decrypt_identity_payload, arg_list, limit=2)
+                crypto_pool._executor.shutdown(wait=True)
+                crypto_pool._executor = None
+
+        self.assertEqual(results['thread'], [{'n': n} for n in range(4)] + [None])
+        self.assertEqual(results['process'], results['thread'])
+
+
+class DerivedKeyCacheTests(SimpleTestCase):
+    def derive(self, cache, signature, salt):
+        return cache.get_or_derive(signature, salt, 1, lambda: os.urandom(32))
+
+    def test_lru_eviction(self):
+        cache = DerivedKeyCache(max_size=2, ttl=60)
+        a = self.derive(cache, b'sig', b'a')
+        self.derive(cache, b'sig', b'b')
+        self.assertEqual(self.derive(cache, b'sig', b'a'), a)  # 'a' is now the most recent
+        self.derive(cache, b'sig', b'c')                          # evicts 'b'
+        self.assertEqual(self.derive(cache, b'sig', b'a'), a)
+        self.assertEqual(cache.stats(), {'size': 2, 'max_size': 2, 'hits': 2, 'misses': 3})
+        self.derive(cache, b'sig', b'b')
+        self.assertEqual(cache.stats()['misses'], 4)
+
+    def test_ttl_expiry(self):
+        clock = mock.Mock(monotonic=mock.Mock(return_value=1000.0))
+        with mock.patch('rest_api.cryptographic_utils.time', clock):
+            cache = DerivedKeyCache(max_size=8, ttl=60)
+            key = self.derive(cache, b'sig', b'a')
+            clock.monotonic.return_value = 1059.0
+            self.assertEqual(self.derive(cache, b'sig', b'a'), key)
+            clock.monotonic.return_value = 1061.0
+            self.assertNotEqual(self.derive(cache, b'sig', b'a'), key)
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_concurrent_misses_derive_once(self):
+        cache = DerivedKeyCache(max_size=8, ttl=60)
+        started, release, calls = threading.Event(), threading.Event(), []
+
+        def derive():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return b'key'
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(cache.get_or_derive, b'sig', b'a', 1, derive)
+            started.wait(5)
+            others = [executor.submit(cache.get_or_derive, b'sig', b'a', 1, derive) for _ in range(3)]
+            time.sleep(0.05)
+            release.set()
+            results = [future.result(5) for future in [first] + others]
+        self.assertEqual(results, [b'key'] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_failed_derivation_not_cached(self):
+        cache = DerivedKeyCache(max_size=8, ttl=60)
+        with self.assertRaises(ValueError):
+            cache.get_or_derive(b'sig', b'a', 1, mock.Mock(side_effect=ValueError))
+        self.assertEqual(cache.get_or_derive(b'sig', b'a', 1, lambda: b'key'), b'key')
+
+    def test_invalidate_salt(self):
+        cache = DerivedKeyCache(max_size=8, ttl=60)
+        self.derive(cache, b'sig', b'a')
+        self.derive(cache, b'other', b'a')
+        kept = self.derive(cache, b'sig', b'b')
+        cache.invalidate_salt(b'a')
+        self.assertEqual(cache.stats()['size'], 1)
+        self.assertEqual(self.derive(cache, b'sig', b'b'), kept)
+        self.assertEqual(cache.stats()['misses'], 3)
+        self.derive(cache, b'sig', b'a')
+        self.assertEqual(cache.stats()['misses'], 4)
+
+
+class IdentityKeyFormatTests(TestCase):
+    signature = '0xsignature'
+
+    def setUp(self):
+        self.holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+
+    def create_identity(self, data, version):
+        identity = Identity(user=self.holder, context='ctx', description=json.dumps(data), salt=os.urandom(16), is_active=True)
+        with override_settings(IDENTITY_ENC_VERSION=version):
+            identity.store_encrypted_data(data, self.signature)
+        identity.save()
+        return Identity.objects.select_related('user').get(pk=identity.pk)
+
+    def test_round_trip(self):
+        for version in (1, 2):
+            identity = self.create_identity({'v': version}, version)
+            self.assertEqual(enc_data_version(identity.enc_data), version)
+            self.assertEqual(identity.retrieve_decrypted_data(self.signature), {'v': version})
+
+    def test_reads_v1_and_upgrades(self):
+        identity = self.create_identity({'name': 'a'}, 1)
+        self.assertTrue(identity.needs_key_upgrade)
+        self.assertEqual(identity.retrieve_decrypted_data(self.signature), {'name': 'a'})
+
+        self.assertEqual(Identity.upgrade_keys([identity], {identity.id: {'name': 'a'}}, self.signature), 1)
+        identity = Identity.objects.select_related('user').get(pk=identity.pk)
+        self.assertEqual(enc_data_version(identity.enc_data), 2)
+        self.assertFalse(identity.needs_key_upgrade)
+        self.assertEqual(identity.retrieve_decrypted_data(self.signature), {'name': 'a'})
+
+    def test_wrong_signature_or_salt(self):
+        for version in (1, 2):
+            identity = self.create_identity({'v': version}, version)
+            self.assertIsNone(identity.retrieve_decrypted_data('0xother'))
+            identity.salt = os.urandom(16)
+            self.assertIsNone(identity.retrieve_decrypted_data(self.signature))
+
+    @override_settings(IDENTITY_DECRYPT_PARALLEL=True, IDENTITY_DECRYPT_MAX_CONCURRENCY=4)
+    def test_master_key_derived_once(self):
+        identities = [self.create_identity({'n': n}, 2) for n in range(4)] + [self.create_identity({'n': 4}, 1)]
+        get_kdf_cache().clear()
+        with mock.patch('rest_api.cryptographic_utils.pbkdf2_sha256', wraps=cryptographic_utils.pbkdf2_sha256) as pbkdf2, \
+                mock.patch('rest_api.crypto_pool.derive_master_key', wraps=derive_master_key) as derive:
+            decrypted = crypto_pool.decrypt_identities(identities, self.signature)
+        self.assertEqual(sorted(data['n'] for data in decrypted.values()), list(range(5)))
+        derive.assert_called_once()
+        # The master key and the v1 row's own key, nothing in the workers
+        self.assertEqual(pbkdf2.call_count, 2)
+
+    def test_migrate_command_idempotent(self):
+        for n in range(2):
+            self.create_identity({'n': n}, 1)
+        args = ['migrate_identity_keys', '--did', self.holder.did, '--signature', self.signature]
+
+        out = io.StringIO()
+        call_command(*args, stdout=out)
+        self.assertIn('Migrated 2 identities', out.getvalue())
+        stored = sorted(bytes(enc_data) for enc_data in Identity.objects.values_list('enc_data', flat=True))
+
+        out = io.StringIO()
+        call_command(*args, stdout=out)
+        self.assertIn('Migrated 0 identities', out.getvalue())
+        self.assertEqual(sorted(bytes(enc_data) for enc_data in Identity.objects.values_list('enc_data', flat=True)), stored)
+
+        out = io.StringIO()
+        call_command('migrate_identity_keys', stdout=out)
+        self.assertIn('0 legacy identities left', out.getvalue())
+        for identity in Identity.objects.select_related('user'):
+            self.assertIn('n', identity.retrieve_decrypted_data(self.signature))
+
+
+class StreamedIdentitiesTests(TestCase):
+    signature = '0xsignature'
+
+    def setUp(self):
+        self.holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        self.token = login_response_data(self.holder.user, self.holder, self.holder.did)['access']
+        for n, version in enumerate((1, 2, 2)):
+            identity = Identity(user=self.holder, context=f'ctx{n}', description='d', salt=os.urandom(16), is_active=True)
+            with override_settings(IDENTITY_ENC_VERSION=version):
+                identity.store_encrypted_data({'n': n}, self.signature)
+            identity.save()
+
+    async def test_async_stream_and_deferred_upgrade(self):
+        with mock.patch('rest_api.api.run_in_background') as background:
+            response = await self.async_client.post(
+                '/api/me/identities/', {'signature': self.signature}, content_type='application/json',
+                headers={'Accept': 'application/x-ndjson', 'Authorization': f'Bearer {self.token}'})
+            self.assertTrue(response.is_async)
+            # Nothing is upgraded while the body is produced
+            background.assert_not_called()
+            body = b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual(sorted(line['identity']['decrypted_data']['n'] for line in lines), [0, 1, 2])
+
+        fn, identities, decrypted, signature = background.call_args.args
+        self.assertEqual(await database_sync_to_async(fn)(identities, decrypted, signature), 1)
+        self.assertFalse(any([identity.needs_key_upgrade async for identity in Identity.objects.all()]))
+
+
+@override_settings(VERAMO_BREAKER_THRESHOLD=3, VERAMO_BREAKER_RESET=30, VERAMO_MAX_RETRIES=0)
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.saved_client, veramo_client._client = veramo_client._client, None
+        self.client = get_veramo_client()
+        self.clock = mock.Mock(monotonic=mock.Mock(return_value=1000.0), perf_counter=mock.Mock(return_value=0.0))
+        patcher = mock.patch('rest_api.veramo_client.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        veramo_client._client = self.saved_client
+
+    def post(self, session_post):
+        with mock.patch.object(self.client.session, 'post', session_post):
+            return self.client.post('verify-presentation', {})
+
+    def test_open_half_open_closed(self):
+        down = mock.Mock(side_effect=requests.exceptions.ConnectionError('refused'))
+        for _ in range(3):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.post(down)
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.OPEN)
+
+        # Open: fails fast without calling the agent
+        with self.assertRaises(VeramoUnavailable):
+            self.post(down)
+        self.assertEqual(down.call_count, 3)
+        self.clock.monotonic.return_value = 1029.0
+        with self.assertRaises(VeramoUnavailable):
+            self.post(down)
+
+        # Half-open after VERAMO_BREAKER_RESET: one failed probe opens it again
+        self.clock.monotonic.return_value = 1030.0
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.post(down)
+        self.assertEqual(down.call_count, 4)
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.OPEN)
+
+        # A successful probe closes it
+        self.clock.monotonic.return_value = 1060.0
+        up = mock.Mock(return_value=mock.Mock(status_code=200, ok=True, json=mock.Mock(return_value={'verified': True})))
+        self.assertEqual(self.post(up), {'verified': True})
+        self.assertEqual(self.client.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.client.metrics()['endpoints']['verify-presentation']['rejected'], 2)
+
+
+@override_settings(VERAMO_CREDENTIAL_CACHE_TTL=3600)
+class CredentialCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.saved_client, veramo_client._client = veramo_client._client, None
+        self.now = timezone.now().replace(microsecond=0)
+
+    def tearDown(self):
+        veramo_client._client = self.saved_client
+
+    def credential(self, expires_in=None):
+        credential = {'issuer': {'id': 'did:ethr:issuer'}, 'credentialSubject': {'n': str(uuid.uuid4())}}
+        if expires_in is not None:
+            expires = self.now + datetime.timedelta(seconds=expires_in)
+            credential['expirationDate'] = expires.strftime('%Y-%m-%dT%H:%M:%SZ')
+        return credential
+
+    def test_ttl_capped_at_expiration(self):
+        with mock.patch('rest_api.veramo_client.timezone.now', return_value=self.now):
+            self.assertEqual(credential_cache_ttl(self.credential()), 3600)
+            self.assertEqual(credential_cache_ttl(self.credential(60)), 60)
+            self.assertEqual(credential_cache_ttl(self.credential(7200)), 3600)
+            self.assertEqual(credential_cache_ttl(self.credential(-1)), 0)
+            self.assertEqual(credential_cache_ttl({'expirationDate': 'soon'}), 0)
+            self.assertEqual(credential_cache_ttl({'validUntil': self.credential(60)['expirationDate']}), 60)
+
+    def test_expired_credentials_not_cached(self):
+        client = get_veramo_client()
+        expired, valid = self.credential(-1), self.credential(600)
+        verified = {'verified': True, 'issuer': 'did:ethr:issuer'}
+
+        with mock.patch.object(client, 'post', return_value=verified) as post:
+            for _ in range(2):
+                client.verify_credential(expired)
+                client.verify_credential(valid)
+        self.assertEqual(post.call_count, 3)
+
+        batch = [self.credential(-1), self.credential(600)]
+        with mock.patch.object(client, 'post', return_value={'results': [verified, verified]}) as post:
+            client.verify_credentials(batch)
+            self.assertEqual(client.verify_credentials(batch), [verified, verified])
+        self.assertEqual(post.call_count, 2)
+        self.assertEqual(post.call_args.args[1], {'credentials': batch[:1]})
+
+
+@override_settings(VERAMO_BATCH_SIZE=2, VERAMO_CREDENTIAL_CACHE_TTL=0)
+class BulkIdentityImportTests(TestCase):
+    def setUp(self):
+        self.saved_client, veramo_client._client = veramo_client._client, None
+        self.holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        token = login_response_data(self.holder.user, self.holder, self.holder.did)['access']
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        patcher = mock.patch('rest_api.api.get_verifier', return_value=VeramoVerifier())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        veramo_client._client = self.saved_client
+
+    def credential(self, context, issuer=None, **subject):
+        return {
+            'issuer': {'id': issuer or self.holder.did}, 
+            'credentialSubject': {'context': context, 'description': 'd', **subject},
+        }
+
+    def agent(self, endpoint, payload):
+        """
+        Fake 'verify-credentials': rejects credentials marked 'forged' and 
+        answers one result short for a batch containing a 'truncated' one.
+        """
+        results = [
+            {'verified': not vc['credentialSubject'].get('forged'), 'issuer': vc['issuer']} 
+            for vc in payload['credentials']
+        ]
+        if any(vc['credentialSubject'].get('truncated') for vc in payload['credentials']):
+            results = results[:-1]
+        return {'results': results}
+
+    def test_batches_and_partial_failures(self):
+        credentials = [
+            self.credential('a'),
+            self.credential('b', forged=True),
+            self.credential('c', issuer='did:ethr:other'),
+            self.credential('d'),
+            self.credential('a'),
+            self.credential('e', truncated=True),
+        ]
+        with mock.patch.object(get_veramo_client(), 'post', side_effect=self.agent) as post:
+            response = self.client.post('/api/identity/bulk/', {'signature': '0xsig', 'credentials': credentials}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.json()['results']],
+                         ['created', 'invalid', 'invalid', 'created', 'conflict', 'invalid'])
+        self.assertEqual(response.json()['created'], 2)
+        # 5 structurally valid credentials in chunks of VERAMO_BATCH_SIZE
+        self.assertEqual([len(call.args[1]['credentials']) for call in post.call_args_list], [2, 2, 1])
+        self.assertEqual(sorted(Identity.objects.values_list('context', flat=True)), ['a', 'd'])
+        self.assertEqual(Identity.objects.get(context='a').retrieve_decrypted_data('0xsig'), {})
+
+    def test_rejects_oversized_import(self):
+        credentials = [self.credential(f'c{i}') for i in range(settings.IDENTITY_BULK_IMPORT_MAX + 1)]
+        with mock.patch.object(get_veramo_client(), 'post') as post:
+            response = self.client.post('/api/identity/bulk/', {'signature': '0xsig', 'credentials': credentials}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('credentials', response.json())
+        post.assert_not_called()
+
+    def test_agent_unavailable(self):
+        down = requests.exceptions.ConnectionError('refused')
+        with mock.patch.object(get_veramo_client(), 'post', side_effect=down):
+            response = self.client.post('/api/identity/bulk/', {'signature': '0xsig', 'credentials': [self.credential('a')]}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Identity.objects.exists())
+
+
+@override_settings(CHALLENGE_MODE='signed', VERAMO_MAX_RETRIES=0, VERAMO_CREDENTIAL_CACHE_TTL=0)
+class AsyncVeramoTests(TestCase):
+    def setUp(self):
+        self.saved_client, veramo_client._client = veramo_client._client, None
+        self.factory = AsyncRequestFactory()
+
+    def tearDown(self):
+        veramo_client._client = self.saved_client
+
+    def agent(self, handler):
+        """
+        Route the async Veramo client to handler(request); returns the httpx 
+        clients it opens.
+        """
+        opened, async_client = [], httpx.AsyncClient
+
+        def open_client(**options):
+            opened.append(async_client(transport=httpx.MockTransport(handler), **options))
+            return opened[-1]
+
+        patcher = mock.patch('rest_api.veramo_client.httpx.AsyncClient', side_effect=open_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return opened
+
+    def post(self, view, body, **headers):
+        request = self.factory.post('/', json.dumps(body), content_type='application/json', headers=headers)
+        request.session = None  # signed challenges
+        return view.as_view()(request)
+
+    async def test_client_closed_per_call(self):
+        opened = self.agent(lambda request: httpx.Response(200, json={'verified': True}))
+        client = get_veramo_client()
+        for _ in range(2):
+            self.assertEqual(await client.apost('verify-presentation', {}), {'verified': True})
+        self.assertEqual(len(opened), 2)
+        self.assertTrue(all(c.is_closed for c in opened))
+
+    @override_settings(VERAMO_ASYNC_SHARED_POOL=True)
+    async def test_shared_pool(self):
+        opened = self.agent(lambda request: httpx.Response(200, json={'verified': True}))
+        client = get_veramo_client()
+        for _ in range(2):
+            await client.apost('verify-presentation', {})
+        self.assertEqual(len(opened), 1)
+        self.assertFalse(opened[0].is_closed)
+        await opened[0].aclose()
+
+    async def test_login(self):
+        did = did_for(ISSUER_KEY)
+        self.agent(lambda request: httpx.Response(200, json={'verified': True, 'issuer': did}))
+        presentation = make_presentation(issue_challenge(None, 'login_challenge'))
+
+        response = await self.post(AsyncUserAuthenticationView, {'presentation': presentation})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('access', json.loads(response.content))
+        self.assertTrue(await Profile.objects.filter(did=did).aexists())
+
+        # Challenges are single use
+        response = await self.post(AsyncUserAuthenticationView, {'presentation': presentation})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_login_agent_down(self):
+        def refuse(request):
+            raise httpx.ConnectError('refused', request=request)
+        self.agent(refuse)
+        presentation = make_presentation(issue_challenge(None, 'login_challenge'))
+        response = await self.post(AsyncUserAuthenticationView, {'presentation': presentation})
+        self.assertEqual(response.status_code, 503)
+
+    async def test_create_identity_string_issuer(self):
+        self.agent(lambda request: httpx.Response(200, json={'verified': True}))
+        profile = await Profile.objects.acreate(user=await User.objects.acreate(username='holder'), did='did:ethr:holder')
+        token = (await sync_to_async(login_response_data)(profile.user, profile, profile.did))['access']
+        subject = {'context': 'Work', 'description': 'd', 'name': 'A'}
+
+        for issuer, expected in (('did:ethr:other', 403), ('did:ethr:holder', 201), ({'id': 'did:ethr:other'}, 403)):
+            vc = {'issuer': issuer, 'credentialSubject': {**subject, 'description': str(issuer)}}
+            request = self.factory.post('/', {'credential': json.dumps(vc), 'signature': '0xsig'},
+                                        headers={'Authorization': f'Bearer {token}'})
+            response = await AsyncCreateIdentityProfileView.as_view()(request)
+            self.assertEqual(response.status_code, expected, response.content)
+
+    async def test_create_request_needs_token(self):
+        response = await self.post(AsyncCreateRequestView, {})
+        self.assertEqual(response.status_code, 401)
+        response = await self.post(AsyncCreateRequestView, {}, Authorization='Bearer invalid')
+        self.assertEqual(response.status_code, 401)
+
+
+class EIP712VerifierTests(SimpleTestCase):
+    def setUp(self):
+        self.verifier = EIP712Verifier()
+
+    def test_cases(self):
+        for name, kind, document, challenge, expected in parity_cases():
+            with self.subTest(name):
+                result = run_case(self.verifier, kind, document, challenge)
+                self.assertIs(result['verified'], expected)
+
+    def test_challenge_mismatch(self):
+        # Stricter than the agent: verifyPresentationEIP712 ignores the challenge
+        # (the views compare it with the issued one before verification).
+        result = self.verifier.verify_presentation(make_presentation('abc123'), 'other')
+        self.assertFalse(result['verified'])
+
+    def test_issuer_shape(self):
+        credential = make_credential()
+        self.assertEqual(self.verifier.verify_credential(credential)['issuer'], credential['issuer'])
+        presentation = make_presentation('abc123')
+        self.assertEqual(self.verifier.verify_presentation(presentation, 'abc123')['issuer'], presentation['holder'])
+
+    def test_missing_proof(self):
+        credential = make_credential()
+        del credential['proof']
+        self.assertFalse(self.verifier.verify_credential(credential)['verified'])
+
+    def test_did_to_address(self):
+        address = Account.from_key(ISSUER_KEY).address
+        public_key = Account.from_key(ISSUER_KEY)._key_obj.public_key.to_compressed_bytes().hex()
+        self.assertEqual(did_to_address(f'did:ethr:{address}'), address)
+        self.assertEqual(did_to_address(f'did:ethr:sepolia:0x{public_key}'), address)
+        self.assertEqual(did_to_address(f'did:pkh:eip155:1:{address.lower()}'), address)
+        with self.assertRaises(ValueError):
+            did_to_address('did:web:example.com')
+
+
+@unittest.skipUnless(os.getenv('VERAMO_PARITY_URL'), 'VERAMO_PARITY_URL not set (running veramo_backend_agent required)')
+class VerifierParityTests(TestCase):
+    """
+    Both backends must agree on 'verified' and 'issuer' for the same documents.
+    """
+    def test_parity(self):
+        with override_settings(VERAMO_URL=os.getenv('VERAMO_PARITY_URL').rstrip('/'), VERAMO_CREDENTIAL_CACHE_TTL=0):
+            from . import veramo_client
+            veramo_client._client = None
+            try:
+                for name, kind, document, challenge, _ in parity_cases():
+                    with self.subTest(name):
+                        local = run_case(EIP712Verifier(), kind, document, challenge)
+                        remote = run_case(VeramoVerifier(), kind, document, challenge)
+                        self.assertEqual(local['verified'], bool(remote['verified']))
+                        self.assertEqual(local['issuer'], remote['issuer'])
+            finally:
+                veramo_client._client = None
+
+
+@override_settings(CHALLENGE_MODE='signed')
+class SignedChallengeTests(SimpleTestCase):
+    def test_one_time_use(self):
+        challenge = issue_challenge(None, 'login_challenge')
+        validate_challenge(None, 'login_challenge', challenge)
+        with self.assertRaisesMessage(ValidationError, 'already used'):
+            validate_challenge(None, 'login_challenge', challenge)
+
+    def test_rejects_tampered_and_other_purpose(self):
+        challenge = issue_challenge(None, 'request_challenge')
+        for received in (challenge + 'x', challenge, None):
+            with self.subTest(received), self.assertRaises(ValidationError):
+                validate_challenge(None, 'login_challenge', received)
+
+    def test_expired(self):
+        challenge = issue_challenge(None, 'login_challenge')
+        with override_settings(CHALLENGE_MAX_AGE=-1), self.assertRaisesMessage(ValidationError, 'expired'):
+            validate_challenge(None, 'login_challenge', challenge)
+
+
+class RequestListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        cls.requestor = Profile.objects.create(user=User.objects.create(username='requestor'), did='did:ethr:requestor')
+        for i in range(7):
+            identity = Identity.objects.create(
+                user=cls.holder, context=f'ctx{i}', description='d', enc_data=b'x', salt=b's', is_active=True)
+            Request.objects.create(requestor=cls.requestor, holder=cls.holder, context=identity, purpose=f'p{i}')
+
+    def setUp(self):
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.holder.user)
+
+    def test_walks_all_pages_without_count(self):
+        expected = [str(pk) for pk in Request.objects.order_by('-created_at', '-id').values_list('id', flat=True)]
+        seen, url = [], '/api/me/requests/?limit=3'
+        while url:
+            body = self.client.get(url).json()
+            self.assertNotIn('count', body)
+            seen += [row['id'] for row in body['results']]
+            url = body['next']
+        self.assertEqual(seen, expected)
+
+    def test_previous_link_and_count(self):
+        first = self.client.get('/api/me/requests/?limit=3&count=true').json()
+        self.assertEqual(first['count'], 7)
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual([r['id'] for r in back['results']], [r['id'] for r in first['results']])
+
+    def test_direction(self):
+        # Self-requests show up in both scans but only once in the page
+        identity = Identity.objects.filter(user=self.holder).first()
+        own = Request.objects.create(requestor=self.holder, holder=self.holder, context=identity, purpose='own')
+        both = self.client.get('/api/me/requests/?limit=5&count=true').json()
+        self.assertEqual(both['count'], 8)
+        self.assertEqual(both['results'][0]['id'], str(own.id))
+        self.assertEqual(len({r['id'] for r in both['results']}), 5)
+        outgoing = self.client.get('/api/me/requests/?direction=outgoing').json()
+        self.assertEqual([r['id'] for r in outgoing['results']], [str(own.id)])
+        incoming = self.client.get('/api/me/requests/?direction=incoming&count=true').json()
+        self.assertEqual(incoming['count'], 8)
+        self.assertEqual(self.client.get('/api/me/requests/?direction=sideways').status_code, 400)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/me/requests/?cursor=nope').status_code, 400)
+
+
+class RequestCountersTests(TestCase):
+    def setUp(self):
+        self.holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        self.requestor = Profile.objects.create(user=User.objects.create(username='requestor'), did='did:ethr:requestor')
+        self.identities = [
+            Identity.objects.create(user=self.holder, context=f'ctx{i}', description='d', enc_data=b'x', salt=b's', is_active=True)
+            for i in range(3)
+        ]
+        self.requests = []
+        for identity in self.identities:
+            req = Request.objects.create(requestor=self.requestor, holder=self.holder, context=identity, purpose='p')
+            record_request_created(req)
+            self.requests.append(req)
+
+    def test_create_update_delete(self):
+        req = self.requests[0]
+        req.status = Request.Status.APPROVED
+        req.save()
+        record_request_status(req, Request.Status.PENDING)
+        self.assertEqual(request_stats(self.holder)['incoming'], {'pending': 2, 'approved': 1, 'declined': 0, 'expired': 0})
+        self.assertEqual(request_stats(self.requestor)['outgoing'], {'pending': 2, 'approved': 1, 'declined': 0, 'expired': 0})
+
+        # Cascade from the identity
+        self.identities[1].delete()
+        self.assertEqual(request_stats(self.holder)['incoming'], {'pending': 1, 'approved': 1, 'declined': 0, 'expired': 0})
+        self.assertEqual(request_stats(self.requestor)['outgoing']['pending'], 1)
+
+    def test_profile_delete(self):
+        self.holder.delete()
+        self.assertEqual(request_stats(self.requestor)['outgoing'], {'pending': 0, 'approved': 0, 'declined': 0, 'expired': 0})
+        self.assertFalse(RequestCounters.objects.filter(profile_id=self.holder.pk).exists())
+
+    def test_stats_endpoint(self):
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(self.holder.user)
+        body = client.get('/api/me/requests/stats/').json()
+        self.assertEqual(body['incoming']['pending'], 3)
+        self.assertEqual(body['outgoing']['pending'], 0)
+
+    def test_repair(self):
+        RequestCounters.objects.filter(profile=self.holder).update(incoming_pending=42)
+        RequestCounters.objects.filter(profile=self.requestor).delete()
+        call_command('repair_request_counters', stdout=io.StringIO())
+        self.assertEqual(request_stats(self.holder)['incoming']['pending'], 3)
+        self.assertEqual(request_stats(self.requestor)['outgoing']['pending'], 3)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        self.requestor = Profile.objects.create(user=User.objects.create(username='requestor'), did='did:ethr:requestor')
+        self.identity = Identity.objects.create(
+            user=self.holder, context='ctx', description='d', enc_data=b'x', salt=b's', is_active=True)
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.requestor.user)
+        cache.clear()
+
+    def revalidate(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        return first['ETag'], self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_requests(self):
+        etag, second = self.revalidate('/api/me/requests/')
+        self.assertEqual(second.status_code, 304)
+
+        req = Request.objects.create(requestor=self.requestor, holder=self.holder, context=self.identity, purpose='p')
+        record_request_created(req)
+        # force_authenticate keeps the user instance (and its cached profile)
+        self.client.force_authenticate(User.objects.get(pk=self.requestor.user_id))
+        third = self.client.get('/api/me/requests/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(len(third.json()['results']), 1)
+
+    def test_contexts(self):
+        url = f'/api/users/{self.holder.did}/contexts/'
+        etag, second = self.revalidate(url)
+        self.assertEqual(second.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.identity.is_active = False
+            self.identity.save(update_fields=['is_active'])
+        third = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(third.json()['contexts'], [])
+
+
+class ContextCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.holder.user)
+        self.url = f'/api/users/{self.holder.did}/contexts/'
+
+    def create_identity(self, context):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Identity.objects.create(
+                user=self.holder, context=context, description='d', enc_data=b'x', salt=b's', is_active=True)
+
+    def test_hit_without_queries(self):
+        self.create_identity('a')
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            body = self.client.get(self.url).json()
+        self.assertEqual([c['context'] for c in body['contexts']], ['a'])
+
+    def test_invalidated_on_create_and_delete(self):
+        self.assertEqual(self.client.get(self.url).json()['contexts'], [])
+        identity = self.create_identity('a')
+        self.assertEqual(len(self.client.get(self.url).json()['contexts']), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            identity.delete()
+        self.assertEqual(self.client.get(self.url).json()['contexts'], [])
+
+    def test_stale_served_while_rebuilding(self):
+        self.create_identity('a')
+        self.client.get(self.url)
+        key = contexts_key(self.holder.did)
+        cache.delete(key)
+        cache.add(key + ':lock', 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(self.url).json()['contexts']), 1)
+
+    def test_rebuild_racing_invalidation_not_cached(self):
+        self.create_identity('a')
+        build = context_cache.build_contexts_entry
+
+        def racing_build(did):
+            entry = build(did)
+            # A writer commits (and invalidates) while this rebuild runs
+            self.create_identity('b')
+            return entry
+
+        with mock.patch('rest_api.context_cache.build_contexts_entry', side_effect=racing_build):
+            self.assertEqual(len(self.client.get(self.url).json()['contexts']), 1)
+        self.assertIsNone(cache.get(contexts_key(self.holder.did) + ':stale'))
+        self.assertEqual(len(self.client.get(self.url).json()['contexts']), 2)
+
+    def test_unknown_did(self):
+        self.assertEqual(self.client.get('/api/users/did:ethr:nobody/contexts/').status_code, 404)
+
+
+def jpeg_upload(size=(800, 600), **save_kwargs):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'JPEG', **save_kwargs)
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), AVATAR_VARIANT_SIZES=[48, 128])
+class AvatarPipelineTests(TestCase):
+    def test_variants(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # orientation: rotate 90
+        main, variants = process_avatar(jpeg_upload(exif=exif.tobytes()))
+
+        self.assertEqual(set(variants), {'48', '128'})
+        self.assertEqual(main, variants['128']['jpeg'])
+        with default_storage.open(variants['48']['webp']) as f:
+            image = Image.open(f)
+            self.assertEqual((image.format, image.size), ('WEBP', (48, 48)))
+        with default_storage.open(main) as f:
+            self.assertFalse(Image.open(f).getexif())
+
+        # Same content, same names
+        self.assertEqual(process_avatar(jpeg_upload(exif=exif.tobytes()))[1], variants)
+
+    def test_rejects_non_images(self):
+        upload = SimpleUploadedFile('photo.jpg', b'not an image', content_type='image/jpeg')
+        with self.assertRaises(ValidationError):
+            process_avatar(upload)
+
+    def test_identity_create_stores_after_commit(self):
+        holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+
+        def create(size):
+            serializer = IdentitySerializer(
+                data={'context': 'ctx', 'description': 'd', 'is_active': True, 'avatar': jpeg_upload(size)},
+                context={'signature': '0xsig', 'user': holder})
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                return serializer.save()
+
+        with mock.patch('rest_api.serializers.open_avatar', wraps=open_avatar) as opened:
+            identity = create((300, 200))
+        opened.assert_called_once()
+        self.assertTrue(all(default_storage.exists(name) for formats in identity.avatar_variants.values() for name in formats.values()))
+
+        # Duplicate context/description: rolled back, nothing stored
+        with self.assertRaises(ValidationError), mock.patch('rest_api.avatars.default_storage.save') as save:
+            create((320, 200))
+        save.assert_not_called()
+
+    def test_served_immutable(self):
+        _, variants = process_avatar(jpeg_upload())
+        url = variant_urls(variants, None)['48']['webp']
+        response = APIClient(SERVER_NAME='localhost').get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(APIClient(SERVER_NAME='localhost').get('/api/avatars/../x.jpg').status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), AVATAR_VARIANT_SIZES=[48])
+class MassDeleteTests(TestCase):
+    def setUp(self):
+        self.holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        self.requestor = Profile.objects.create(user=User.objects.create(username='requestor'), did='did:ethr:requestor')
+        self.avatar, self.variants = process_avatar(jpeg_upload())
+        self.identities = []
+        for i in range(3):
+            identity = Identity.objects.create(
+                user=self.holder, context=f'ctx{i}', description='d', enc_data=b'x', salt=f's{i}'.encode(), is_active=True,
+                avatar=self.avatar if i < 2 else None, avatar_variants=self.variants if i < 2 else None)
+            req = Request.objects.create(requestor=self.requestor, holder=self.holder, context=identity, purpose='p')
+            record_request_created(req)
+            SharedData.objects.create(request=req, enc_data=b'x', encKey_wrapped=b'k', wrap_salt=f'w{i}'.encode())
+            self.identities.append(identity)
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.holder.user)
+
+    def mass_delete(self, ids):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post('/api/me/identities/mass-delete/', {'ids': [str(i) for i in ids]}, format='json')
+        return response, callbacks
+
+    def test_deletes_cascade_and_counts(self):
+        unknown = uuid.uuid4()
+        response, _ = self.mass_delete([self.identities[0].id, self.identities[2].id, unknown])
+        self.assertEqual(response.json()['deletion_count'], 2)
+        self.assertEqual(Identity.objects.count(), 1)
+        self.assertEqual(Request.objects.count(), 1)
+        self.assertEqual(SharedData.objects.count(), 1)
+        self.assertEqual(request_stats(self.holder)['incoming']['pending'], 1)
+        self.assertEqual(request_stats(self.requestor)['outgoing']['pending'], 1)
+
+        response, _ = self.mass_delete([unknown])
+        self.assertEqual(response.status_code, 404)
+
+    def test_raw_deletes_cover_all_relations(self):
+        # A new FK to Identity / Request / SharedData has to be deleted in
+        # delete_identities() and listed in RAW_DELETE_RELATIONS
+        self.assertEqual(unhandled_relations(), set())
+
+    def test_unhandled_relation_falls_back_to_collector(self):
+        with mock.patch.dict(deletion.RAW_DELETE_RELATIONS, {Request: set()}):
+            self.assertEqual(unhandled_relations(), {'Request.shared_data'})
+            response, _ = self.mass_delete([self.identities[0].id, self.identities[2].id])
+        self.assertEqual(response.json()['deletion_count'], 2)
+        self.assertEqual((Identity.objects.count(), Request.objects.count(), SharedData.objects.count()), (1, 1, 1))
+        self.assertEqual(request_stats(self.holder)['incoming']['pending'], 1)
+
+    def test_same_side_effects_as_single_delete(self):
+        kdf_cache = get_kdf_cache()
+        derived = lambda salt: kdf_cache.get_or_derive(b'sig', salt, 1, lambda: os.urandom(32))
+        keys = {salt: derived(salt) for i in range(3) for salt in (f's{i}'.encode(), f'w{i}'.encode())}
+        contexts_url = f'/api/users/{self.holder.did}/contexts/'
+        etag = self.client.get(contexts_url)['ETag']
+
+        # One identity through the post_delete receivers, one through the mass delete
+        with self.captureOnCommitCallbacks(execute=True):
+            self.identities[0].delete()
+        with mock.patch('rest_api.deletion.run_after_commit'), self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/me/identities/mass-delete/', {'ids': [str(self.identities[1].id)]}, format='json')
+
+        self.assertEqual(request_stats(self.holder)['incoming']['pending'], 1)
+        self.assertEqual(request_stats(self.requestor)['outgoing']['pending'], 1)
+        for salt, key in keys.items():
+            kept = salt in (b's2', b'w2')
+            self.assertEqual(derived(salt) == key, kept, salt)
+
+        response = self.client.get(contexts_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['context'] for c in response.json()['contexts']], ['ctx2'])
+
+    def test_avatar_files_removed_when_unreferenced(self):
+        # identities[0] and [1] share the same (content-hashed) avatar files
+        self.mass_delete([self.identities[0].id])
+        delete_avatar_files([(self.avatar, self.variants)])
+        self.assertTrue(default_storage.exists(self.avatar))
+
+        _, callbacks = self.mass_delete([self.identities[1].id])
+        self.assertEqual(len(callbacks), 2)  # contexts cache + file cleanup
+        delete_avatar_files([(self.avatar, self.variants)])
+        self.assertFalse(default_storage.exists(self.avatar))
+        self.assertFalse(default_storage.exists(self.variants['48']['webp']))
+
+
+class ExpirySweepTests(TestCase):
+    def setUp(self):
+        self.holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        self.requestor = Profile.objects.create(user=User.objects.create(username='requestor'), did='did:ethr:requestor')
+        past = timezone.now() - datetime.timedelta(hours=1)
+        future = timezone.now() + datetime.timedelta(hours=1)
+        self.requests = []
+        for i, expires_at in enumerate([past, past, past, future, None]):
+            identity = Identity.objects.create(user=self.holder, context=f'ctx{i}', description='d', enc_data=b'x', salt=b's', is_active=True)
+            req = Request.objects.create(requestor=self.requestor, holder=self.holder, context=identity, purpose='p',
+                                         status=Request.Status.APPROVED, expires_at=expires_at)
+            record_request_created(req)
+            SharedData.objects.create(request=req, enc_data=b'x', encKey_wrapped=b'k', wrap_salt=b'w')
+            self.requests.append(req)
+
+    def test_sweep_in_batches(self):
+        with mock.patch('rest_api.expiry.notify_did') as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(sweep_expired(batch_size=2), 2)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(sweep_expired(batch_size=2), 1)
+            self.assertEqual(sweep_expired(batch_size=2), 0)
+
+        # One batched event per requestor and sweep
+        self.assertEqual(notify.call_count, 2)
+        did, payload = notify.call_args_list[0].args
+        self.assertEqual(did, self.requestor.did)
+        self.assertEqual(payload['event'], 'access expired')
+        self.assertEqual(len(payload['request_ids']), 2)
+
+        statuses = [Request.objects.get(pk=req.pk).status for req in self.requests]
+        self.assertEqual(statuses, [Request.Status.EXPIRED] * 3 + [Request.Status.APPROVED] * 2)
+        self.assertEqual(SharedData.objects.count(), 2)
+        self.assertEqual(request_stats(self.holder)['incoming'], {'pending': 0, 'approved': 2, 'declined': 0, 'expired': 3})
+        self.assertEqual(request_stats(self.requestor)['outgoing']['expired'], 3)
+
+    def test_evicts_wrap_keys(self):
+        kdf_cache = get_kdf_cache()
+        kdf_cache.clear()
+        kdf_cache.get_or_derive(b'sig', b'w', 1, lambda: os.urandom(32))
+        with mock.patch('rest_api.expiry.notify_did'):
+            sweep_expired()
+        self.assertEqual(kdf_cache.stats()['size'], 0)
+
+    def test_command_and_retrieve(self):
+        with mock.patch('rest_api.expiry.notify_did'):
+            call_command('sweep_expired_requests', '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(Request.objects.filter(status=Request.Status.EXPIRED).count(), 3)
+
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(self.requestor.user)
+        response = client.post(f'/api/requests/{self.requests[0].id}/shared-data/', {'signature': 'sig'}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['error'], 'Access expired.')
+
+
+class FakeChannelLayer:
+    """
+    Records group_send calls; raises once for each group listed in 'fail'.
+    """
+    def __init__(self, fail=()):
+        self.sent = []
+        self.fail = list(fail)
+
+    async def group_send(self, group, message):
+        if group in self.fail:
+            self.fail.remove(group)
+            raise ConnectionError('channel layer down')
+        self.sent.append((group, json.loads(message['text'])))
+
+
+class NotificationOutboxTests(TestCase):
+    def test_rollback_discards_notification(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            notify_did('did:ethr:a', {'event': 'x'})
+        self.assertEqual(len(callbacks), 1)  # background dispatch kick
+
+        try:
+            with transaction.atomic():
+                notify_did('did:ethr:b', {'event': 'x'})
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(list(Notification.objects.values_list('did', flat=True)), ['did:ethr:a'])
+
+    def test_dispatch_retries_in_order(self):
+        for did, n in (('did:ethr:a', 1), ('did:ethr:a', 2), ('did:ethr:b', 1)):
+            Notification.objects.create(did=did, payload={'n': n})
+        layer = FakeChannelLayer(fail=[group_name('did:ethr:a')])
+
+        with mock.patch('rest_api.outbox.get_channel_layer', return_value=layer):
+            self.assertEqual(dispatch_pending(), 3)
+            self.assertEqual(layer.sent, [(group_name('did:ethr:b'), {'n': 1})])
+            failed = Notification.objects.get(payload={'n': 1}, did='did:ethr:a')
+            self.assertEqual(failed.attempts, 1)
+            self.assertIn('channel layer down', failed.last_error)
+
+            # The DID waits for its retry, the later row must not overtake it
+            self.assertEqual(dispatch_pending(), 0)
+
+            Notification.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(dispatch_pending(), 2)
+
+        self.assertEqual(layer.sent[1:], [(group_name('did:ethr:a'), {'n': 1}), (group_name('did:ethr:a'), {'n': 2})])
+        self.assertFalse(Notification.objects.filter(dispatched_at__isnull=True).exists())
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    def test_command_needs_shared_layer(self):
+        with self.assertRaisesMessage(CommandError, 'in-memory'):
+            call_command('dispatch_notifications', stdout=io.StringIO())
+
+    @override_settings(NOTIFICATION_MAX_ATTEMPTS=1)
+    def test_dropped_after_max_attempts(self):
+        Notification.objects.create(did='did:ethr:a', payload={'n': 1})
+        layer = FakeChannelLayer(fail=[group_name('did:ethr:a')])
+        with mock.patch('rest_api.outbox.get_channel_layer', return_value=layer):
+            dispatch_pending()
+            self.assertEqual(dispatch_pending(), 0)
+        self.assertIsNotNone(Notification.objects.get().dispatched_at)
+
+    def test_rows_leased_during_send(self):
+        Notification.objects.create(did='did:ethr:a', payload={'n': 1})
+        during = []
+
+        class LeaseCheckingLayer(FakeChannelLayer):
+            async def group_send(self, group, message):
+                # Claimed in a transaction of its own: another dispatcher finds nothing due
+                during.append(await sync_to_async(dispatch_pending)())
+                await super().group_send(group, message)
+
+        with mock.patch('rest_api.outbox.get_channel_layer', return_value=LeaseCheckingLayer()):
+            self.assertEqual(dispatch_pending(), 1)
+        self.assertEqual(during, [0])
+        self.assertIsNotNone(Notification.objects.get().dispatched_at)
+
+
+class WebSocketAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        self.token = login_response_data(self.profile.user, self.profile, self.profile.did)['access']
+        self.application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    async def open(self, did, query):
+        communicator = ApplicationCommunicator(self.application, {
+            'type': 'websocket', 'path': f'/ws/notifications/{did}/', 'query_string': query.encode(), 'headers': [],
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        return communicator, await communicator.receive_output(timeout=5)
+
+    async def connect(self, did, token):
+        """
+        Returns the first message the server sends ('websocket.accept' / 'websocket.close').
+        """
+        communicator, message = await self.open(did, f'token={token}')
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+        return message['type'] == 'websocket.accept', message.get('code')
+
+    async def test_connect(self):
+        self.assertEqual(await self.connect(self.profile.did, self.token), (True, None))
+        self.assertEqual(await self.connect(self.profile.did, 'invalid'), (False, 4401))
+        self.assertEqual(await self.connect('did:ethr:other', self.token), (False, 4403))
+
+    async def test_profile_lookup_cached(self):
+        await self.connect(self.profile.did, self.token)
+        # Served from the cache until the TTL expires
+        await Profile.objects.filter(pk=self.profile.pk).aupdate(did='did:ethr:changed')
+        self.assertEqual(await self.connect(self.profile.did, self.token), (True, None))
+
+        cache.clear()
+        self.assertEqual(await self.connect(self.profile.did, self.token), (False, 4403))
+
+    async def test_replay_since(self):
+        for n in range(3):
+            await database_sync_to_async(notify_did)(self.profile.did, {'event': 'e', 'n': n})
+
+        communicator, message = await self.open(self.profile.did, f'token={self.token}&since=1')
+        self.assertEqual(message['type'], 'websocket.accept')
+        frames = [json.loads((await communicator.receive_output(timeout=5))['text']) for _ in range(2)]
+        self.assertEqual(frames, [{'event': 'e', 'n': 1, 'seq': 2}, {'event': 'e', 'n': 2, 'seq': 3}])
+
+        # Live delivery of an already replayed frame is skipped
+        await communicator.send_input(notify_message({'event': 'e', 'n': 2}, 3))
+        await communicator.send_input(notify_message({'event': 'e', 'n': 3}, 4))
+        frame = json.loads((await communicator.receive_output(timeout=5))['text'])
+        self.assertEqual(frame['seq'], 4)
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+
+
+    @override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+    async def test_in_memory_layer_delivers_after_commit(self):
+        communicator, message = await self.open(self.profile.did, f'token={self.token}')
+        self.assertEqual(message['type'], 'websocket.accept')
+
+        def notify():
+            with self.captureOnCommitCallbacks(execute=True):
+                notify_did(self.profile.did, {'event': 'e'})
+
+        # The committing thread only hands the drain over (run inline here, a 
+        # background thread wouldn't see the test transaction); the sends 
+        # still have to reach this loop
+        with mock.patch('rest_api.outbox.run_in_background', side_effect=lambda fn, *args: fn(*args)) as background:
+            await database_sync_to_async(notify)()
+        background.assert_called_once()
+        frame = json.loads((await communicator.receive_output(timeout=5))['text'])
+        self.assertEqual(frame, {'event': 'e', 'seq': 1})
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+
+
+    @override_settings(WS_PRESENCE=True)
+    async def test_presence(self):
+        communicator, _ = await self.open(self.profile.did, f'token={self.token}')
+        self.assertEqual(lookup([self.profile.did]), ({self.profile.did}, set()))
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+        self.assertEqual(lookup([self.profile.did])[0], set())
+
+
+    async def test_schema_v2(self):
+        message = notify_message({'event': 'e', 'request': {'id': 'x'}}, 1)
+        for query, expected in (('', {'event': 'e', 'seq': 1}), ('&v=2', {'event': 'e', 'request': {'id': 'x'}, 'seq': 1})):
+            communicator, _ = await self.open(self.profile.did, f'token={self.token}{query}')
+            await communicator.send_input(message)
+            self.assertEqual(json.loads((await communicator.receive_output(timeout=5))['text']), expected)
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(timeout=5)
+
+
+class NotificationReplayTests(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        for n in range(3):
+            notify_did(self.profile.did, {'event': 'e', 'n': n})
+
+    def test_replay(self):
+        self.assertEqual(list(Notification.objects.values_list('seq', flat=True)), [1, 2, 3])
+        frames, last_seq, complete = replay(self.profile.did, 1)
+        self.assertEqual([seq for seq, _ in frames], [2, 3])
+        self.assertEqual((last_seq, complete), (3, True))
+        self.assertEqual(replay(self.profile.did, 3), ([], 3, True))
+        # Unknown or too many
+        self.assertFalse(replay(self.profile.did, 7)[2])
+        self.assertFalse(replay(self.profile.did, 0, limit=2)[2])
+
+    def test_purged_events_require_resync(self):
+        old = timezone.now() - datetime.timedelta(days=30)
+        Notification.objects.filter(seq=1).update(created_at=old, dispatched_at=old)
+        Notification.objects.filter(seq=2).update(created_at=old)  # not sent yet, kept
+        self.assertEqual(purge_dispatched(), 1)
+        self.assertFalse(replay(self.profile.did, 0)[2])
+        self.assertTrue(replay(self.profile.did, 1)[2])
+
+
+class SendQueueTests(SimpleTestCase):
+    async def scenario(self, version=1):
+        sent, release = [], asyncio.Event()
+
+        async def slow_send(text_data):
+            await release.wait()
+            sent.append(json.loads(text_data))
+
+        consumer = BackendConsumer()
+        consumer.version = version
+        consumer.send = slow_send
+        consumer.start_sender()
+
+        await consumer.notify(notify_message({'event': 'a'}, 1))
+        await asyncio.sleep(0)  # 'a' is in flight, the queue is empty
+        for seq in (2, 3, 4):
+            await consumer.notify(notify_message({'event': 'new request received', 'request': {'id': seq}}, seq))
+        await consumer.notify(notify_message({'event': 'b'}, 5))
+        await consumer.notify(notify_message({'event': 'c'}, 6))  # queue full
+
+        release.set()
+        while len(sent) < 4:
+            await asyncio.sleep(0)
+        consumer.sender.cancel()
+        return sent
+
+    @override_settings(WS_SEND_QUEUE_SIZE=2)
+    def test_coalesce_and_drop(self):
+        before = send_queue_metrics()
+        sent = asyncio.run(self.scenario())
+        self.assertEqual(sent, [
+            {'event': 'a', 'seq': 1},
+            # Highest seq of the merged events
+            {'event': 'new request received', 'count': 3, 'seq': 4},
+            {'event': 'b', 'seq': 5},
+            {'event': 'notifications dropped', 'count': 1},
+        ])
+        metrics = send_queue_metrics()
+        self.assertEqual(metrics['coalesced'] - before['coalesced'], 2)
+        self.assertEqual(metrics['dropped'] - before['dropped'], 1)
+
+    def test_coalesced_frame_keeps_position(self):
+        async def scenario():
+            sent = []
+
+            async def send(text_data):
+                sent.append(json.loads(text_data))
+
+            consumer = BackendConsumer()
+            consumer.send = send
+            consumer.start_sender()
+            for seq, event in ((1, 'new request received'), (2, 'b'), (3, 'new request received')):
+                await consumer.notify(notify_message({'event': event}, seq))
+            while len(sent) < 2:
+                await asyncio.sleep(0)
+            consumer.sender.cancel()
+            return sent
+
+        # Merged into the first frame: seq 3 goes out before seq 2, clients
+        # resume from the highest one
+        self.assertEqual(asyncio.run(scenario()), [
+            {'event': 'new request received', 'count': 2, 'seq': 3},
+            {'event': 'b', 'seq': 2},
+        ])
+
+    @override_settings(WS_SEND_QUEUE_SIZE=2)
+    def test_v2_resync_instead_of_summaries(self):
+        # Merged or dropped frames would lose their 'request' payloads
+        sent = asyncio.run(self.scenario(version=2))
+        self.assertEqual(sent, [
+            {'event': 'a', 'seq': 1},
+            {'event': 'resync required', 'seq': 4},
+            {'event': 'b', 'seq': 5},
+            {'event': 'resync required', 'seq': 6},
+        ])
+
+
+@override_settings(WS_PRESENCE=True)
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def later(self):
+        return mock.patch('time.time', return_value=time.time() + settings.WS_PRESENCE_TTL + 1)
+
+    def test_connections(self):
+        c1 = async_to_sync(mark_online)('did:ethr:a', 'c1')
+        c2 = async_to_sync(mark_online)('did:ethr:a', 'c2')
+        self.assertNotEqual(c1, c2)
+        async_to_sync(mark_offline)('did:ethr:a', 'c1', c1)
+        self.assertEqual(lookup(['did:ethr:a', 'did:ethr:b']), ({'did:ethr:a'}, set()))
+        async_to_sync(mark_offline)('did:ethr:a', 'c2', c2)
+        self.assertEqual(lookup(['did:ethr:a']), (set(), set()))
+
+    def test_offline_after_ttl(self):
+        # Offline only once every open connection had a heartbeat since
+        self.assertEqual(lookup(['did:ethr:a']), (set(), set()))
+        with self.later():
+            self.assertEqual(lookup(['did:ethr:a']), (set(), {'did:ethr:a'}))
+            async_to_sync(mark_online)('did:ethr:a', 'c1')
+            self.assertEqual(lookup(['did:ethr:a']), ({'did:ethr:a'}, set()))
+
+    def test_lost_slot_claimed_again(self):
+        c1 = async_to_sync(mark_online)('did:ethr:a', 'c1')
+        c2 = async_to_sync(mark_online)('did:ethr:a', 'c2')
+        cache.delete(c1)  # evicted
+        async_to_sync(mark_offline)('did:ethr:a', 'c2', c2)
+        self.assertEqual(lookup(['did:ethr:a']), (set(), set()))
+        self.assertIsNotNone(async_to_sync(heartbeat)('did:ethr:a', 'c1', c1))
+        self.assertEqual(lookup(['did:ethr:a']), ({'did:ethr:a'}, set()))
+
+    def test_crashed_connection_expires(self):
+        async_to_sync(mark_online)('did:ethr:a', 'c1')
+        with self.later():
+            self.assertEqual(lookup(['did:ethr:a'])[0], set())
+
+    @override_settings(WS_PRESENCE_SLOTS=1)
+    def test_untracked_connection_takes_free_slot(self):
+        c1 = async_to_sync(mark_online)('did:ethr:a', 'c1')
+        self.assertIsNone(async_to_sync(mark_online)('did:ethr:a', 'c2'))
+        async_to_sync(mark_offline)('did:ethr:a', 'c1', c1)
+        self.assertEqual(async_to_sync(heartbeat)('did:ethr:a', 'c2', None), slot_keys('did:ethr:a')[0])
+        self.assertEqual(lookup(['did:ethr:a']), ({'did:ethr:a'}, set()))
+
+    def test_dispatch_skips_offline(self):
+        async_to_sync(mark_online)('did:ethr:a', 'c1')
+        cache.set(offline_key('did:ethr:b'), time.time() - settings.WS_PRESENCE_TTL - 1)
+        for did in ('did:ethr:a', 'did:ethr:b', 'did:ethr:c'):
+            Notification.objects.create(did=did, payload={'did': did})
+        layer = FakeChannelLayer()
+        with mock.patch('rest_api.outbox.get_channel_layer', return_value=layer):
+            self.assertEqual(dispatch_pending(), 3)
+        self.assertEqual(layer.sent, [(group_name('did:ethr:a'), {'did': 'did:ethr:a'})])
+        # b is kept for replay, c may have a connection about to show up again
+        pending = Notification.objects.get(dispatched_at__isnull=True)
+        self.assertEqual(pending.did, 'did:ethr:c')
+        self.assertEqual(pending.attempts, 0)
+        self.assertGreater(pending.next_attempt_at, timezone.now())
+
+
+class RichNotificationTests(TestCase):
+    def test_update_event_matches_list_representation(self):
+        holder = Profile.objects.create(user=User.objects.create(username='holder'), did='did:ethr:holder')
+        requestor = Profile.objects.create(user=User.objects.create(username='requestor'), did='did:ethr:requestor')
+        identity = Identity.objects.create(user=holder, context='ctx', description='d', enc_data=b'x', salt=b's', is_active=True)
+        req = Request.objects.create(requestor=requestor, holder=holder, context=identity, purpose='p')
+        record_request_created(req)
+
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(holder.user)
+        response = client.patch(f'/api/requests/{req.id}/', {'action': 'decline'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        notification = Notification.objects.get(did=requestor.did)
+        self.assertEqual(notification.payload['request'], response.json())
+        self.assertEqual(notification.payload['request']['description'], 'd')
+        self.assertNotIn('request', json.loads(notify_message(notification.payload)['text']))
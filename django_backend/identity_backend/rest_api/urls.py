@@ -1,34 +1,58 @@
 from django.urls import path
+from django.conf import settings
 from .api import (
     UserAuthenticationView, 
     LoginChallengeView, 
     CreateIdentityProfileView,
+    BulkIdentityImportView,
     GetMyIdentitiesView,
+    DecryptIdentitiesView,
     IdentityDeleteView,
     GetContexts,
     RequestChallengeView,
     CreateRequestView,
     GetRequests,
+    RequestStatsView,
     UpdateRequestView,
     DeleteRequestView,
     UpdateIdentityActiveView,
     RetrieveSharedDataView,
-    DeleteSharedDataView
+    DeleteSharedDataView,
+    VeramoMetricsView,
+    WebSocketMetricsView
 )
+from .views import avatar_variant
+from .async_api import (
+    AsyncUserAuthenticationView,
+    AsyncCreateIdentityProfileView,
+    AsyncCreateRequestView
+)
+
+# Veramo-bound endpoints: native async views when running under ASGI
+if settings.ASYNC_VERAMO_VIEWS:
+    UserAuthenticationView = AsyncUserAuthenticationView
+    CreateIdentityProfileView = AsyncCreateIdentityProfileView
+    CreateRequestView = AsyncCreateRequestView
 
 urlpatterns = [
     path('auth/authenticate/', UserAuthenticationView.as_view(), name='auth_authenticate'),
     path('auth/challenge/', LoginChallengeView.as_view(), name='auth_challenge'),
     path('identity/', CreateIdentityProfileView.as_view(), name='create_identity_profile'),
+    path('identity/bulk/', BulkIdentityImportView.as_view(), name='bulk_import_identities'),
     path('me/identities/', GetMyIdentitiesView.as_view(), name='get_identities'),
+    path('me/identities/decrypt/', DecryptIdentitiesView.as_view(), name='decrypt_identities'),
     path('me/identities/<uuid:identity_id>/active/', UpdateIdentityActiveView.as_view(), name="set_identity_visibility"),
     path('me/identities/mass-delete/', IdentityDeleteView.as_view(), name='mass_delete_identities'),
     path('users/<path:did>/contexts/', GetContexts.as_view(), name='user_contexts'),
     path('requests/challenge/', RequestChallengeView.as_view(), name='get_request_challenge'),
     path('requests/', CreateRequestView.as_view(), name='create_request'),
     path('me/requests/', GetRequests.as_view(), name='get_requests'),
+    path('me/requests/stats/', RequestStatsView.as_view(), name='request_stats'),
     path('requests/<uuid:request_id>/', UpdateRequestView.as_view(), name='update_requests'),
     path('me/requests/<uuid:request_id>/', DeleteRequestView.as_view(), name='delete_request'),
     path('requests/<uuid:request_id>/shared-data/', RetrieveSharedDataView.as_view(), name='grant_data_access'),
     path('shared-data/<uuid:request_id>/', DeleteSharedDataView.as_view(), name='shared_data_delete'),
+    path('veramo/metrics/', VeramoMetricsView.as_view(), name='veramo_metrics'),
+    path('ws/metrics/', WebSocketMetricsView.as_view(), name='ws_metrics'),
+    path('avatars/<str:name>', avatar_variant, name='avatar_variant'),
 ]
\ No newline at end of file
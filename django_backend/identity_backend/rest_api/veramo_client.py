@@ -0,0 +1,420 @@
+"""
+Pooled, resilient HTTP client for the Veramo backend agent (running at :3003).
+
+- keep-alive connection pool shared by all threads of the process
+- separate connect and read timeouts, so a stalled agent cannot pin a worker
+- bounded retries with full jitter for the (idempotent) verification calls
+- circuit breaker: after VERAMO_BREAKER_THRESHOLD consecutive failures calls
+  fail fast for VERAMO_BREAKER_RESET seconds, then a single probe is let through
+- per-endpoint call / error / latency counters (VeramoClient.metrics())
+- async variant (VeramoClient.apost) for the async views: on a shared httpx
+  connection pool per event loop under ASGI (VERAMO_ASYNC_SHARED_POOL), else
+  on a client opened and closed per call
+- successful credential verifications are cached in the Django cache, keyed 
+  by a canonical hash of the credential, never past its expirationDate 
+  (presentations are never cached: they carry a single-use challenge)
+
+Documentation:
+https://requests.readthedocs.io/en/latest/user/advanced/#session-objects
+https://martinfowler.com/bliki/CircuitBreaker.html
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from requests.adapters import HTTPAdapter
+
+import requests, httpx, asyncio, contextlib, datetime, weakref, threading, logging, random, time, json, hashlib
+
+logger = logging.getLogger('rest_api')
+
+# Gateway errors are treated like connection failures (retried, counted by the breaker)
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+class VeramoUnavailable(requests.exceptions.ConnectionError):
+    """
+    Raised without calling the agent while the circuit breaker is open.
+    Subclass of requests' ConnectionError, so callers handling
+    RequestException keep answering 503.
+    """
+
+
+class CircuitBreaker:
+    """
+    Minimal thread-safe circuit breaker (closed -> open -> half-open -> closed).
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return True if a call may go through. While half-open only one probe
+        call is allowed until it reports back.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.error(f"Veramo circuit breaker opened after {self.failures} failures.")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class EndpointMetrics:
+    """
+    Call counters and latency totals for one agent endpoint.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms, ok):
+        self.calls += 1
+        self.errors += 0 if ok else 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'avg_ms': round(self.total_ms / self.calls, 2) if self.calls else None,
+            'max_ms': round(self.max_ms, 2),
+        }
+
+
+class VeramoClient:
+    """
+    Client for the custom verification endpoints of the Veramo agent.
+    """
+    def __init__(self, base_url, connect_timeout, read_timeout, max_retries,
+                 retry_backoff, pool_size, breaker, async_pool_size=100, shared_async_pool=False):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker
+        self.async_pool_size = async_pool_size
+        self.shared_async_pool = shared_async_pool
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # httpx clients are bound to an event loop: one pool per running loop
+        self._async_clients = weakref.WeakKeyDictionary()
+
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def _endpoint_metrics(self, endpoint):
+        with self._metrics_lock:
+            return self._metrics.setdefault(endpoint, EndpointMetrics())
+
+    def _sleep_before_retry(self, attempt):
+        # "Full jitter": uniform in [0, backoff * 2^attempt]
+        time.sleep(random.uniform(0, self.retry_backoff * (2 ** attempt)))
+
+    def post(self, endpoint, json_data, idempotent=True):
+        """
+        POST a JSON payload to the agent and return the parsed JSON response.
+
+        Args:
+            endpoint (str): API endpoint path (e.g., 'verify-presentation').
+            json_data (dict): JSON body to send in the request.
+            idempotent (bool): allow retries on connection errors / timeouts.
+
+        Raises:
+            VeramoUnavailable if the circuit breaker is open.
+            HTTPError / RequestException if the request fails.
+        """
+        endpoint = endpoint.lstrip('/')
+        url = f"{self.base_url}/{endpoint}"
+        metrics = self._endpoint_metrics(endpoint)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                with self._metrics_lock:
+                    metrics.rejected += 1
+                raise VeramoUnavailable(f"Veramo agent unavailable (circuit {self.breaker.state}).")
+
+            started = time.perf_counter()
+            try:
+                response = self.session.post(url, json=json_data, timeout=self.timeout)
+                if response.status_code in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                self._record(metrics, started, ok=False)
+                self.breaker.record_failure()
+                logger.warning(f"Veramo call {endpoint} failed (attempt {attempt + 1}/{attempts}): {e}")
+                if attempt + 1 >= attempts:
+                    raise
+                with self._metrics_lock:
+                    metrics.retries += 1
+                self._sleep_before_retry(attempt)
+                continue
+
+            # The agent answered: it is healthy, even if the verification itself failed
+            self.breaker.record_success()
+            self._record(metrics, started, ok=response.ok)
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                logger.error(f"HTTP error: {e}")
+                raise
+            return response.json()
+
+    def _async_client_options(self):
+        return {
+            'timeout': httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+            'limits': httpx.Limits(
+                max_connections=self.async_pool_size, 
+                max_keepalive_connections=self.async_pool_size,
+            ),
+        }
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(**self._async_client_options())
+            self._async_clients[loop] = client
+        return client
+
+    @contextlib.asynccontextmanager
+    async def _async_session(self):
+        """
+        httpx client for one apost() call. Under ASGI the event loop lives as 
+        long as the process, so its pooled client is reused. Elsewhere (async
+        views under WSGI get a new loop per request from async_to_sync) a 
+        per-loop client would never be closed: open one per call instead.
+        """
+        if self.shared_async_pool:
+            yield self._async_client()
+            return
+        async with httpx.AsyncClient(**self._async_client_options()) as client:
+            yield client
+
+    async def apost(self, endpoint, json_data, idempotent=True):
+        """
+        Async variant of post() for async views. Uses the same breaker, retry
+        policy and metrics. httpx errors are re-raised as the matching 
+        requests exceptions so callers handle both variants the same way.
+        """
+        endpoint = endpoint.lstrip('/')
+        url = f"{self.base_url}/{endpoint}"
+        metrics = self._endpoint_metrics(endpoint)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+
+        async with self._async_session() as client:
+            for attempt in range(attempts):
+                if not self.breaker.allow():
+                    with self._metrics_lock:
+                        metrics.rejected += 1
+                    raise VeramoUnavailable(f"Veramo agent unavailable (circuit {self.breaker.state}).")
+
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json=json_data)
+                    if response.status_code in RETRY_STATUS_CODES:
+                        raise requests.exceptions.HTTPError(f"{response.status_code} Server Error for url: {url}")
+                except (httpx.HTTPError, requests.exceptions.RequestException) as e:
+                    self._record(metrics, started, ok=False)
+                    self.breaker.record_failure()
+                    logger.warning(f"Veramo call {endpoint} failed (attempt {attempt + 1}/{attempts}): {e}")
+                    if attempt + 1 >= attempts:
+                        raise as_requests_exception(e) from e
+                    with self._metrics_lock:
+                        metrics.retries += 1
+                    await asyncio.sleep(random.uniform(0, self.retry_backoff * (2 ** attempt)))
+                    continue
+
+                self.breaker.record_success()
+                self._record(metrics, started, ok=response.is_success)
+                if not response.is_success:
+                    logger.error(f"HTTP error: {response.status_code} for url: {url}")
+                    raise requests.exceptions.HTTPError(f"{response.status_code} Error for url: {url}")
+                return response.json()
+
+    # --- Credential verification (cached) ---
+
+    def verify_credential(self, credential):
+        """
+        Verify a VC with the agent ('verify-credential'), reusing a cached 
+        positive result for an identical credential.
+        Returns {'verified': ..., 'issuer': ...}.
+        """
+        key = credential_cache_key(credential)
+        cached = cache.get(key) if key else None
+        if cached is not None:
+            return cached
+
+        result = credential_result(self.post('verify-credential', {'credential': credential}))
+        ttl = credential_cache_ttl(credential)
+        if key and result['verified'] and ttl > 0:
+            cache.set(key, result, ttl)
+        return result
+
+    def verify_credentials(self, credentials):
+        """
+        Batch variant of verify_credential(): cached results are reused, the 
+        remaining credentials go to the agent's 'verify-credentials' endpoint 
+        in chunks of VERAMO_BATCH_SIZE (one call per chunk).
+        Returns one {'verified': ..., 'issuer': ...} per credential, in order.
+        """
+        keys = [credential_cache_key(credential) for credential in credentials]
+        cached = cache.get_many([key for key in keys if key])
+        results = [cached.get(key) if key else None for key in keys]
+
+        missing = [index for index, result in enumerate(results) if result is None]
+        batch_size = max(1, settings.VERAMO_BATCH_SIZE)
+        to_cache = {}  # ttl -> {key: result}
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            response = self.post('verify-credentials', {'credentials': [credentials[i] for i in chunk]})
+            for index, result in zip(chunk, response.get('results', [])):
+                results[index] = credential_result(result)
+                ttl = credential_cache_ttl(credentials[index])
+                if keys[index] and results[index]['verified'] and ttl > 0:
+                    to_cache.setdefault(ttl, {})[keys[index]] = results[index]
+
+        for ttl, entries in to_cache.items():
+            cache.set_many(entries, ttl)
+        # Agent returned fewer results than sent: treat the rest as unverified
+        return [result or {'verified': False, 'issuer': None} for result in results]
+
+    async def averify_credential(self, credential):
+        """
+        Async variant of verify_credential().
+        """
+        key = credential_cache_key(credential)
+        cached = await cache.aget(key) if key else None
+        if cached is not None:
+            return cached
+
+        result = credential_result(await self.apost('verify-credential', {'credential': credential}))
+        ttl = credential_cache_ttl(credential)
+        if key and result['verified'] and ttl > 0:
+            await cache.aset(key, result, ttl)
+        return result
+
+    def _record(self, metrics, started, ok):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._metrics_lock:
+            metrics.record(elapsed_ms, ok)
+        logger.debug(f"Veramo call took {elapsed_ms:.1f} ms (ok={ok})")
+
+    def metrics(self):
+        """
+        Snapshot of the per-endpoint counters plus the breaker state.
+        """
+        with self._metrics_lock:
+            endpoints = {name: m.snapshot() for name, m in self._metrics.items()}
+        return {'breaker': self.breaker.state, 'endpoints': endpoints}
+
+
+def as_requests_exception(e):
+    """
+    Map an httpx exception onto the equivalent requests exception.
+    """
+    if isinstance(e, requests.exceptions.RequestException):
+        return e
+    if isinstance(e, httpx.TimeoutException):
+        return requests.exceptions.Timeout(str(e))
+    return requests.exceptions.ConnectionError(str(e))
+
+
+def credential_cache_key(credential):
+    """
+    Content address of a credential: SHA-256 over its canonical JSON form 
+    (sorted keys, no whitespace). None if caching is disabled.
+    """
+    if settings.VERAMO_CREDENTIAL_CACHE_TTL <= 0:
+        return None
+    canonical = json.dumps(credential, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return 'veramo:vc:' + hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def credential_cache_ttl(credential):
+    """
+    Cache TTL (seconds) of a positive verification: VERAMO_CREDENTIAL_CACHE_TTL,
+    capped at the credential's expirationDate (validUntil in VC 2.0) so an 
+    expired credential is never served as verified. 0 (don't cache) if it 
+    has expired or the date can't be parsed.
+    """
+    ttl = settings.VERAMO_CREDENTIAL_CACHE_TTL
+    expires = credential.get('expirationDate') or credential.get('validUntil')
+    if not expires:
+        return ttl
+    try:
+        expires_at = parse_datetime(expires)
+    except (TypeError, ValueError):
+        expires_at = None
+    if expires_at is None:
+        return 0
+    if timezone.is_naive(expires_at):
+        expires_at = timezone.make_aware(expires_at, datetime.timezone.utc)
+    return max(0, min(ttl, int((expires_at - timezone.now()).total_seconds())))
+
+
+def credential_result(result):
+    """
+    Reduce an agent response to the fields callers use (and cache).
+    Only positive results are cached; failed verifications always hit the agent.
+    """
+    return {'verified': result.get('verified'), 'issuer': result.get('issuer')}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_veramo_client():
+    """
+    Return the process-wide VeramoClient, configured from settings.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = VeramoClient(
+                base_url=settings.VERAMO_URL,
+                connect_timeout=settings.VERAMO_CONNECT_TIMEOUT,
+                read_timeout=settings.VERAMO_READ_TIMEOUT,
+                max_retries=settings.VERAMO_MAX_RETRIES,
+                retry_backoff=settings.VERAMO_RETRY_BACKOFF,
+                pool_size=settings.VERAMO_POOL_SIZE,
+                breaker=CircuitBreaker(settings.VERAMO_BREAKER_THRESHOLD, settings.VERAMO_BREAKER_RESET),
+                async_pool_size=settings.VERAMO_ASYNC_POOL_SIZE,
+                shared_async_pool=settings.VERAMO_ASYNC_SHARED_POOL,
+            )
+        return _client
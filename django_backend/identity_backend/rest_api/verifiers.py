@@ -0,0 +1,194 @@
+"""
+Pluggable verification backends for Verifiable Credentials / Presentations.
+
+The backend is selected with the VERIFIER_BACKEND setting (dotted path):
+    rest_api.verifiers.VeramoVerifier   HTTP call to the Veramo agent (default)
+    rest_api.verifiers.EIP712Verifier   in-process EIP-712 signature recovery
+
+Both return the same shape as the agent's custom endpoints:
+    credential:   {'verified': bool, 'issuer': credential['issuer']}
+    presentation: {'verified': bool, 'issuer': presentation['holder']}
+
+Documentation:
+https://eips.ethereum.org/EIPS/eip-712
+https://w3c-ccg.github.io/ethereum-eip712-signature-2021-spec/
+https://github.com/decentralized-identity/veramo/tree/next/packages/credential-eip712
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+from asgiref.sync import sync_to_async
+from eth_account import Account
+from eth_account.messages import encode_typed_data
+from eth_keys import keys
+from eth_utils import to_checksum_address
+
+from .veramo_client import get_veramo_client
+
+import threading, logging, re
+
+logger = logging.getLogger('rest_api')
+
+
+class BaseVerifier:
+    """
+    Interface of a verification backend. Async methods default to running the
+    sync ones in a thread; backends with native async I/O override them.
+    """
+    def verify_credential(self, credential):
+        raise NotImplementedError
+
+    def verify_credentials(self, credentials):
+        return [self.verify_credential(credential) for credential in credentials]
+
+    def verify_presentation(self, presentation, challenge, domain=None):
+        raise NotImplementedError
+
+    async def averify_credential(self, credential):
+        return await sync_to_async(self.verify_credential, thread_sensitive=False)(credential)
+
+    async def averify_presentation(self, presentation, challenge, domain=None):
+        return await sync_to_async(self.verify_presentation, thread_sensitive=False)(presentation, challenge, domain)
+
+
+class VeramoVerifier(BaseVerifier):
+    """
+    Delegate to the Veramo agent (veramo_backend_agent) over HTTP.
+    """
+    def verify_credential(self, credential):
+        return get_veramo_client().verify_credential(credential)
+
+    def verify_credentials(self, credentials):
+        return get_veramo_client().verify_credentials(credentials)
+
+    def verify_presentation(self, presentation, challenge, domain=None):
+        result = get_veramo_client().post('verify-presentation', presentation_payload(presentation, challenge, domain))
+        return {'verified': bool(result.get('verified')), 'issuer': result.get('issuer')}
+
+    async def averify_credential(self, credential):
+        return await get_veramo_client().averify_credential(credential)
+
+    async def averify_presentation(self, presentation, challenge, domain=None):
+        result = await get_veramo_client().apost('verify-presentation', presentation_payload(presentation, challenge, domain))
+        return {'verified': bool(result.get('verified')), 'issuer': result.get('issuer')}
+
+
+class EIP712Verifier(BaseVerifier):
+    """
+    Offline verification of 'EthereumEip712Signature2021' proofs, mirroring
+    Veramo's verifyCredentialEIP712 / verifyPresentationEIP712:
+        1. rebuild the signed message: document without proof.proofValue /
+           proof.eip712 / proof.eip712Domain
+        2. recover the signer address from the EIP-712 (v4) typed data hash
+        3. compare with the address controlling the issuer / holder DID
+
+    DIDs are resolved without network access: did:ethr (address or public
+    key form) and did:pkh:eip155 map to their default controller address.
+    Controller changes registered on-chain are therefore not taken into account.
+    """
+    def verify_credential(self, credential):
+        issuer = credential.get('issuer') if isinstance(credential, dict) else None
+        return {'verified': self.verify_document(credential, credential_issuer(credential)), 'issuer': issuer}
+
+    def verify_presentation(self, presentation, challenge, domain=None):
+        holder = presentation.get('holder') if isinstance(presentation, dict) else None
+        verified = self.verify_document(presentation, holder)
+        if verified and challenge is not None and presentation.get('challenge') != challenge:
+            logger.warning("Presentation challenge mismatch.")
+            verified = False
+        return {'verified': verified, 'issuer': holder}
+
+    def verify_document(self, document, did):
+        """
+        True if the document's EIP-712 proof was signed by the controller of did.
+        """
+        try:
+            expected = did_to_address(did)
+            recovered = recover_eip712_signer(document)
+        except Exception as e:
+            logger.debug(f"EIP-712 verification failed: {e}")
+            return False
+        return recovered.lower() == expected.lower()
+
+
+def credential_issuer(credential):
+    """
+    Issuer DID of a credential: 'issuer' is either the DID or an object with
+    an 'id'. None if there is none.
+    """
+    issuer = credential.get('issuer') if isinstance(credential, dict) else None
+    return issuer.get('id') if isinstance(issuer, dict) else issuer
+
+
+def presentation_payload(presentation, challenge, domain=None):
+    """
+    Request body for the agent's verify-presentation endpoint.
+    """
+    return {
+        'presentation': presentation,
+        'challenge': {'value': challenge},
+        'domain': domain or settings.EIP712_CHAIN_ID
+    }
+
+
+def recover_eip712_signer(document):
+    """
+    Recover the address that signed an 'EthereumEip712Signature2021' proof.
+    Raises ValueError if the proof is incomplete.
+    """
+    if not isinstance(document, dict) or not isinstance(document.get('proof'), dict):
+        raise ValueError('proof is undefined')
+
+    signing_input = {k: v for k, v in document.items() if k != 'proof'}
+    proof = document['proof']
+    proof_value = proof.get('proofValue')
+    if not proof_value:
+        raise ValueError('proof is undefined')
+
+    verify_input_proof = {k: v for k, v in proof.items() if k not in ('proofValue', 'eip712', 'eip712Domain')}
+    compat = {**(proof.get('eip712Domain') or {}), **(proof.get('eip712') or {})}
+    types = compat.get('types') or compat.get('messageSchema')
+    if not compat.get('primaryType') or not types or not compat.get('domain'):
+        raise ValueError('proof is missing expected properties')
+
+    typed_data = {
+        'types': types,
+        'primaryType': compat['primaryType'],
+        'domain': compat['domain'],
+        'message': {**signing_input, 'proof': verify_input_proof},
+    }
+    return Account.recover_message(encode_typed_data(full_message=typed_data), signature=proof_value)
+
+
+ETHR_DID = re.compile(r'^did:ethr:(?:[a-zA-Z0-9]+:)?(0x[0-9a-fA-F]{40}|0x[0-9a-fA-F]{66})$')
+PKH_DID = re.compile(r'^did:pkh:eip155:\d+:(0x[0-9a-fA-F]{40})$')
+
+
+def did_to_address(did):
+    """
+    Default controller address of a did:ethr / did:pkh:eip155 DID.
+    Raises ValueError for unsupported DIDs.
+    """
+    match = ETHR_DID.match(did or '') or PKH_DID.match(did or '')
+    if not match:
+        raise ValueError(f'Unsupported DID: {did}')
+    identifier = match.group(1)
+    if len(identifier) == 42:
+        return to_checksum_address(identifier)
+    # Compressed secp256k1 public key form
+    public_key = keys.PublicKey.from_compressed_bytes(bytes.fromhex(identifier[2:]))
+    return public_key.to_checksum_address()
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    """
+    Return the process-wide verification backend configured in VERIFIER_BACKEND.
+    """
+    global _verifier
+    with _verifier_lock:
+        if _verifier is None:
+            _verifier = import_string(settings.VERIFIER_BACKEND)()
+        return _verifier
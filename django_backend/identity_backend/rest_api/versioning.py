@@ -0,0 +1,61 @@
+"""
+Cheap validators for polled list endpoints (conditional GET).
+
+Each Profile carries two counters that are bumped in the same transaction as
+every write that changes what a list shows:
+    requests_version    GET /api/me/requests/   (bumped for holder and requestor)
+    identities_version  GET /api/users/<did>/contexts/
+
+The ETag is derived from the profile and the counter only, so a poll with a
+matching If-None-Match is answered with 304 after the single profile lookup,
+before any list query or serialization.
+
+Documentation:
+https://developer.mozilla.org/en-US/docs/Web/HTTP/Reference/Headers/ETag
+"""
+from django.db.models import F
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Profile
+
+
+def bump_requests_version(*profile_ids):
+    Profile.objects.filter(pk__in=set(profile_ids)).update(requests_version=F('requests_version') + 1)
+
+
+def bump_identities_version(*profile_ids):
+    Profile.objects.filter(pk__in=set(profile_ids)).update(identities_version=F('identities_version') + 1)
+
+
+def make_etag(kind, profile, version):
+    return 'W/' + quote_etag(f'{kind}-{profile.pk}-{version}')
+
+
+def etag_matches(request, etag):
+    """
+    Weak comparison of etag with the request's If-None-Match header.
+    """
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    if '*' in etags:
+        return True
+    bare = etag.removeprefix('W/')
+    return any(candidate.removeprefix('W/') == bare for candidate in etags)
+
+
+def with_etag(response, etag):
+    """
+    Attach the validator; clients must revalidate before reusing the response.
+    """
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(etag):
+    return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
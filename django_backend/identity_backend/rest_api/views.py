@@ -1,3 +1,26 @@
-from django.shortcuts import render
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+import re
+
+# Content-hashed avatar variant names (see avatars.py)
+AVATAR_VARIANT_NAME = re.compile(r'[0-9a-f]{64}\.(webp|jpg)')
+CONTENT_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg'}
+
+
+@require_GET
+def avatar_variant(request, name):
+    """
+    GET /api/avatars/<name>
+    Serve an avatar variant. The name is the hash of the content, so the
+    response can be cached forever by browsers and CDNs.
+    """
+    match = AVATAR_VARIANT_NAME.fullmatch(name)
+    path = f'avatars/{name}'
+    if not match or not default_storage.exists(path):
+        raise Http404('Avatar not found')
+
+    response = FileResponse(default_storage.open(path, 'rb'), content_type=CONTENT_TYPES[match.group(1)])
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -5,7 +5,7 @@ import RequestCardList from '../components/Cards/RequestCardList';
 import { getRequests } from '../utils/apiHelper';
 import { useAgent } from '../services/AgentContext';
 
-const STATUS_OPTIONS = ['All','Approved', 'Pending', 'Declined'];
+const STATUS_OPTIONS = ['All','Approved', 'Pending', 'Declined', 'Expired'];
 /**
  * Requests 
  * 
@@ -90,11 +90,18 @@ const Requests = () => {
     useEffect(() => {
         if (!notifications.length) return;
         const n = notifications[notifications.length - 1];
+        // Schema v2 events carry the request as the list endpoint returns it
+        if (n.request) {
+            setRequests(prev => prev.some(r => r.id === n.request.id)
+                ? prev.map(r => r.id === n.request.id ? n.request : r)
+                : [n.request, ...prev]);
+            return;
+        }
         if (n.event === 'access revoked' && n.request_id && n.request_id !== lastRevokedId) {
             setLastRevokedId(n.request_id);
             loadRequest();
         }
-        if (n.event === 'new request received' || n.event === 'request answer received') {
+        if (n.event === 'new request received' || n.event === 'request answer received' || n.event === 'access expired' || n.event === 'notifications dropped' || n.event === 'resync required') {
             loadRequest();
         }
     }, [notifications, loadRequest, lastRevokedId]);
@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useState, useEffect, useCallback, useMemo } from 'react';
+import React, { createContext, useContext, useState, useEffect, useCallback, useMemo, useRef } from 'react';
 import { isTokenExpired } from '../utils/tokenExpiration';
 import { refreshAccessToken } from '../utils/refreshToken';
 import { useWeb3AuthDisconnect} from "@web3auth/modal/react";
@@ -136,6 +136,11 @@ export const AgentProvider = ({ children }) => {
         return () => clearInterval(interval);
     }, [handleLogout, agent, did]);
 
+    // Highest sequence number received on this DID (coalesced frames can 
+    // arrive ahead of frames with lower numbers)
+    const lastSeq = useRef(null);
+    useEffect(() => { lastSeq.current = null; }, [did]);
+
     // Open a WebSocket for notifications tied to DID + access token
     useEffect(() => {
         const token = localStorage.getItem('accessToken');
@@ -144,13 +149,22 @@ export const AgentProvider = ({ children }) => {
         const wsHost  = location.host;
         const WS_BASE = (import.meta.env.VITE_WS_URL || '/ws').replace(/\/+$/, '')
         const path = `${WS_BASE}/notifications/${encodeURIComponent(did)}/`
-        const wsUrl = `${wsProto}//${wsHost}${path}?token=${encodeURIComponent(token)}`
+        // Resume after the last received notification (replayed by the server)
+        const since = lastSeq.current !== null ? `&since=${lastSeq.current}` : '';
+        // v=2: request events include the full request (no refetch needed)
+        const wsUrl = `${wsProto}//${wsHost}${path}?token=${encodeURIComponent(token)}&v=2${since}`
         const newSocket = new WebSocket(wsUrl);
 
         setSocket(newSocket);
 
         newSocket.onopen = () => console.log("WebSocket connected.");
-        newSocket.onmessage = (e) => setNotifications(prev => [...prev, JSON.parse(e.data)]);
+        newSocket.onmessage = (e) => {
+            const message = JSON.parse(e.data);
+            if (message.seq !== undefined && message.seq !== null) {
+                lastSeq.current = Math.max(lastSeq.current ?? 0, message.seq);
+            }
+            setNotifications(prev => [...prev, message]);
+        };
         newSocket.onclose = (e) => console.log("WebSocket disconnected.", e);
         newSocket.onerror = (err) => console.error("WebSocket error:", err);
         
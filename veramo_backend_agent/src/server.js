@@ -47,7 +47,15 @@ app.use(RequestWithAgentRouter({ agent }))
 app.use(basePath, agentRouter)
 app.use(schemaPath, schemaRouter)
 
-// Parse JSON requests
+// Credentials per /verify-credentials call (keep in sync with the backend's VERAMO_BATCH_SIZE)
+// and the body size allowed for them: the default 100kb of express.json() is
+// too small for a full batch of EIP-712 credentials
+const VERIFY_BATCH_SIZE = Number(process.env.VERAMO_BATCH_SIZE || 25)
+const CREDENTIAL_MAX_KB = Number(process.env.VERAMO_CREDENTIAL_MAX_KB || 64)
+const verifyBatchJson = express.json({ limit: `${VERIFY_BATCH_SIZE * CREDENTIAL_MAX_KB}kb` })
+
+// Parse JSON requests (the batch endpoint first, with its own limit)
+app.use('/verify-credentials', verifyBatchJson);
 app.use(express.json());
 
 
@@ -130,6 +138,40 @@ app.post('/verify-credential', express.json(), async (req, res) => {
   }
 });
 
+/**
+ * POST /verify-credentials
+ * 
+ * Batch variant of /verify-credential (used for bulk identity imports).
+ * - Expects: { credentials: [...] } in request body, at most VERAMO_BATCH_SIZE
+ *   credentials (body limit VERAMO_BATCH_SIZE * VERAMO_CREDENTIAL_MAX_KB).
+ * - Verifies all credentials concurrently with verifyCredentialEIP712.
+ * - Responds with one { verified, issuer } entry per credential, in input order.
+ *   A credential that fails to verify yields { verified: false, error } 
+ *   instead of failing the whole batch.
+ */
+app.post('/verify-credentials', verifyBatchJson, async (req, res) => {
+  const { credentials } = req.body;
+
+  if (!Array.isArray(credentials) || credentials.length === 0) {
+    return res.status(400).json({ error: 'Missing credentials'});
+  }
+  if (credentials.length > VERIFY_BATCH_SIZE) {
+    return res.status(413).json({ error: `At most ${VERIFY_BATCH_SIZE} credentials per call`});
+  }
+
+  const results = await Promise.all(credentials.map(async (credential) => {
+    try {
+      const result = await agent.verifyCredentialEIP712({ credential });
+      return { verified: result, issuer: credential.issuer };
+    } catch (err) {
+      console.error('Credential verification failed:', err);
+      return { verified: false, issuer: credential?.issuer ?? null, error: 'Credential could not be verified' };
+    }
+  }));
+
+  res.status(200).json({ results });
+});
+
 // Start server
 const PORT = 3003
 app.listen(PORT, () => console.log(`Listening on port ${PORT}`))